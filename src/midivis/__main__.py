@@ -3,29 +3,364 @@ from pathlib import Path
 import typer
 from typing_extensions import Annotated
 
-from midivis.analyse import analyse_files
+from midivis import tracing
+from midivis.analyse import analyse_files, print_report
+from midivis.bench import run_bench
+from midivis.export import ExportFormat, export_files
+from midivis.frames import render_files
+from midivis.layout import Layout, default_layout, load_layout
+from midivis.library import init_db
+from midivis.live import VIRTUAL_PORT_NAME, run_live
+from midivis.outputs import RELAY_PORT, OutputOptions, TerminalRenderer
+from midivis.palette import PaletteName, get_palette
 from midivis.play import play_many
-from midivis.utils import set_verbosity
+from midivis.render import DEFAULT_MAX_FPS
+from midivis.utils import log, set_verbosity
+from midivis.wled import HOST
+from midivis.wled_realtime import DRGB_MAX_LEDS, WLEDProtocol
 
 app = typer.Typer()
 
+# Options shared by the commands that show a visualisation
+Verbosity = Annotated[int, typer.Option("--verbose", "-v", count=True)]
+MaxFps = Annotated[float, typer.Option("--fps", min=1)]
+WLEDOption = Annotated[
+    WLEDProtocol | None,
+    typer.Option(
+        help="Output to WLED using this API (instead of the terminal, unless"
+        " --terminal)"
+    ),
+]
+WLEDHostOption = Annotated[str, typer.Option()]
+LayoutOption = Annotated[
+    Path | None,
+    typer.Option(
+        help="A TOML file describing how the LED panels are arranged and wired"
+        " [default: one 100x16 panel, row by row]",
+        exists=True,
+        dir_okay=False,
+    ),
+]
+TerminalOption = Annotated[
+    bool | None,
+    typer.Option(
+        "--terminal/--no-terminal",
+        help="Show the visualisation in the terminal [default: unless --wled]",
+    ),
+]
+RendererOption = Annotated[
+    TerminalRenderer,
+    typer.Option(
+        help="How to draw in the terminal: ansi uses far less CPU, but needs"
+        " a 24-bit colour terminal"
+    ),
+]
+PaletteOption = Annotated[
+    PaletteName | None,
+    typer.Option(help="How to colour the notes [default: hue]"),
+]
+RecordOption = Annotated[
+    Path | None,
+    typer.Option(
+        help="Record what was played to a MIDI file in this directory",
+        exists=True,
+        file_okay=False,
+    ),
+]
+RelayOption = Annotated[
+    str | None,
+    typer.Option(
+        metavar="HOST[:PORT]",
+        help=f"Forward what was played to this host over UDP [default port: {RELAY_PORT}]",
+    ),
+]
+ProfileOption = Annotated[
+    bool, typer.Option(help="Time each stage, and print a summary at the end")
+]
+
+
+def _check_wled_layout(wled: WLEDProtocol | None, layout: Layout | None) -> None:
+    """Checks that the layout fits in what `wled` can send."""
+    if layout is None:
+        layout = default_layout()
+    if wled == WLEDProtocol.DRGB and layout.num_leds > DRGB_MAX_LEDS:
+        raise typer.BadParameter(
+            f"DRGB supports at most {DRGB_MAX_LEDS} LEDs, but the layout has"
+            f" {layout.num_leds}; use DNRGB or DDP"
+        )
+
+
+def _output_options(
+    max_fps: float,
+    wled: WLEDProtocol | None,
+    wled_host: str,
+    layout: Path | None,
+    terminal: bool | None,
+    renderer: TerminalRenderer,
+    palette: PaletteName | None,
+    record: Path | None,
+    relay: str | None,
+) -> OutputOptions:
+    """Checks the shared output options, and gathers them up."""
+    if layout is not None and wled is None:
+        raise typer.BadParameter("--layout needs --wled")
+    try:
+        wled_layout = None if layout is None else load_layout(layout)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    _check_wled_layout(wled, wled_layout)
+
+    relay_host, relay_port = None, RELAY_PORT
+    if relay is not None:
+        relay_host, _, port = relay.partition(":")
+        try:
+            relay_port = int(port) if port else RELAY_PORT
+        except ValueError:
+            raise typer.BadParameter(f"Invalid relay port: {port}")
+
+    show_terminal = wled is None if terminal is None else terminal
+    return OutputOptions(
+        terminal=renderer if show_terminal else None,
+        max_fps=max_fps,
+        wled_protocol=wled,
+        wled_host=wled_host,
+        layout=wled_layout,
+        palette=None if palette is None else get_palette(palette),
+        record_dir=record,
+        relay_host=relay_host,
+        relay_port=relay_port,
+    )
+
 
 @app.command()
 def play(
     files: Annotated[list[Path], typer.Argument(exists=True, dir_okay=False)],
-    verbosity: Annotated[int, typer.Option("--verbose", "-v", count=True)] = 0,
+    verbosity: Verbosity = 0,
+    max_fps: MaxFps = DEFAULT_MAX_FPS,
+    wled: WLEDOption = None,
+    wled_host: WLEDHostOption = HOST,
+    layout: LayoutOption = None,
+    prerendered: Annotated[
+        bool,
+        typer.Option(
+            help="Stream frames from `midivis render` to WLED, rendering any"
+            " that are missing"
+        ),
+    ] = False,
+    start: Annotated[
+        float,
+        typer.Option(min=0, help="Start this many seconds into the first file"),
+    ] = 0.0,
+    terminal: TerminalOption = None,
+    renderer: RendererOption = TerminalRenderer.RICH,
+    palette: PaletteOption = None,
+    record: RecordOption = None,
+    relay: RelayOption = None,
+    profile: ProfileOption = False,
+    trace: Annotated[
+        Path | None,
+        typer.Option(
+            help="With --profile, also write a Chrome trace (for chrome://tracing"
+            " or Perfetto) here",
+            dir_okay=False,
+        ),
+    ] = None,
 ) -> None:
     set_verbosity(verbosity)
-    play_many(files)
+    if prerendered and wled is None:
+        raise typer.BadParameter("--prerendered needs --wled")
+    if prerendered and (
+        terminal or record is not None or relay is not None or palette is not None
+    ):
+        raise typer.BadParameter(
+            "--prerendered can't be combined with --terminal, --palette, --record"
+            " or --relay"
+        )
+    if trace is not None and not profile:
+        raise typer.BadParameter("--trace needs --profile")
+
+    options = _output_options(
+        max_fps, wled, wled_host, layout, terminal, renderer, palette, record, relay
+    )
+
+    profiler = tracing.enable(trace=trace is not None) if profile else None
+    try:
+        play_many(files, options=options, prerendered=prerendered, start_secs=start)
+    finally:
+        if profiler is not None:
+            log(0, profiler.summary())
+            if trace is not None:
+                profiler.write_trace(trace)
+                log(0, f"Wrote trace to {trace}")
+
+
+@app.command()
+def live(
+    port: Annotated[
+        str | None,
+        typer.Argument(help="The input port to listen to [default: the first one]"),
+    ] = None,
+    verbosity: Verbosity = 0,
+    virtual: Annotated[
+        bool,
+        typer.Option(
+            help=f"Create an input port (named {VIRTUAL_PORT_NAME}, unless PORT is"
+            " given) for other programs to connect to"
+        ),
+    ] = False,
+    replay: Annotated[
+        Path | None,
+        typer.Option(
+            help="Play this MIDI file as though it were being played live, instead"
+            " of listening to a port",
+            exists=True,
+            dir_okay=False,
+        ),
+    ] = None,
+    thru: Annotated[
+        bool, typer.Option(help="Send what's received on to the synth")
+    ] = False,
+    max_fps: MaxFps = DEFAULT_MAX_FPS,
+    wled: WLEDOption = None,
+    wled_host: WLEDHostOption = HOST,
+    layout: LayoutOption = None,
+    terminal: TerminalOption = None,
+    renderer: RendererOption = TerminalRenderer.RICH,
+    palette: PaletteOption = None,
+    record: RecordOption = None,
+    relay: RelayOption = None,
+    profile: ProfileOption = False,
+) -> None:
+    """
+    Visualise a live MIDI input, eg a keyboard or a DAW, then report the latency
+    from input to each output.
+    """
+    set_verbosity(verbosity)
+    if replay is not None and (port is not None or virtual):
+        raise typer.BadParameter("--replay can't be combined with PORT or --virtual")
+
+    options = _output_options(
+        max_fps, wled, wled_host, layout, terminal, renderer, palette, record, relay
+    )
+
+    profiler = tracing.enable() if profile else None
+    try:
+        run_live(name=port, virtual=virtual, replay=replay, thru=thru, options=options)
+    finally:
+        if profiler is not None:
+            log(0, profiler.summary())
+
+
+@app.command()
+def render(
+    files: Annotated[list[Path], typer.Argument(exists=True, dir_okay=False)],
+    verbosity: Verbosity = 0,
+    fps: Annotated[float, typer.Option(min=1)] = DEFAULT_MAX_FPS,
+) -> None:
+    set_verbosity(verbosity)
+    render_files(files, fps=fps)
+
+
+@app.command()
+def export(
+    files: Annotated[list[Path], typer.Argument(exists=True, dir_okay=False)],
+    output: Annotated[
+        Path,
+        typer.Option(
+            "--output", "-o", help="Write the frames to this directory", file_okay=False
+        ),
+    ],
+    verbosity: Verbosity = 0,
+    fps: Annotated[float, typer.Option(min=1)] = DEFAULT_MAX_FPS,
+    export_format: Annotated[
+        ExportFormat,
+        typer.Option(
+            "--format",
+            help="raw writes every frame to one .rgb file (eg for ffmpeg); png"
+            " writes a directory of numbered PNGs",
+        ),
+    ] = ExportFormat.PNG,
+    scale: Annotated[
+        int, typer.Option(min=1, help="Draw each LED as a square of this many pixels")
+    ] = 1,
+    layout: LayoutOption = None,
+    palette: Annotated[
+        PaletteName, typer.Option(help="How to colour the notes")
+    ] = PaletteName.HUE,
+    workers: Annotated[
+        int | None,
+        typer.Option(min=1, help="Worker processes [default: one per CPU]"),
+    ] = None,
+) -> None:
+    """
+    Export the visualisation of each file as frames of the LED wall, much faster
+    than real time. The same file always gives identical frames.
+    """
+    set_verbosity(verbosity)
+    try:
+        wall_layout = None if layout is None else load_layout(layout)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    export_files(
+        files,
+        output,
+        fps=fps,
+        export_format=export_format,
+        layout=wall_layout,
+        palette=palette,
+        scale=scale,
+        workers=workers,
+    )
 
 
 @app.command()
 def analyse(
     base_path: Annotated[Path, typer.Argument(exists=True, dir_okay=True)],
-    verbosity: Annotated[int, typer.Option("--verbose", "-v", count=True)] = 0,
+    verbosity: Verbosity = 0,
+    workers: Annotated[
+        int | None,
+        typer.Option(min=1, help="Worker processes [default: one per CPU]"),
+    ] = None,
+) -> None:
+    set_verbosity(verbosity)
+    analyse_files(base_path=base_path, workers=workers)
+
+
+@app.command()
+def report() -> None:
+    conn = init_db()
+    try:
+        print_report(conn)
+    finally:
+        conn.close()
+
+
+@app.command()
+def bench(
+    paths: Annotated[list[Path], typer.Argument(exists=True)],
+    verbosity: Verbosity = 0,
+    fps: Annotated[float, typer.Option(min=1)] = DEFAULT_MAX_FPS,
+    wled: Annotated[
+        WLEDProtocol, typer.Option(help="Encode WLED frames for this API")
+    ] = WLEDProtocol.JSON,
+    trace_memory: Annotated[
+        bool,
+        typer.Option(help="Trace peak memory use (which slows everything down)"),
+    ] = False,
+    output: Annotated[
+        Path | None, typer.Option(help="Write the JSON report here, not stdout")
+    ] = None,
 ) -> None:
     set_verbosity(verbosity)
-    analyse_files(base_path=base_path)
+    _check_wled_layout(wled, None)
+    run_bench(
+        paths,
+        fps=fps,
+        protocol=wled,
+        trace_memory=trace_memory,
+        output=output,
+    )
 
 
 if __name__ == "__main__":
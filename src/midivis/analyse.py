@@ -1,20 +1,189 @@
-import hashlib
 import sqlite3
 import sys
 from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import timedelta
 from pathlib import Path
 from time import monotonic
 
 from mido import MidiFile
+from rich.progress import (
+    BarColumn,
+    MofNCompleteColumn,
+    Progress,
+    TextColumn,
+    TimeElapsedColumn,
+)
 
+from midivis.cache import cache_path, content_hash, read_timeline
+from midivis.library import (
+    ANALYSIS_VERSION,
+    CHANNELS,
+    NOTES,
+    PROGRAMS,
+    histograms,
+    init_db,
+    replace_counts,
+)
+from midivis.smf import SMFError, SMFSummary, map_file, scan_smf, scan_smf_file
+from midivis.timeline import NOTE_ON, PROGRAM_CHANGE, Timeline
+from midivis.utils import get_console
 
-def analyse_files(base_path: Path) -> None:
-    notes: Counter[int] = Counter()
-    note_ranges: Counter[int] = Counter()
-    channels: Counter[int] = Counter()
-    programs: Counter[int] = Counter()
+# How many rows to insert per transaction
+BATCH_SIZE = 500
 
+# How many files to hand to a worker process at a time
+CHUNK_SIZE = 16
+
+
+@dataclass
+class FileStats:
+    """
+    Everything we extract from a single MIDI file.
+    """
+
+    relative_path: str
+    file_name: str
+    file_size_bytes: int
+    file_mtime_ns: int
+    file_hash_blake2b: str = ""
+    error: str | None = None
+    runtime_secs: float | None = None
+    note_count: int = 0
+    note_max: int | None = None
+    note_min: int | None = None
+    # note_on events per note and per channel, and program_change events per
+    # program
+    notes: Counter[int] = field(default_factory=Counter)
+    channels: Counter[int] = field(default_factory=Counter)
+    programs: Counter[int] = field(default_factory=Counter)
+
+    def row_params(self) -> dict[str, object]:
+        return {
+            "file_path": self.relative_path,
+            "file_name": self.file_name,
+            "file_size_bytes": self.file_size_bytes,
+            "file_mtime_ns": self.file_mtime_ns,
+            "file_hash_blake2b": self.file_hash_blake2b,
+            "runtime_secs": self.runtime_secs,
+            "channel_count": len(self.channels),
+            "note_count": self.note_count,
+            "program_count": len(self.programs),
+            "note_max": self.note_max,
+            "note_min": self.note_min,
+            "analysis_version": ANALYSIS_VERSION,
+        }
+
+
+def analyse_file(path: Path, base_path: Path) -> FileStats:
+    """
+    Hashes and parses a MIDI file. Runs in a worker process.
+
+    The file is only read once: it's hashed and scanned from the same mapping.
+    Files that have already been compiled for playback are read from the cache
+    instead.
+    """
+    stat = path.stat()
+    stats = FileStats(
+        relative_path=str(path.relative_to(base_path)),
+        file_name=path.stem,
+        file_size_bytes=stat.st_size,
+        file_mtime_ns=stat.st_mtime_ns,
+    )
+
+    with map_file(path) as data:
+        stats.file_hash_blake2b = content_hash(data)
+
+        timeline = read_timeline(cache_path(stats.file_hash_blake2b))
+        if timeline is not None:
+            _stats_from_timeline(stats, timeline)
+            return stats
+
+        try:
+            summary: SMFSummary | None = scan_smf(data)
+        except SMFError:
+            summary = None
+
+    if summary is not None:
+        _stats_from_smf(stats, summary)
+    else:
+        # Let mido decide whether the file is really broken
+        try:
+            midi_file = MidiFile(str(path))
+        except Exception as e:
+            stats.error = f"{type(e).__name__}: {e}"
+            return stats
+        _stats_from_mido(stats, midi_file)
+
+    return stats
+
+
+def _stats_from_smf(stats: FileStats, summary: SMFSummary) -> None:
+    stats.note_count = summary.note_count
+    stats.notes = _counter(summary.note_counts)
+    stats.channels = _counter(summary.channel_counts)
+    stats.programs = _counter(summary.program_counts)
+    stats.note_max = summary.note_max
+    stats.note_min = summary.note_min
+    stats.runtime_secs = summary.runtime_secs
+
+
+def _counter(counts: list[int]) -> Counter[int]:
+    return Counter({n: count for n, count in enumerate(counts) if count})
+
+
+def _stats_from_timeline(stats: FileStats, timeline: Timeline) -> None:
+    statuses = timeline.statuses
+    channels = timeline.channels
+    data1 = timeline.data1
+    for i in range(len(timeline)):
+        status = statuses[i]
+        if status == NOTE_ON:
+            stats.notes[data1[i]] += 1
+            stats.channels[channels[i]] += 1
+        elif status == PROGRAM_CHANGE:
+            stats.programs[data1[i]] += 1
+
+    stats.note_count = stats.notes.total()
+    if stats.notes:
+        stats.note_max = max(stats.notes)
+        stats.note_min = min(stats.notes)
+    stats.runtime_secs = timeline.length_secs
+
+
+def _stats_from_mido(stats: FileStats, midi_file: MidiFile) -> None:
+    max_note = -1
+    min_note = 256
+
+    for track in midi_file.tracks:
+        for message in track:
+            match message.type:
+                case "note_on":
+                    stats.note_count += 1
+                    stats.notes[message.note] += 1
+                    stats.channels[message.channel] += 1
+                    max_note = max(max_note, message.note)
+                    min_note = min(min_note, message.note)
+                case "program_change":
+                    stats.programs[message.program] += 1
+
+    if stats.note_count:
+        stats.note_max = max_note
+        stats.note_min = min_note
+
+    try:
+        stats.runtime_secs = midi_file.length
+    except ValueError:
+        stats.runtime_secs = None
+
+
+def _analyse_file(args: tuple[Path, Path]) -> FileStats:
+    return analyse_file(*args)
+
+
+def analyse_files(base_path: Path, workers: int | None = None) -> None:
     start = monotonic()
 
     paths = list(base_path.glob("**/*.mid", case_sensitive=False))
@@ -23,115 +192,179 @@ def analyse_files(base_path: Path) -> None:
 
     print(f"Globbed {len(paths)} files in {timedelta(seconds=monotonic() - start)}")
 
+    conn = init_db()
+
+    # Skip anything that hasn't changed since it was last analysed
+    known = {
+        file_path: (size, mtime_ns)
+        for file_path, size, mtime_ns in conn.execute(
+            "SELECT file_path, file_size_bytes, file_mtime_ns FROM tracks"
+            " WHERE analysis_version = ?",
+            (ANALYSIS_VERSION,),
+        )
+    }
+    todo = []
+    backfill_mtimes = []
+    for path in paths:
+        relative_path_str = str(path.relative_to(base_path))
+        if relative_path_str not in known:
+            todo.append(path)
+            continue
+        stat = path.stat()
+        size, mtime_ns = known[relative_path_str]
+        if size != stat.st_size or mtime_ns not in (None, stat.st_mtime_ns):
+            todo.append(path)
+        elif mtime_ns is None:
+            # Analysed before we recorded mtimes; assume it's unchanged
+            backfill_mtimes.append((stat.st_mtime_ns, relative_path_str))
+
+    with conn:
+        conn.executemany(
+            "UPDATE tracks SET file_mtime_ns = ? WHERE file_path = ?", backfill_mtimes
+        )
+
+    print(f"{len(paths) - len(todo)} files unchanged since they were last analysed")
+
     fails = 0
     n = 0
+    total_bytes = 0
 
-    conn = init_db()
-    cursor = conn.cursor()
+    # Tracks waiting to be inserted in the next transaction
+    batch: list[FileStats] = []
 
     try:
-        for n, path in enumerate(paths):
-            relative_path_str = str(path.relative_to(base_path))
-            if cursor.execute(
-                "select 1 from tracks where file_path = ?", (relative_path_str,)
-            ).fetchall():
-                print(f"Track already processed: {relative_path_str}")
-                continue
-            try:
-                midi_file = MidiFile(str(path))
-            except Exception:
-                print(f"Error opening {n} of {len(paths)} - {relative_path_str}")
-                fails += 1
-                continue
-
-            with open(path, "rb") as f:
-                file_hash = hashlib.file_digest(f, "blake2b")
-
-            this_channels = set()
-            this_programs = set()
-            note_count = 0
-            max_note = -1
-            min_note = 256
-
-            for i, track in enumerate(midi_file.tracks):
-                for message in track:
-                    match message.type:
-                        case "note_on":
-                            note_count += 1
-                            notes[message.note] += 1
-                            this_channels.add(message.channel)
-                            max_note = max(max_note, message.note)
-                            min_note = min(min_note, message.note)
-                        case "program_change":
-                            this_programs.add(message.program)
-
-            try:
-                runtime_secs = midi_file.length
-            except ValueError:
-                runtime_secs = None
-
-            row_params = {
-                "file_path": relative_path_str,
-                "file_name": path.stem,
-                "file_size_bytes": path.stat().st_size,
-                "file_hash_blake2b": file_hash.hexdigest(),
-                "runtime_secs": runtime_secs,
-                "channel_count": len(this_channels),
-                "note_count": note_count,
-                "program_count": len(this_programs),
-                "note_max": max_note if note_count else None,
-                "note_min": min_note if note_count else None,
-            }
-
-            cursor.execute(
-                """
-                INSERT INTO tracks (
-                    file_path,
-                    file_name,
-                    file_size_bytes,
-                    file_hash_blake2b,
-                    runtime_secs,
-                    channel_count,
-                    note_count,
-                    program_count,
-                    note_max,
-                    note_min
-                ) VALUES (
-                    :file_path,
-                    :file_name,
-                    :file_size_bytes,
-                    :file_hash_blake2b,
-                    :runtime_secs,
-                    :channel_count,
-                    :note_count,
-                    :program_count,
-                    :note_max,
-                    :note_min
+        with _progress() as progress:
+            task = progress.add_task("Analysing", total=len(todo), rate="")
+            for stats in _analyse_in_parallel(todo, base_path, workers):
+                n += 1
+                total_bytes += stats.file_size_bytes
+                elapsed = monotonic() - start
+                progress.update(
+                    task,
+                    completed=n,
+                    rate=f"{n / elapsed:.1f} files/s, "
+                    f"{total_bytes / elapsed / 1e6:.2f} MB/s",
                 )
-            """,
-                row_params,
-            )
-            conn.commit()
 
-            note_ranges[max_note - min_note if note_count else 0] += 1
-            channels.update(this_channels)
-            programs.update(this_programs)
+                if stats.error is not None:
+                    progress.console.print(
+                        f"Error opening {stats.relative_path}: {stats.error}"
+                    )
+                    fails += 1
+                    continue
+
+                batch.append(stats)
+                if len(batch) >= BATCH_SIZE:
+                    _insert_tracks(conn, batch)
+                    batch = []
     except KeyboardInterrupt:
         pass
+    finally:
+        _insert_tracks(conn, batch)
 
-    print("\nChannels")
-    draw_hist(channels)
-    print("\nNotes")
-    draw_hist(notes)
-    print("\nPrograms")
-    draw_hist(programs)
-    print("\nNote Ranges")
-    draw_hist(note_ranges)
+    print_report(conn)
+    conn.close()
 
     print(f"\n{fails} failed out of {n} processed")
     print(f"Total time: {timedelta(seconds=monotonic() - start)}")
 
 
+def _analyse_in_parallel(
+    paths: list[Path], base_path: Path, workers: int | None
+) -> Iterator[FileStats]:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            yield from executor.map(
+                _analyse_file,
+                ((path, base_path) for path in paths),
+                chunksize=CHUNK_SIZE,
+            )
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _insert_tracks(conn: sqlite3.Connection, batch: list[FileStats]) -> None:
+    """Inserts (or updates) tracks in a single transaction."""
+    track_ids = []
+    with conn:
+        for stats in batch:
+            (track_id,) = conn.execute(INSERT_TRACK, stats.row_params()).fetchone()
+            track_ids.append(track_id)
+
+        # Replace anything from when the tracks were last analysed
+        for counts, attr in (
+            (NOTES, "notes"),
+            (CHANNELS, "channels"),
+            (PROGRAMS, "programs"),
+        ):
+            replace_counts(
+                conn,
+                counts,
+                track_ids,
+                (
+                    (track_id, key, count)
+                    for track_id, stats in zip(track_ids, batch)
+                    for key, count in getattr(stats, attr).items()
+                ),
+            )
+
+
+def _progress() -> Progress:
+    return Progress(
+        TextColumn("{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+        TextColumn("{task.fields[rate]}"),
+        console=get_console(),
+    )
+
+
+def benchmark_scan(base_path: Path) -> None:
+    """
+    Compares the raw SMF scanner with parsing each file with mido, and checks
+    that they agree.
+    """
+    paths = sorted(base_path.glob("**/*.mid", case_sensitive=False))
+
+    smf_secs = mido_secs = 0.0
+    scanned = 0
+    for path in paths:
+        start = monotonic()
+        try:
+            summary = scan_smf_file(path)
+        except SMFError:
+            continue
+        smf_secs += monotonic() - start
+
+        start = monotonic()
+        midi_file = MidiFile(str(path))
+        mido_stats = FileStats(str(path), path.stem, 0, 0)
+        _stats_from_mido(mido_stats, midi_file)
+        mido_secs += monotonic() - start
+
+        smf_stats = FileStats(str(path), path.stem, 0, 0)
+        _stats_from_smf(smf_stats, summary)
+        if smf_stats.runtime_secs is not None and mido_stats.runtime_secs is not None:
+            assert abs(smf_stats.runtime_secs - mido_stats.runtime_secs) < 1e-6
+        smf_stats.runtime_secs = mido_stats.runtime_secs
+        assert smf_stats == mido_stats, path
+        scanned += 1
+
+    print(f"Scanned {scanned} of {len(paths)} files")
+    print(
+        f"mido: {mido_secs:.3f}s  smf: {smf_secs:.3f}s  ({mido_secs / smf_secs:.1f}x)"
+    )
+
+
+def print_report(conn: sqlite3.Connection) -> None:
+    """Prints histograms over the whole library."""
+    for title, histogram in histograms(conn).items():
+        print(f"\n{title}")
+        draw_hist(histogram)
+
+
 def draw_hist(data: Counter[int]) -> None:
     if not data:
         print("No data")
@@ -142,33 +375,54 @@ def draw_hist(data: Counter[int]) -> None:
         print(f"{i:3d} | {bar:80s} | {data[i]:6d}")
 
 
-def init_db() -> sqlite3.Connection:
-    con = sqlite3.connect("midi.db")
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS tracks (
-            track_id INTEGER PRIMARY KEY,
-            -- file info
-            file_path TEXT NOT NULL UNIQUE,
-            file_name TEXT NOT NULL,
-            file_size_bytes INTEGER NOT NULL,
-            file_hash_blake2b TEXT NOT NULL,
-            -- track info
-            runtime_secs REAL,  -- NULLable because Mido says asynchronous midi files have no defined runtime
-            channel_count INTEGER NOT NULL,
-            note_count INTEGER NOT NULL,
-            program_count INTEGER NOT NULL,
-            note_max INTEGER,
-            note_min INTEGER
-        )
-    """)
-
-    return con
+INSERT_TRACK = """
+    INSERT INTO tracks (
+        file_path,
+        file_name,
+        file_size_bytes,
+        file_mtime_ns,
+        file_hash_blake2b,
+        runtime_secs,
+        channel_count,
+        note_count,
+        program_count,
+        note_max,
+        note_min,
+        analysis_version
+    ) VALUES (
+        :file_path,
+        :file_name,
+        :file_size_bytes,
+        :file_mtime_ns,
+        :file_hash_blake2b,
+        :runtime_secs,
+        :channel_count,
+        :note_count,
+        :program_count,
+        :note_max,
+        :note_min,
+        :analysis_version
+    )
+    ON CONFLICT (file_path) DO UPDATE SET
+        file_name = excluded.file_name,
+        file_size_bytes = excluded.file_size_bytes,
+        file_mtime_ns = excluded.file_mtime_ns,
+        file_hash_blake2b = excluded.file_hash_blake2b,
+        runtime_secs = excluded.runtime_secs,
+        channel_count = excluded.channel_count,
+        note_count = excluded.note_count,
+        program_count = excluded.program_count,
+        note_max = excluded.note_max,
+        note_min = excluded.note_min,
+        analysis_version = excluded.analysis_version
+    RETURNING track_id
+"""
 
 
 def main() -> None:
     base_path = sys.argv[1] if len(sys.argv) >= 2 else "."
     analyse_files(Path(base_path))
+    # benchmark_scan(Path(base_path))
 
 
 if __name__ == "__main__":
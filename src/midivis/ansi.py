@@ -0,0 +1,132 @@
+"""
+Renders the display straight to ANSI escape codes, for slow devices
+
+This draws the same panel as `display.to_panel`, without building a rich
+`Style`, `Color` and `Text` for every cell, or having rich measure and segment
+the whole panel each frame.
+"""
+
+import itertools
+
+from midivis.display import (
+    EMPTY_RECTANGLE,
+    FILLED_RECTANGLE,
+    RGB,
+    Display,
+    progress_text,
+)
+from midivis.midi_metadata import NOTES_PER_CHANNEL, NUM_CHANNELS
+
+CSI = "\x1b["
+
+# Switches to (and back from) the alternate screen, hiding the cursor meanwhile
+ENTER_SCREEN = f"{CSI}?1049h{CSI}?25l{CSI}2J"
+LEAVE_SCREEN = f"{CSI}0m{CSI}?25h{CSI}?1049l"
+
+RESET = f"{CSI}0m"
+BACKGROUND = f"{CSI}48;2;0;0;0m"
+# The border, and empty cells
+DIM = f"{CSI}38;2;32;32;32m"
+# The title and progress, in the terminal's own white, as rich uses
+WHITE = f"{CSI}37m"
+
+BLACK = b"\0\0\0"
+
+
+def _move_to(line: int, column: int) -> str:
+    """Moves the cursor, to 1-based coordinates."""
+    return f"{CSI}{line};{column}H"
+
+
+class AnsiRenderer:
+    """
+    Renders a `Display` like `to_panel`, as ANSI escape codes, at the top left
+    of the screen.
+
+    The first render draws the whole panel; after that, only the rows that
+    changed (and the progress, once a second) are redrawn, in place. Each
+    colour's escape code is built once, and runs of cells of the same colour
+    share it.
+    """
+
+    def __init__(
+        self, display: Display, lower_limit: int = 0, note_range: int = 100
+    ) -> None:
+        self._display = display
+        self._lower_limit = max(0, lower_limit)
+        self._upper_limit = min(NOTES_PER_CHANNEL, self._lower_limit + note_range)
+        self._changes = display.track_changes()
+        self._styles: dict[bytes, str] = {BLACK: DIM}
+        self._drawn = False
+        self._subtitle = ""
+
+        # The width inside the border
+        self._inner_width = self._upper_limit - self._lower_limit + 2
+
+    def render(self) -> str:
+        """Returns the escape codes to bring the screen up to date."""
+        if not self._drawn:
+            self._drawn = True
+            self._changes.drain()
+            return self._draw_all()
+
+        parts = []
+        channels = set()
+        for cell in self._changes.drain():
+            channel, note = divmod(cell, NOTES_PER_CHANNEL)
+            if self._lower_limit <= note < self._upper_limit:
+                channels.add(channel)
+        for channel in sorted(channels):
+            parts.append(_move_to(channel + 2, 3))
+            parts.append(self._row(channel))
+
+        subtitle = progress_text(self._display)
+        if subtitle != self._subtitle:
+            parts.append(_move_to(NUM_CHANNELS + 2, 1))
+            parts.append(self._bottom(subtitle))
+
+        return "".join(parts)
+
+    def _draw_all(self) -> str:
+        parts = [_move_to(1, 1), self._top()]
+        for channel in range(NUM_CHANNELS):
+            parts.append(_move_to(channel + 2, 1))
+            parts.append(f"{BACKGROUND}{DIM}│ ")
+            parts.append(self._row(channel))
+            parts.append(f"{BACKGROUND}{DIM} │{RESET}")
+        parts.append(_move_to(NUM_CHANNELS + 2, 1))
+        parts.append(self._bottom(progress_text(self._display)))
+        return "".join(parts)
+
+    def _row(self, channel: int) -> str:
+        styles = self._styles
+        row = channel * NOTES_PER_CHANNEL
+        colors = self._display.colors[
+            (row + self._lower_limit) * RGB : (row + self._upper_limit) * RGB
+        ].tobytes()
+
+        parts = [BACKGROUND]
+        cells = (colors[i : i + RGB] for i in range(0, len(colors), RGB))
+        for color, run in itertools.groupby(cells):
+            style = styles.get(color)
+            if style is None:
+                r, g, b = color
+                style = styles[color] = f"{CSI}38;2;{r};{g};{b}m"
+            glyph = EMPTY_RECTANGLE if color == BLACK else FILLED_RECTANGLE
+            parts.append(style)
+            parts.append(glyph * sum(1 for _ in run))
+        parts.append(RESET)
+        return "".join(parts)
+
+    def _top(self) -> str:
+        title = self._display.title[: self._inner_width - 4]
+        left = (self._inner_width - len(title) - 2) // 2
+        right = self._inner_width - len(title) - 2 - left
+        return (
+            f"{BACKGROUND}{DIM}╭{'─' * left} {WHITE}{title}{DIM} {'─' * right}╮{RESET}"
+        )
+
+    def _bottom(self, subtitle: str) -> str:
+        self._subtitle = subtitle
+        left = self._inner_width - len(subtitle) - 3
+        return f"{BACKGROUND}{DIM}╰{'─' * left} {WHITE}{subtitle}{DIM} ─╯{RESET}"
@@ -0,0 +1,337 @@
+"""
+Headless benchmarks of the playback and visualisation pipeline
+
+Everything runs as fast as possible, against a virtual clock and stand-ins for
+the synth and WLED, so no hardware (or TiMidity) is needed.
+"""
+
+import asyncio
+import gc
+import importlib.metadata
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Collection, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from mido import Message
+from rich.console import Console
+
+from midivis.ansi import AnsiRenderer
+from midivis.bus import play_async
+from midivis.cache import read_timeline, write_timeline
+from midivis.display import Display, PanelRenderer
+from midivis.frames import render_frames, sample_frames
+from midivis.layout import default_layout
+from midivis.render import DEFAULT_MAX_FPS
+from midivis.scheduler import VirtualClock
+from midivis.timeline import Timeline, load_timeline
+from midivis.tracing import TimingStats
+from midivis.utils import log
+from midivis.wled import ClientStats, leds_changed_state
+from midivis.wled_realtime import WLEDProtocol, WLEDRealtimeClient
+
+# Wide enough that rich doesn't wrap the panel
+CONSOLE_WIDTH = 200
+
+
+class RecordingPort:
+    """
+    Stands in for a synth port, counting (and optionally keeping) the messages
+    sent to it.
+    """
+
+    def __init__(self, record: bool = False) -> None:
+        self.messages: list[Message] = []
+        self.num_sent = 0
+        self._record = record
+
+    def send(self, message: Message) -> None:
+        self.num_sent += 1
+        if self._record:
+            self.messages.append(message)
+
+
+class RecordingWLEDClient:
+    """
+    Stands in for a WLED client. Frames are encoded for `protocol` exactly as
+    the real client would, but nothing is sent.
+    """
+
+    def __init__(self, protocol: WLEDProtocol = WLEDProtocol.JSON) -> None:
+        self._realtime = (
+            None if protocol == WLEDProtocol.JSON else WLEDRealtimeClient(protocol)
+        )
+        self.payload_bytes = 0
+        self.stats = ClientStats()
+
+    def __enter__(self) -> "RecordingWLEDClient":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._realtime is not None:
+            self._realtime.close()
+
+    def submit_frame(
+        self, buffer: bytes | memoryview, changed: Collection[int] | None = None
+    ) -> None:
+        if self._realtime is None:
+            payload = json.dumps(leds_changed_state(bytes(buffer), changed))
+            self.payload_bytes += len(payload)
+        else:
+            for packet in self._realtime.packets(buffer, changed):
+                self.payload_bytes += len(packet)
+        self.stats.sent += 1
+
+
+@dataclass
+class StageStats:
+    events: int = 0
+    frames: int = 0
+    secs: float = 0.0
+
+    # Bytes of output, eg WLED payloads
+    output_bytes: int = 0
+
+    # How long each unit of work (a group of events, or a frame) took
+    latency: TimingStats = field(default_factory=TimingStats)
+
+    # Memory blocks allocated during the stage and still allocated at the end,
+    # from `sys.getallocatedblocks`
+    allocated_blocks: int = 0
+
+    # Peak traced memory, only measured with `trace_memory`
+    peak_memory_bytes: int = 0
+
+    # Garbage collector runs during the stage
+    gc_collections: int = 0
+
+    def to_json(self) -> dict[str, Any]:
+        result: dict[str, Any] = {
+            "events": self.events,
+            "frames": self.frames,
+            "secs": round(self.secs, 6),
+        }
+        if self.secs > 0:
+            if self.events:
+                result["events_per_sec"] = round(self.events / self.secs)
+            if self.frames:
+                result["frames_per_sec"] = round(self.frames / self.secs, 1)
+        if self.output_bytes:
+            result["output_bytes"] = self.output_bytes
+        if len(self.latency):
+            result["latency"] = {
+                key: round(value, 4) for key, value in self.latency.summary().items()
+            }
+        result["allocated_blocks"] = self.allocated_blocks
+        result["peak_memory_bytes"] = self.peak_memory_bytes
+        result["gc_collections"] = self.gc_collections
+        return result
+
+
+class Bench:
+    """
+    Replays MIDI files through each stage of the pipeline, collecting stats per
+    stage across all of the files.
+    """
+
+    def __init__(
+        self,
+        fps: float = DEFAULT_MAX_FPS,
+        protocol: WLEDProtocol = WLEDProtocol.JSON,
+        trace_memory: bool = False,
+    ) -> None:
+        self._fps = fps
+        self._protocol = protocol
+        self._trace_memory = trace_memory
+        self.stages: dict[str, StageStats] = {}
+        self.files = 0
+        self.failures: dict[str, str] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        """Times the body, adding to the totals for the `name` stage."""
+        stats = self.stages.setdefault(name, StageStats())
+        if self._trace_memory:
+            tracemalloc.start()
+        collections = sum(s["collections"] for s in gc.get_stats())
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.secs += time.perf_counter() - start
+            stats.allocated_blocks += sys.getallocatedblocks() - blocks
+            stats.gc_collections += (
+                sum(s["collections"] for s in gc.get_stats()) - collections
+            )
+            if self._trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stats.peak_memory_bytes = max(stats.peak_memory_bytes, peak)
+
+    def run_file(self, path: Path) -> None:
+        try:
+            with self.stage("load") as stats:
+                timeline = load_timeline(path)
+                stats.events += len(timeline)
+        except Exception as e:
+            self.failures[str(path)] = f"{type(e).__name__}: {e}"
+            return
+
+        self.files += 1
+        self._cache(timeline)
+        self._schedule(timeline)
+        self._visualise(timeline)
+        self._prerender(timeline)
+
+    def _cache(self, timeline: Timeline) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "bench.timeline"
+            write_timeline(path, timeline)
+            with self.stage("load_cached") as stats:
+                cached = read_timeline(path)
+                assert cached is not None
+                stats.events += len(cached)
+
+    def _schedule(self, timeline: Timeline) -> None:
+        """Plays the timeline through `play_async`, to a recording port."""
+        synth_port = RecordingPort()
+
+        async def play() -> None:
+            async for _ in play_async(
+                timeline, synth_port=synth_port, clock=VirtualClock()
+            ):
+                pass
+
+        with self.stage("schedule") as stats:
+            asyncio.run(play())
+            stats.events += synth_port.num_sent
+
+    def _visualise(self, timeline: Timeline) -> None:
+        """
+        Applies the timeline to a display, rendering a terminal frame and a
+        WLED frame at each frame tick in which something changed.
+        """
+        display = Display(
+            title="bench", duration_secs=timeline.length_secs, progress_secs=0.0
+        )
+        panel_renderer = PanelRenderer(display, with_instruments=False)
+        ansi_renderer = AnsiRenderer(display)
+        changes = display.track_changes()
+        client = RecordingWLEDClient(self._protocol)
+        layout = default_layout()
+        display_stats = self.stages.setdefault("display", StageStats())
+
+        with open(os.devnull, "w") as devnull:
+            console = Console(
+                file=devnull,
+                width=CONSOLE_WIDTH,
+                force_terminal=True,
+                color_system="truecolor",
+            )
+
+            def output_frame() -> None:
+                with self.stage("terminal") as stats:
+                    start = time.perf_counter()
+                    console.print(panel_renderer.render())
+                    stats.latency.add(time.perf_counter() - start)
+                    stats.frames += 1
+                with self.stage("terminal_ansi") as stats:
+                    start = time.perf_counter()
+                    output = ansi_renderer.render()
+                    devnull.write(output)
+                    stats.latency.add(time.perf_counter() - start)
+                    stats.output_bytes += len(output)
+                    stats.frames += 1
+                with self.stage("wled") as stats:
+                    start = time.perf_counter()
+                    client.submit_frame(
+                        layout.leds(display.colors),
+                        layout.changed_leds(changes.drain()),
+                    )
+                    stats.latency.add(time.perf_counter() - start)
+                    stats.frames += 1
+
+            def apply_events(
+                timeline: Timeline, start: int, stop: int, time_secs: float
+            ) -> None:
+                with self.stage("display"):
+                    start_secs = time.perf_counter()
+                    display.apply_events(timeline, start, stop, time_secs)
+                    display_stats.latency.add(time.perf_counter() - start_secs)
+                display_stats.events += stop - start
+
+            for _ in sample_frames(timeline, apply_events, self._fps):
+                if changes:
+                    output_frame()
+
+        self.stages["wled"].output_bytes += client.payload_bytes
+
+    def _prerender(self, timeline: Timeline) -> None:
+        display = Display(
+            title="bench", duration_secs=timeline.length_secs, progress_secs=0.0
+        )
+        with self.stage("prerender") as stats:
+            for _ in render_frames(timeline, display, self._fps):
+                stats.frames += 1
+            stats.events += len(timeline)
+
+    def report(self) -> dict[str, Any]:
+        try:
+            version = importlib.metadata.version("midivis")
+        except importlib.metadata.PackageNotFoundError:
+            version = "unknown"
+        return {
+            "midivis": version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fps": self._fps,
+            "wled_protocol": str(self._protocol),
+            "trace_memory": self._trace_memory,
+            "files": self.files,
+            "failures": self.failures,
+            "stages": {name: stats.to_json() for name, stats in self.stages.items()},
+        }
+
+
+def midi_paths(paths: Iterable[Path]) -> list[Path]:
+    """Expands directories into the MIDI files inside them."""
+    found: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            found += path.glob("**/*.mid", case_sensitive=False)
+            found += path.glob("**/*.midi", case_sensitive=False)
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def run_bench(
+    paths: Iterable[Path],
+    fps: float = DEFAULT_MAX_FPS,
+    protocol: WLEDProtocol = WLEDProtocol.JSON,
+    trace_memory: bool = False,
+    output: Path | None = None,
+) -> None:
+    """Benchmarks every file, and writes the report as JSON."""
+    bench = Bench(fps=fps, protocol=protocol, trace_memory=trace_memory)
+    for path in midi_paths(paths):
+        log(1, f"Benchmarking {path}")
+        bench.run_file(path)
+
+    report = json.dumps(bench.report(), indent=2)
+    if output is None:
+        print(report)
+    else:
+        output.write_text(report + "\n")
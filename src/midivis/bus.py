@@ -0,0 +1,344 @@
+"""
+Fans a single playback stream out to any number of outputs
+
+`play_to` plays a timeline with one `Scheduler`, which sends to the synth on
+its own thread, and publishes each group of events as it's sent as a `Batch`.
+`publish` does the same for any stream of batches, eg `LiveBatch`es from a live
+input. Every subscriber has its own bounded queue, drained by its own task, so
+a slow subscriber only ever holds itself up.
+"""
+
+import asyncio
+import enum
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Iterator, Sequence
+from dataclasses import dataclass
+from typing import NamedTuple
+
+from mido import Message
+from mido.ports import BaseOutput
+
+from midivis import tracing
+from midivis.display import Display
+from midivis.scheduler import Clock, Scheduler
+from midivis.timeline import Timeline
+from midivis.utils import log
+
+# The longest that `play_async` waits before checking for sent groups
+MAX_POLL_SECS = 0.01
+
+DEFAULT_MAX_QUEUED = 64
+
+
+class Batch(NamedTuple):
+    """Events of a timeline that were played together"""
+
+    timeline: Timeline
+
+    # Event indices into the timeline
+    start: int
+    stop: int
+
+    # When the events were due, in seconds from the start of the file
+    time_secs: float
+
+    # Only live batches have an arrival time
+    received_at: None = None
+
+    def apply_to(self, display: Display) -> None:
+        display.apply_events(self.timeline, self.start, self.stop, self.time_secs)
+
+    def timed_messages(self) -> Iterator[tuple[float, Message]]:
+        """Yields each event as a message, with when it was due."""
+        times = self.timeline.times
+        messages = self.timeline.messages
+        for i in range(self.start, self.stop):
+            yield times[i], messages[i]
+
+    def timed_bytes(self) -> Iterator[tuple[float, bytes]]:
+        """Yields the raw MIDI bytes of each event, with when it was due."""
+        times = self.timeline.times
+        for i in range(self.start, self.stop):
+            yield times[i], self.timeline.event_bytes(i)
+
+
+class LiveBatch(NamedTuple):
+    """Messages from a live input that arrived together"""
+
+    messages: tuple[Message, ...]
+
+    # When each message arrived, in seconds from the start of the input
+    times: tuple[float, ...]
+
+    # When the last one arrived
+    time_secs: float
+
+    # When the first one arrived (from `time.perf_counter`), for measuring
+    # latency
+    received_at: float
+
+    def apply_to(self, display: Display) -> None:
+        display.apply_batch(self.messages, self.time_secs)
+
+    def timed_messages(self) -> Iterator[tuple[float, Message]]:
+        """Yields each message that a synth would play, with when it arrived."""
+        for time_secs, message in zip(self.times, self.messages):
+            if not message.is_meta:
+                yield time_secs, message
+
+    def timed_bytes(self) -> Iterator[tuple[float, bytes]]:
+        """Yields the raw MIDI bytes of each message, with when it arrived."""
+        for time_secs, message in self.timed_messages():
+            yield time_secs, bytes(message.bytes())
+
+
+AnyBatch = Batch | LiveBatch
+
+
+def _merge(older: AnyBatch, newer: AnyBatch) -> AnyBatch:
+    """Merges two consecutive batches from the same stream into one."""
+    if isinstance(older, Batch) and isinstance(newer, Batch):
+        return older._replace(stop=newer.stop, time_secs=newer.time_secs)
+    if isinstance(older, LiveBatch) and isinstance(newer, LiveBatch):
+        return older._replace(
+            messages=older.messages + newer.messages,
+            times=older.times + newer.times,
+            time_secs=newer.time_secs,
+        )
+    raise TypeError("Can't merge batches from different streams")
+
+
+class Policy(enum.Enum):
+    """What to do with a batch when a subscriber's queue is full"""
+
+    # Merge it into the newest queued batch. Batches are consecutive, and
+    # each event keeps its own time, so nothing is lost; it just arrives in
+    # fewer, bigger batches.
+    COALESCE = "coalesce"
+
+    # Drop the oldest queued batch, for subscribers that only care about what's
+    # happening now
+    DROP_OLDEST = "drop-oldest"
+
+
+@dataclass
+class QueueStats:
+    # Batches put on the queue
+    published: int = 0
+
+    # Batches merged into another because the queue was full
+    coalesced: int = 0
+
+    # Batches thrown away because the queue was full
+    dropped: int = 0
+
+    # The most batches that were waiting at once
+    max_depth: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.published} published, {self.coalesced} coalesced,"
+            f" {self.dropped} dropped, max depth {self.max_depth}"
+        )
+
+
+class BatchQueue:
+    """
+    A bounded queue of batches for one subscriber.
+
+    Putting never waits: when the queue is full, `policy` decides what gives.
+    """
+
+    def __init__(
+        self, max_queued: int = DEFAULT_MAX_QUEUED, policy: Policy = Policy.COALESCE
+    ) -> None:
+        if max_queued < 1:
+            raise ValueError("max_queued must be at least 1")
+        self._batches: deque[AnyBatch] = deque()
+        self._max_queued = max_queued
+        self._policy = policy
+        self._ready = asyncio.Event()
+        self._closed = False
+
+        self.stats = QueueStats()
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def put(self, batch: AnyBatch) -> None:
+        batches = self._batches
+        if len(batches) >= self._max_queued:
+            if self._policy == Policy.COALESCE:
+                batch = _merge(batches.pop(), batch)
+                self.stats.coalesced += 1
+            else:
+                batches.popleft()
+                self.stats.dropped += 1
+
+        batches.append(batch)
+        self.stats.published += 1
+        self.stats.max_depth = max(self.stats.max_depth, len(batches))
+        self._ready.set()
+
+    def close(self) -> None:
+        """Marks the end of the stream, once any queued batches are consumed."""
+        self._closed = True
+        self._ready.set()
+
+    async def get(self) -> AnyBatch | None:
+        """Waits for the next batch, returning `None` at the end of the stream."""
+        while not self._batches:
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._batches.popleft()
+
+
+async def play_async(
+    timeline: Timeline,
+    start_secs: float = 0.0,
+    synth_port: BaseOutput | None = None,
+    clock: Clock | None = None,
+) -> AsyncIterator[tuple[int, int, float]]:
+    """
+    Async generator that plays a compiled timeline in real time.
+
+    This is similar to `MidiFile.play()`, except that it:
+        - sends to `synth_port` from a dedicated `Scheduler` thread, so that
+          timing is not affected by whatever else the event loop is doing
+        - groups simultaneous messages together
+        - yields `(start, stop, progress_secs)` once each group has been sent,
+          where `start` and `stop` are event indices into `timeline`
+
+    Playback starts `start_secs` into the file. The display state at that point
+    can be found with `timeline.seek(start_secs).state`.
+    """
+    scheduler = Scheduler(
+        timeline, synth_port=synth_port, start_secs=start_secs, clock=clock
+    )
+    groups = scheduler.groups
+    times = timeline.times
+    num_events = len(timeline)
+    profiler = tracing.get_profiler()
+
+    # When the scheduler is next due to send something
+    next_secs = start_secs
+
+    scheduler.start()
+    try:
+        # Check `finished` first, so that we can't miss a final group
+        while not scheduler.finished or groups:
+            if not groups:
+                wait_secs = next_secs - scheduler.playback_secs()
+                await asyncio.sleep(min(max(wait_secs, 0.0), MAX_POLL_SECS))
+                continue
+
+            start, stop, progress_secs = groups.popleft()
+            if profiler is not None:
+                # How far the consumer has fallen behind the synth
+                profiler.record_lateness(
+                    "group consumed", scheduler.playback_secs() - progress_secs
+                )
+            next_secs = times[stop] if stop < num_events else timeline.length_secs
+            yield start, stop, progress_secs
+    finally:
+        scheduler.stop()
+
+    log(1, f"Timing error for {len(scheduler.stats)} groups: {scheduler.stats}")
+
+
+class Subscriber:
+    """
+    Consumes the batches played from a timeline (or received live), eg an
+    output.
+
+    `open` is called before playback starts, `handle` with each batch in order,
+    and `close` once playback ends (however it ends), if `open` succeeded.
+    """
+
+    name = "subscriber"
+    max_queued = DEFAULT_MAX_QUEUED
+    policy = Policy.COALESCE
+
+    async def open(self) -> None:
+        pass
+
+    async def handle(self, batch: AnyBatch) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+async def play_to(
+    timeline: Timeline,
+    subscribers: Sequence[Subscriber],
+    start_secs: float = 0.0,
+    synth_port: BaseOutput | None = None,
+    clock: Clock | None = None,
+) -> None:
+    """
+    Plays `timeline` to `synth_port`, publishing what was played to every
+    subscriber.
+
+    If a subscriber fails, playback carries on to the rest, and the error is
+    raised at the end.
+    """
+
+    async def batches() -> AsyncIterator[Batch]:
+        async for start, stop, time_secs in play_async(
+            timeline, start_secs=start_secs, synth_port=synth_port, clock=clock
+        ):
+            yield Batch(timeline, start, stop, time_secs)
+
+    await publish(batches(), subscribers)
+
+
+async def publish(
+    batches: AsyncIterable[AnyBatch], subscribers: Sequence[Subscriber]
+) -> None:
+    """
+    Publishes every batch to every subscriber, until `batches` ends.
+
+    If a subscriber fails, the rest carry on, and the error is raised at the
+    end.
+    """
+    opened: list[Subscriber] = []
+    try:
+        for subscriber in subscribers:
+            await subscriber.open()
+            opened.append(subscriber)
+
+        queues = [BatchQueue(s.max_queued, s.policy) for s in subscribers]
+        tasks = [
+            asyncio.create_task(_drain(subscriber, queue))
+            for subscriber, queue in zip(subscribers, queues)
+        ]
+        try:
+            async for batch in batches:
+                for queue, task in zip(queues, tasks):
+                    if not task.done():
+                        queue.put(batch)
+        finally:
+            for queue in queues:
+                queue.close()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        for subscriber, queue in zip(subscribers, queues):
+            log(1, f"{subscriber.name}: {queue.stats}")
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    finally:
+        for subscriber in reversed(opened):
+            await subscriber.close()
+
+
+async def _drain(subscriber: Subscriber, queue: BatchQueue) -> None:
+    try:
+        while (batch := await queue.get()) is not None:
+            await subscriber.handle(batch)
+    except Exception as e:
+        log(0, f"{subscriber.name} failed: {type(e).__name__}: {e}")
+        raise
@@ -0,0 +1,209 @@
+"""
+On-disk cache of compiled timelines, keyed by the hash of the MIDI file
+
+Cached timelines are memory-mapped, so loading one doesn't involve parsing
+anything, and identical files (wherever they are) share a single entry.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from pathlib import Path
+from typing import IO
+
+from midivis.timeline import ChannelState, Keyframe, Timeline, load_timeline
+from midivis.utils import log
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "midivis"
+    / "timelines"
+)
+
+MAGIC = b"MVTL"
+# Bump this whenever the format (or what gets compiled into it) changes
+VERSION = 1
+
+# magic, version, num_events, num_group_starts, num_keyframes, num_sysex,
+# length_secs. Everything uses native byte order, since the cache isn't shared
+# between machines.
+HEADER = struct.Struct("=4sIIIIId")
+
+# time_secs, event_index, padding
+KEYFRAME_HEADER = struct.Struct("=dII")
+
+# event index, length
+SYSEX_HEADER = struct.Struct("=II")
+
+STATE_SIZE = len(ChannelState().to_bytes())
+
+
+def file_hash(path: Path) -> str:
+    """Returns the blake2b hash of a file, as also stored by `midivis analyse`."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+def content_hash(data: bytes | mmap.mmap) -> str:
+    """Returns the same hash as `file_hash`, for a file that's already in memory."""
+    return hashlib.blake2b(data).hexdigest()
+
+
+def cache_path(content_hash: str) -> Path:
+    return CACHE_DIR / content_hash[:2] / f"{content_hash}.timeline"
+
+
+def load_cached_timeline(midi_path: Path) -> Timeline:
+    """
+    Returns the compiled timeline for a MIDI file, from the cache if possible.
+
+    Anything that isn't already cached is compiled and added to the cache.
+    """
+    path = cache_path(file_hash(midi_path))
+
+    timeline = read_timeline(path)
+    if timeline is not None:
+        log(1, f"Loaded {midi_path} from {path}")
+        return timeline
+
+    timeline = load_timeline(midi_path)
+    try:
+        write_timeline(path, timeline)
+    except OSError as e:
+        log(1, f"Unable to cache {midi_path}: {e}")
+    return timeline
+
+
+def read_timeline(path: Path) -> Timeline | None:
+    """
+    Memory-maps a cached timeline, or returns `None` if it isn't usable.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        return None
+
+    try:
+        return _from_buffer(data)
+    except (struct.error, ValueError, TypeError) as e:
+        log(1, f"Ignoring bad cache entry {path}: {e}")
+        return None
+
+
+def write_timeline(path: Path, timeline: Timeline) -> None:
+    """
+    Writes a timeline to `path`, atomically, so that concurrent readers never
+    see a partial file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        try:
+            _write(f, timeline)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def _write(f: IO[bytes], timeline: Timeline) -> None:
+    num_events = len(timeline)
+    f.write(
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            num_events,
+            len(timeline.group_starts),
+            len(timeline.keyframes),
+            len(timeline.sysex),
+            timeline.length_secs,
+        )
+    )
+
+    f.write(array("d", timeline.times))
+    for column in (
+        timeline.statuses,
+        timeline.channels,
+        timeline.data1,
+        timeline.data2,
+    ):
+        f.write(bytes(column))
+    _pad(f, 8)
+    f.write(array("I", timeline.group_starts))
+    _pad(f, 8)
+
+    for keyframe in timeline.keyframes:
+        f.write(KEYFRAME_HEADER.pack(keyframe.time_secs, keyframe.event_index, 0))
+        f.write(keyframe.state.to_bytes())
+
+    for index, data in sorted(timeline.sysex.items()):
+        f.write(SYSEX_HEADER.pack(index, len(data)))
+        f.write(data)
+
+
+def _pad(f: IO[bytes], alignment: int) -> None:
+    f.write(bytes(-f.tell() % alignment))
+
+
+def _from_buffer(data: memoryview) -> Timeline:
+    (
+        magic,
+        version,
+        num_events,
+        num_group_starts,
+        num_keyframes,
+        num_sysex,
+        length_secs,
+    ) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported format {magic!r} version {version}")
+
+    pos = HEADER.size
+
+    def take(size: int) -> memoryview:
+        nonlocal pos
+        section = data[pos : pos + size]
+        if len(section) != size:
+            raise ValueError("Truncated")
+        pos += size
+        return section
+
+    times = take(num_events * 8).cast("d")
+    statuses = take(num_events)
+    channels = take(num_events)
+    data1 = take(num_events)
+    data2 = take(num_events)
+    take(-pos % 8)
+    group_starts = take(num_group_starts * 4).cast("I")
+    take(-pos % 8)
+
+    keyframes = []
+    for _ in range(num_keyframes):
+        time_secs, event_index, _ = KEYFRAME_HEADER.unpack(take(KEYFRAME_HEADER.size))
+        keyframes.append(
+            Keyframe(
+                time_secs=time_secs,
+                event_index=event_index,
+                state=ChannelState.from_bytes(take(STATE_SIZE)),
+            )
+        )
+
+    sysex = {}
+    for _ in range(num_sysex):
+        index, length = SYSEX_HEADER.unpack(take(SYSEX_HEADER.size))
+        sysex[index] = bytes(take(length))
+
+    return Timeline(
+        times=times,
+        statuses=statuses,
+        channels=channels,
+        data1=data1,
+        data2=data2,
+        group_starts=group_starts,
+        sysex=sysex,
+        length_secs=length_secs,
+        keyframes=keyframes,
+    )
@@ -1,7 +1,8 @@
 import colorsys
-from dataclasses import dataclass, field
+import enum
+import weakref
+from collections.abc import Iterable
 from datetime import timedelta
-from itertools import islice
 
 from mido import Message
 from rich.color import Color
@@ -14,7 +15,9 @@ from midivis.midi_metadata import (
     NUM_CHANNELS,
     PERCUSSION_CHANNEL,
 )
-from midivis.wled import OFF, RGBColor
+from midivis.palette import LEVELS, PERCUSSION, Palette, get_palette
+from midivis.timeline import ChannelState, Timeline
+from midivis.wled import RGBColor
 
 
 def color_from_hsv(hue: float, saturation: float, value: float) -> Color:
@@ -28,22 +31,49 @@ FILLED_CIRCLE = "\u25cf"
 EMPTY_CIRCLE = "\u25cb"
 
 
-@dataclass
-class Channel:
+class Recolor(enum.Enum):
+    """What needs recoloring after applying a message"""
+
+    NONE = enum.auto()
+    NOTE = enum.auto()
+    CHANNEL = enum.auto()
+
+
+# Bytes per color in the color buffer
+RGB = 3
+
+# Volume before any control change. TODO: check if 100 is actually the default.
+DEFAULT_VOLUME = 100
+
+
+class DirtyCells:
     """
-    Maintains the current state of a single MIDI channel
+    Collects the cells of a `Display` whose colors have changed.
+
+    Cells are numbered `channel * NOTES_PER_CHANNEL + note` (0-based channel),
+    so a cell's color starts at `cell * RGB` in `Display.colors`.
     """
 
-    num: int
+    def __init__(self) -> None:
+        self._cells: set[int] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self._cells)
 
-    # Current instrument/voice
-    program: int = 0
+    def __len__(self) -> int:
+        return len(self._cells)
 
-    # Current volume. TODO: check if 100 is actually the default.
-    volume: int = 100
+    def mark(self, cells: Iterable[int]) -> None:
+        self._cells.update(cells)
 
-    # Notes and how loudly they are playing
-    velocities: bytearray = field(default_factory=lambda: bytearray(NOTES_PER_CHANNEL))
+    def mark_all(self) -> None:
+        self._cells.update(range(NUM_CHANNELS * NOTES_PER_CHANNEL))
+
+    def drain(self) -> set[int]:
+        """Returns the cells that have changed since the last drain."""
+        cells = self._cells
+        self._cells = set()
+        return cells
 
 
 class Display:
@@ -51,6 +81,14 @@ class Display:
     Tracks the current display state.
 
     Ingests MIDI messages and applies relevant changes.
+
+    The state is held in contiguous buffers: `velocities` is `NUM_CHANNELS` rows
+    of `NOTES_PER_CHANNEL` bytes, `programs` and `volumes` have a byte per
+    channel, and `colors` holds packed r, g, b bytes for every note of every
+    channel, in the same order as `velocities`.
+
+    Each consumer of the colors should call `track_changes` to find out which
+    cells have changed since it last looked.
     """
 
     def __init__(
@@ -58,15 +96,21 @@ class Display:
         title: str,
         duration_secs: float,
         progress_secs: float = 0.0,
+        palette: Palette | None = None,
     ) -> None:
         self._title = title
         self._duration_secs = duration_secs
         self._progress_secs = progress_secs
-        self._channels = [Channel(num=i + 1) for i in range(NUM_CHANNELS)]
 
-        self._needs_redraw = False
+        self._velocities = bytearray(NUM_CHANNELS * NOTES_PER_CHANNEL)
+        self._programs = bytearray(NUM_CHANNELS)
+        self._volumes = bytearray([DEFAULT_VOLUME] * NUM_CHANNELS)
+
+        self._generation = 0
+        self._trackers: weakref.WeakSet[DirtyCells] = weakref.WeakSet()
 
-        self._colors = [[OFF] * NOTES_PER_CHANNEL for _ in range(NUM_CHANNELS)]
+        self._colors = bytearray(NUM_CHANNELS * NOTES_PER_CHANNEL * RGB)
+        self._palette = palette if palette is not None else get_palette()
 
     @property
     def title(self) -> str:
@@ -81,64 +125,191 @@ class Display:
         return self._progress_secs
 
     @property
-    def needs_redraw(self) -> bool:
-        return self._needs_redraw
+    def generation(self) -> int:
+        """Incremented every time the colors change."""
+        return self._generation
+
+    def track_changes(self) -> DirtyCells:
+        """
+        Returns a new `DirtyCells` that will collect every subsequent change.
+
+        Everything is initially marked as changed, so that the first frame is
+        drawn in full. Tracking stops once the `DirtyCells` is garbage collected.
+        """
+        tracker = DirtyCells()
+        tracker.mark_all()
+        self._trackers.add(tracker)
+        return tracker
+
+    @property
+    def velocities(self) -> memoryview:
+        return memoryview(self._velocities).toreadonly()
+
+    @property
+    def programs(self) -> memoryview:
+        return memoryview(self._programs).toreadonly()
+
+    @property
+    def volumes(self) -> memoryview:
+        return memoryview(self._volumes).toreadonly()
 
     @property
-    def colors(self) -> list[list[RGBColor]]:
-        return self._colors
+    def colors(self) -> memoryview:
+        """A read-only view of the packed r, g, b color buffer."""
+        return memoryview(self._colors).toreadonly()
+
+    def color(self, channel: int, note: int) -> RGBColor:
+        """Returns the color of a note, with 0-based `channel`."""
+        i = (channel * NOTES_PER_CHANNEL + note) * RGB
+        return RGBColor(*self._colors[i : i + RGB])
 
     def update(self, message: Message, progress_secs: float) -> None:
         """
         Updates the internal state with the given MIDI message.
         """
+        self.apply_batch((message,), progress_secs)
+
+    def apply_batch(self, messages: Iterable[Message], progress_secs: float) -> None:
+        """
+        Updates the internal state with a group of simultaneous MIDI messages.
+
+        All the messages are applied first, then each affected channel is
+        recolored once, however many notes, controllers or programs changed.
+        Cells that end up unchanged, eg from a note on and off in the same
+        group, aren't reported as changed.
+        """
         self._progress_secs = progress_secs
-        match message.type:
-            case "note_on":
-                channel = self._channels[message.channel]
-                channel.velocities[message.note] = message.velocity
-                self.set_note_color(channel, message.note)
-
-            case "note_off":
-                channel = self._channels[message.channel]
-                channel.velocities[message.note] = 0
-                self.set_note_color(channel, message.note)
-
-            case "program_change":
-                channel = self._channels[message.channel]
-                channel.program = message.program
-                self.recolor_channel(channel)
-
-            case "control_change":
-                channel = self._channels[message.channel]
-                match message.control:
-                    case 7:
-                        channel.volume = message.value
-                        self.recolor_channel(channel)
 
-    def recolor_channel(self, channel: Channel) -> None:
-        for note in range(NOTES_PER_CHANNEL):
-            self.set_note_color(channel, note)
+        affected: dict[int, list[int] | None] = {}
+        for message in messages:
+            if message.is_meta or message.type == "sysex":
+                continue
+            data = message.bytes()
+            channel = data[0] & 0x0F
+            data1 = data[1] if len(data) > 1 else 0
+            match self._apply(
+                data[0] & 0xF0, channel, data1, data[2] if len(data) > 2 else 0
+            ):
+                case Recolor.NOTE:
+                    notes = affected.setdefault(channel, [])
+                    if notes is not None:
+                        notes.append(data1)
+                case Recolor.CHANNEL:
+                    affected[channel] = None
+
+        for channel, changed_notes in affected.items():
+            self.recolor_channel(channel, notes=changed_notes)
+
+    def apply_events(
+        self, timeline: Timeline, start: int, stop: int, progress_secs: float
+    ) -> None:
+        """
+        Updates the internal state with events `start` to `stop` of `timeline`,
+        like `apply_batch`.
+        """
+        self._progress_secs = progress_secs
+        statuses = timeline.statuses
+        channels = timeline.channels
+        data1 = timeline.data1
+        data2 = timeline.data2
+
+        # Notes that changed in each channel, or None to recolor every note
+        affected: dict[int, list[int] | None] = {}
+        for i in range(start, stop):
+            channel = channels[i]
+            match self._apply(statuses[i], channel, data1[i], data2[i]):
+                case Recolor.NOTE:
+                    notes = affected.setdefault(channel, [])
+                    if notes is not None:
+                        notes.append(data1[i])
+                case Recolor.CHANNEL:
+                    affected[channel] = None
+
+        for channel, changed_notes in affected.items():
+            self.recolor_channel(channel, notes=changed_notes)
+
+    def restore(self, state: ChannelState) -> None:
+        """
+        Replaces the internal state with a snapshot, eg after seeking.
+        """
+        self._velocities[:] = state.velocities
+        for channel in range(NUM_CHANNELS):
+            self._programs[channel] = state.program(channel)
+            self._volumes[channel] = state.controller(
+                channel, 7, default=DEFAULT_VOLUME
+            )
+            self.recolor_channel(channel)
+
+    def _apply(self, status: int, channel: int, data1: int, data2: int) -> Recolor:
+        """
+        Updates the state arrays, without recoloring.
+
+        Returns what needs to be recolored as a result.
+        """
+        match status:
+            case 0x90:  # note_on
+                self._velocities[channel * NOTES_PER_CHANNEL + data1] = data2
+                return Recolor.NOTE
 
-    def set_note_color(self, channel: Channel, note: int) -> None:
-        old_color = self._colors[channel.num - 1][note]
+            case 0x80:  # note_off
+                self._velocities[channel * NOTES_PER_CHANNEL + data1] = 0
+                return Recolor.NOTE
 
-        velocity = channel.velocities[note]
-        if channel.volume == 0 or velocity == 0:
-            new_color = OFF
+            case 0xC0:  # program_change
+                self._programs[channel] = data1
+                return Recolor.CHANNEL
 
-        else:
-            hue = channel.program / 0x7F  # Colour by instrument
-            sat = 0 if channel.num == PERCUSSION_CHANNEL else 1  # Make percussion white
+            case 0xB0:  # control_change
+                match data1:
+                    case 7:
+                        self._volumes[channel] = data2
+                        return Recolor.CHANNEL
 
-            volume_fraction = channel.volume / 0x7F
-            val = velocity / 0x7F * volume_fraction  # louder => brighter
+        return Recolor.NONE
 
-            new_color = RGBColor.from_hsv(hue, sat, val)
+    def recolor_channel(self, channel: int, notes: Iterable[int] | None = None) -> None:
+        """
+        Recolors every note of a (0-based) channel in one go.
 
-        if new_color != old_color:
-            self._colors[channel.num - 1][note] = new_color
-            self._needs_redraw = True
+        If only some notes' velocities have changed, passing them as `notes`
+        saves searching the whole channel for changed cells.
+        """
+        r, g, b = self._palette.ramp(
+            PERCUSSION if channel == PERCUSSION_CHANNEL - 1 else self._programs[channel]
+        )
+        start = channel * NOTES_PER_CHANNEL
+        levels = self._velocities[start : start + NOTES_PER_CHANNEL].translate(
+            LEVELS[self._volumes[channel]]
+        )
+
+        start *= RGB
+        stop = start + NOTES_PER_CHANNEL * RGB
+        old_colors = self._colors[start:stop]
+
+        self._colors[start:stop:RGB] = levels.translate(r)
+        self._colors[start + 1 : stop : RGB] = levels.translate(g)
+        self._colors[start + 2 : stop : RGB] = levels.translate(b)
+
+        new_colors = self._colors[start:stop]
+        if new_colors == old_colors:
+            return
+
+        self._generation += 1
+
+        if not self._trackers:
+            return
+
+        if notes is None:
+            notes = range(NOTES_PER_CHANNEL)
+        cell = channel * NOTES_PER_CHANNEL
+        changed = [
+            cell + note
+            for note in notes
+            if new_colors[note * RGB : (note + 1) * RGB]
+            != old_colors[note * RGB : (note + 1) * RGB]
+        ]
+        for tracker in self._trackers:
+            tracker.mark(changed)
 
 
 def to_panel(
@@ -153,47 +324,104 @@ def to_panel(
     lower_limit = max(0, lower_limit)
     upper_limit = min(NOTES_PER_CHANNEL, lower_limit + note_range)
 
-    text = Text()
+    colors = display.colors
+    rows = [
+        _row_text(colors, channel, lower_limit, upper_limit)
+        for channel in range(NUM_CHANNELS)
+    ]
 
-    for channel_num, colors in enumerate(display.colors, start=1):
-        notes: list[Text | str] = []
-
-        for color in islice(colors, lower_limit, upper_limit):
-            if color is not OFF:
-                style = Style(color=Color.from_rgb(*color))
-                notes.append(Text(FILLED_RECTANGLE, style=style))
-            else:
-                notes.append(EMPTY_RECTANGLE)
-                # notes.append(" ")
-
-        # TODO: fix this
-        # if with_instruments:
-        #     instrument_name = (
-        #         "Percussion"
-        #         if channel_num == PERCUSSION_CHANNEL
-        #         else PROGRAMS[channel.program + 1]
-        #     )
-        #     # text.append(f"Track {channel_num:02d}: ")
-        #     text.append(
-        #         f"vol:0x{channel.volume:02x}     {instrument_name}",
-        #         style=Style(color=color_from_hsv(hue, sat, max(0.2, max_val))),
-        #     )
-        #     text.append("\n")
-
-        for note in notes:
-            text.append(note)
-
-        text.append("\n")
-
-    text.remove_suffix("\n")
+    return _panel(display, rows)
 
-    duration_td = timedelta(seconds=int(display.duration_secs))
+
+class PanelRenderer:
+    """
+    Renders a `Display` like `to_panel`, but only rebuilds the rows that have
+    changed since the last render.
+    """
+
+    def __init__(
+        self,
+        display: Display,
+        with_instruments: bool = True,
+        lower_limit: int = 0,
+        note_range: int = 100,
+    ) -> None:
+        self._display = display
+        self._lower_limit = max(0, lower_limit)
+        self._upper_limit = min(NOTES_PER_CHANNEL, self._lower_limit + note_range)
+        self._changes = display.track_changes()
+        self._rows = [Text() for _ in range(NUM_CHANNELS)]
+
+    def render(self) -> Panel:
+        colors = self._display.colors
+        channels = set()
+        for cell in self._changes.drain():
+            channel, note = divmod(cell, NOTES_PER_CHANNEL)
+            if self._lower_limit <= note < self._upper_limit:
+                channels.add(channel)
+
+        for channel in channels:
+            self._rows[channel] = _row_text(
+                colors, channel, self._lower_limit, self._upper_limit
+            )
+
+        return _panel(self._display, self._rows)
+
+
+def _row_text(
+    colors: memoryview, channel: int, lower_limit: int, upper_limit: int
+) -> Text:
+    """
+    Returns the notes from `lower_limit` to `upper_limit` of a (0-based) channel.
+    """
+    text = Text()
+
+    row = channel * NOTES_PER_CHANNEL
+    for i in range((row + lower_limit) * RGB, (row + upper_limit) * RGB, RGB):
+        r, g, b = colors[i : i + RGB]
+        if r or g or b:
+            style = Style(color=Color.from_rgb(r, g, b))
+            text.append(FILLED_RECTANGLE, style=style)
+        else:
+            text.append(EMPTY_RECTANGLE)
+            # text.append(" ")
+
+    # TODO: fix this
+    # if with_instruments:
+    #     instrument_name = (
+    #         "Percussion"
+    #         if channel + 1 == PERCUSSION_CHANNEL
+    #         else PROGRAMS[display.programs[channel] + 1]
+    #     )
+    #     # text.append(f"Track {channel + 1:02d}: ")
+    #     text.append(
+    #         f"vol:0x{display.volumes[channel]:02x}     {instrument_name}",
+    #         style=Style(color=color_from_hsv(hue, sat, max(0.2, max_val))),
+    #     )
+    #     text.append("\n")
+
+    return text
+
+
+def progress_text(display: Display) -> str:
+    """
+    Returns the progress shown under the panel, without the duration if it's
+    unknown (eg when live).
+    """
     pos_td = timedelta(seconds=int(display.progress_secs))
+    if not display.duration_secs:
+        return str(pos_td)
+    duration_td = timedelta(seconds=int(display.duration_secs))
+    return f"{pos_td} / {duration_td}"
+
+
+def _panel(display: Display, rows: list[Text]) -> Panel:
+    text = Text("\n").join(rows)
 
     return Panel.fit(
         text,
         title=f"[white]{display.title}[/white]",
-        subtitle=f"[white]{pos_td} / {duration_td}[/white]",
+        subtitle=f"[white]{progress_text(display)}[/white]",
         subtitle_align="right",
         style=Style(bgcolor=Color.from_rgb(0, 0, 0), color=Color.from_rgb(32, 32, 32)),
     )
@@ -0,0 +1,266 @@
+"""
+Exports visualisations as video frames, much faster than real time
+
+Each file is played into a `Display` against a virtual clock, and a frame of the
+LED wall (as arranged by a `Layout`) is written at every multiple of `1 / fps`
+seconds: either to a single raw r, g, b stream, eg for ffmpeg, or as a sequence
+of PNG files. Nothing depends on the wall clock or on scheduling, so exporting
+the same file twice gives identical output, and files are exported in parallel,
+one per worker process.
+"""
+
+import enum
+import math
+import os
+import shutil
+import struct
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from midivis.cache import load_cached_timeline
+from midivis.display import RGB, Display
+from midivis.frames import sample_frames
+from midivis.layout import Layout, default_layout
+from midivis.palette import PaletteName, get_palette
+from midivis.render import DEFAULT_MAX_FPS
+from midivis.utils import log
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# width, height, bit depth, colour type (truecolour), compression, filter and
+# interlace methods
+PNG_HEADER = struct.Struct("!IIBBBBB")
+PNG_CHUNK_HEADER = struct.Struct("!I4s")
+PNG_CRC = struct.Struct("!I")
+
+# The scanline filter that leaves the row as it is
+NO_FILTER = b"\0"
+
+COMPRESSION_LEVEL = 6
+
+
+class ExportFormat(enum.StrEnum):
+    # Every frame in one `.rgb` file, packed r, g, b bytes row by row
+    RAW = "raw"
+
+    # A directory of numbered `.png` files
+    PNG = "png"
+
+
+class ExportResult(NamedTuple):
+    path: Path
+    frames: int
+    size_bytes: int
+    elapsed_secs: float
+    length_secs: float
+
+
+def scale_pixels(pixels: bytes, width: int, scale: int) -> bytes:
+    """
+    Scales up packed r, g, b pixels, row by row, so that each pixel becomes a
+    `scale` x `scale` square.
+    """
+    if scale == 1:
+        return pixels
+    row_bytes = width * RGB
+    rows = []
+    for y in range(0, len(pixels), row_bytes):
+        row = pixels[y : y + row_bytes]
+        rows.append(
+            b"".join(row[i : i + RGB] * scale for i in range(0, row_bytes, RGB)) * scale
+        )
+    return b"".join(rows)
+
+
+def encode_png(pixels: bytes, width: int, height: int) -> bytes:
+    """Encodes packed r, g, b pixels, row by row, as a PNG."""
+    row_bytes = width * RGB
+    scanlines = b"".join(
+        NO_FILTER + pixels[y : y + row_bytes]
+        for y in range(0, height * row_bytes, row_bytes)
+    )
+    header = PNG_HEADER.pack(width, height, 8, 2, 0, 0, 0)
+    return b"".join(
+        (
+            PNG_SIGNATURE,
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(scanlines, COMPRESSION_LEVEL)),
+            _png_chunk(b"IEND", b""),
+        )
+    )
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        PNG_CHUNK_HEADER.pack(len(data), chunk_type)
+        + data
+        + PNG_CRC.pack(zlib.crc32(data, zlib.crc32(chunk_type)))
+    )
+
+
+def output_names(paths: Iterable[Path]) -> list[str]:
+    """
+    Returns a distinct output name for each path: its file name, with `-2`,
+    `-3` etc added to the stem of any name that's already taken. Names are
+    compared ignoring case, as some filesystems do.
+    """
+    names = []
+    taken = set()
+    for path in paths:
+        name = path.name
+        n = 1
+        while name.casefold() in taken:
+            n += 1
+            name = f"{path.stem}-{n}{path.suffix}"
+        taken.add(name.casefold())
+        names.append(name)
+    return names
+
+
+def export_file(
+    midi_path: Path,
+    output_dir: Path,
+    fps: float = DEFAULT_MAX_FPS,
+    export_format: ExportFormat = ExportFormat.PNG,
+    layout: Layout | None = None,
+    palette: PaletteName = PaletteName.HUE,
+    scale: int = 1,
+    name: str | None = None,
+) -> ExportResult:
+    """
+    Exports the frames for `midi_path` to `output_dir`, as `<name>.rgb` or
+    `<name>/<frame>.png`. `name` defaults to the MIDI file's name.
+    """
+    start = time.monotonic()
+    if name is None:
+        name = midi_path.name
+    if layout is None:
+        layout = default_layout()
+    timeline = load_cached_timeline(midi_path)
+    display = Display(
+        title="",
+        duration_secs=timeline.length_secs,
+        palette=get_palette(palette),
+    )
+
+    width = layout.width * scale
+    height = layout.height * scale
+
+    def frames() -> Iterator[tuple[int, bytes]]:
+        """Yields each frame, encoded; most are the same as the one before."""
+        generation = -1
+        image = b""
+        for frame in sample_frames(
+            timeline, display.apply_events, fps, every_frame=True
+        ):
+            if display.generation != generation:
+                generation = display.generation
+                image = scale_pixels(layout.pixels(display.colors), layout.width, scale)
+                if export_format == ExportFormat.PNG:
+                    image = encode_png(image, width, height)
+            yield frame, image
+
+    num_frames = 0
+    size_bytes = 0
+    if export_format == ExportFormat.RAW:
+        path = output_dir / f"{name}.rgb"
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            try:
+                for _, image in frames():
+                    size_bytes += f.write(image)
+                    num_frames += 1
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        os.replace(temp_path, path)
+    else:
+        path = output_dir / name
+        # Written to one side and swapped in, so no frames from an earlier
+        # export are left behind
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        temp_path.mkdir()
+        digits = max(len(str(math.floor(timeline.length_secs * fps))), 6)
+        try:
+            for frame, image in frames():
+                (temp_path / f"{frame:0{digits}}.png").write_bytes(image)
+                size_bytes += len(image)
+                num_frames += 1
+        except BaseException:
+            shutil.rmtree(temp_path)
+            raise
+        if path.exists():
+            old_path = path.with_name(f".{path.name}.{os.getpid()}.old")
+            os.replace(path, old_path)
+            os.replace(temp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(temp_path, path)
+
+    return ExportResult(
+        path, num_frames, size_bytes, time.monotonic() - start, timeline.length_secs
+    )
+
+
+def export_files(
+    paths: Iterable[Path],
+    output_dir: Path,
+    fps: float = DEFAULT_MAX_FPS,
+    export_format: ExportFormat = ExportFormat.PNG,
+    layout: Layout | None = None,
+    palette: PaletteName = PaletteName.HUE,
+    scale: int = 1,
+    workers: int | None = None,
+) -> None:
+    """
+    Exports each MIDI file to `output_dir`, in parallel. Files with the same
+    name are given distinct outputs by `output_names`.
+    """
+    if layout is None:
+        layout = default_layout()
+    paths = list(paths)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                export_file,
+                path,
+                output_dir,
+                fps=fps,
+                export_format=export_format,
+                layout=layout,
+                palette=palette,
+                scale=scale,
+                name=name,
+            )
+            for path, name in zip(paths, output_names(paths))
+        ]
+        try:
+            for midi_path, future in zip(paths, futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log(0, f"Unable to export {midi_path}: {type(e).__name__}: {e}")
+                    continue
+                log(
+                    0,
+                    f"Exported {result.frames} frames to {result.path}"
+                    f" ({result.size_bytes:,} bytes) in {result.elapsed_secs:.2f}s"
+                    f" ({result.length_secs / max(result.elapsed_secs, 1e-6):.0f}x"
+                    " real time)",
+                )
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    if export_format == ExportFormat.RAW:
+        log(
+            0,
+            f"Frames are {layout.width * scale}x{layout.height * scale} rgb24 at"
+            f" {fps:g} fps",
+        )
@@ -0,0 +1,279 @@
+"""
+Pre-rendered frames, for pushing to WLED without computing any colours
+
+`render_file` runs a MIDI file through a `Display` at a fixed frame rate and
+writes out just the LEDs that changed in each frame. Frame files are
+memory-mapped for playback, so they never need to fit in memory.
+"""
+
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+
+from midivis.cache import file_hash, load_cached_timeline
+from midivis.display import RGB, DirtyCells, Display
+from midivis.render import DEFAULT_MAX_FPS
+from midivis.timeline import Timeline
+from midivis.utils import log
+
+MAGIC = b"MVFR"
+VERSION = 1
+
+FRAMES_SUFFIX = ".frames"
+
+# magic, version, fps, num_frames, num_leds, length_secs, offset of the index,
+# and the blake2b hash of the MIDI file. Native byte order, as for the
+# timeline cache.
+HEADER = struct.Struct("=4sIdIIdQ128s")
+
+# Each frame is a sequence of runs of LEDs: the first LED and the number of
+# LEDs, followed by their r, g, b values
+RUN_HEADER = struct.Struct("=HH")
+
+# Runs are joined across a gap of this many unchanged LEDs, since resending
+# them costs no more than starting a new run
+MAX_GAP = RUN_HEADER.size // RGB
+
+
+def frames_path(midi_path: Path) -> Path:
+    """Where `midivis render` puts the frames for `midi_path` by default."""
+    return midi_path.with_name(midi_path.name + FRAMES_SUFFIX)
+
+
+def encode_changes(buffer: bytes | memoryview, changed: set[int]) -> bytes:
+    """Encodes the `changed` positions of a packed r, g, b buffer as runs."""
+    encoded = bytearray()
+
+    def add_run(first: int, last: int) -> None:
+        encoded.extend(RUN_HEADER.pack(first, last - first + 1))
+        encoded.extend(buffer[first * RGB : (last + 1) * RGB])
+
+    positions = sorted(changed)
+    first = last = positions[0]
+    for pos in positions[1:]:
+        if pos - last > MAX_GAP + 1:
+            add_run(first, last)
+            first = pos
+        last = pos
+    add_run(first, last)
+
+    return bytes(encoded)
+
+
+# Applies events `start` to `stop` of a timeline, at the given time in seconds
+ApplyEvents = Callable[[Timeline, int, int, float], None]
+
+
+def sample_frames(
+    timeline: Timeline,
+    apply_events: ApplyEvents,
+    fps: float,
+    every_frame: bool = False,
+) -> Iterator[int]:
+    """
+    Plays `timeline` through `apply_events` (usually `Display.apply_events`) as
+    fast as possible, yielding the number of each frame once every event up to
+    and including `frame / fps` seconds has been applied.
+
+    By default, frames in which no events were applied are skipped, other than
+    the first. With `every_frame`, frames continue to the end of the timeline,
+    whether anything changed or not.
+    """
+    times = timeline.times
+    group_starts = timeline.group_starts
+    num_groups = timeline.num_groups
+    last_frame = math.floor(timeline.length_secs * fps)
+    group = 0
+    frame = 0
+    while True:
+        frame_secs = frame / fps
+        while group < num_groups and times[group_starts[group]] <= frame_secs:
+            start = group_starts[group]
+            apply_events(timeline, start, group_starts[group + 1], times[start])
+            group += 1
+        yield frame
+
+        if every_frame:
+            if frame >= last_frame:
+                return
+            frame += 1
+        elif group == num_groups:
+            return
+        else:
+            # Skip ahead to the first frame that shows the next group
+            frame = max(frame + 1, math.ceil(times[group_starts[group]] * fps))
+
+
+def render_frames(
+    timeline: Timeline, display: Display, fps: float
+) -> Iterator[tuple[float, bytes]]:
+    """
+    Plays `timeline` into `display` as fast as possible, yielding
+    `(time_secs, encoded_changes)` for each frame in which anything changed.
+
+    Frames are at multiples of `1 / fps` seconds, and show every event up to
+    and including that time. The first frame holds every LED.
+    """
+    changes: DirtyCells = display.track_changes()
+    changes.mark_all()
+    colors = display.colors
+
+    for frame in sample_frames(timeline, display.apply_events, fps):
+        if changes:
+            yield frame / fps, encode_changes(colors, changes.drain())
+
+
+def render_file(timeline: Timeline, content_hash: str, path: Path, fps: float) -> int:
+    """
+    Renders `timeline` to a frame file at `path`, atomically. `content_hash` is
+    the hash of the MIDI file, for checking that the frames still match it.
+
+    Returns the number of frames written.
+    """
+    display = Display(title="", duration_secs=timeline.length_secs, progress_secs=0.0)
+    num_leds = len(display.colors) // RGB
+
+    # Not a `NamedTemporaryFile`, which would only be readable by us
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as f:
+        try:
+            f.write(bytes(HEADER.size))
+
+            times = array("d")
+            offsets = array("Q")
+            for time_secs, encoded in render_frames(timeline, display, fps):
+                times.append(time_secs)
+                offsets.append(f.tell() - HEADER.size)
+                f.write(encoded)
+            offsets.append(f.tell() - HEADER.size)
+
+            f.write(bytes(-f.tell() % 8))
+            index_offset = f.tell()
+            f.write(times)
+            f.write(offsets)
+
+            f.seek(0)
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    fps,
+                    len(times),
+                    num_leds,
+                    timeline.length_secs,
+                    index_offset,
+                    content_hash.encode(),
+                )
+            )
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    os.replace(temp_path, path)
+
+    return len(times)
+
+
+class FrameFile:
+    """
+    A memory-mapped frame file.
+
+    `times[i]` is when frame `i` should be shown; `apply` applies it to a
+    buffer.
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        (
+            magic,
+            version,
+            fps,
+            num_frames,
+            num_leds,
+            length_secs,
+            index_offset,
+            content_hash,
+        ) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(
+                f"{path} is not a frame file that this version can play; render it again"
+            )
+
+        self.fps: float = fps
+        self.num_leds: int = num_leds
+        self.length_secs: float = length_secs
+        self.content_hash: str = content_hash.rstrip(b"\0").decode()
+
+        times_size = num_frames * 8
+        self.times = data[index_offset : index_offset + times_size].cast("d")
+        self._offsets = data[
+            index_offset + times_size : index_offset + times_size + (num_frames + 1) * 8
+        ].cast("Q")
+        self._data = data[HEADER.size : index_offset]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def matches(self, midi_path: Path) -> bool:
+        """Whether these frames were rendered from the current `midi_path`."""
+        return self.content_hash == file_hash(midi_path)
+
+    def apply(self, index: int, buffer: bytearray, changed: list[int]) -> None:
+        """
+        Applies frame `index` to a packed r, g, b buffer, and appends the
+        positions that it changed to `changed`.
+        """
+        frame = self._data[self._offsets[index] : self._offsets[index + 1]]
+        pos = 0
+        while pos < len(frame):
+            first, count = RUN_HEADER.unpack_from(frame, pos)
+            pos += RUN_HEADER.size
+            buffer[first * RGB : (first + count) * RGB] = frame[pos : pos + count * RGB]
+            pos += count * RGB
+            changed.extend(range(first, first + count))
+
+
+def load_frames(midi_path: Path, fps: float = DEFAULT_MAX_FPS) -> FrameFile:
+    """
+    Opens the pre-rendered frames for `midi_path`, rendering them first if
+    they're missing, out of date or at a different frame rate.
+    """
+    path = frames_path(midi_path)
+    try:
+        frames = FrameFile(path)
+    except (OSError, ValueError) as e:
+        log(1, f"Unable to open {path}: {e}")
+    else:
+        if frames.fps != fps:
+            log(1, f"{path} was rendered at {frames.fps:g} fps, not {fps:g}")
+        elif frames.matches(midi_path):
+            return frames
+        else:
+            log(1, f"{path} is out of date")
+
+    log(0, f"Rendering {midi_path} to {path}")
+    render_file(
+        load_cached_timeline(midi_path), file_hash(midi_path), path=path, fps=fps
+    )
+    return FrameFile(path)
+
+
+def render_files(paths: Iterable[Path], fps: float = DEFAULT_MAX_FPS) -> None:
+    """Renders each MIDI file to the frame file next to it."""
+    for midi_path in paths:
+        path = frames_path(midi_path)
+        start = time.monotonic()
+        num_frames = render_file(
+            load_cached_timeline(midi_path), file_hash(midi_path), path=path, fps=fps
+        )
+        log(
+            0,
+            f"Rendered {num_frames} frames to {path} ({path.stat().st_size:,} bytes)"
+            f" in {time.monotonic() - start:.2f}s",
+        )
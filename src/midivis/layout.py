@@ -0,0 +1,223 @@
+"""
+Maps the display onto a matrix of LED panels, however they're wired
+
+A layout is a list of panels, each covering a rectangle of the note grid: one
+row per channel, and one column per note from `lower_note`. Each panel's LEDs
+run along rows (or columns, once rotated) from `first_led`, optionally zigzagging.
+Layouts are read from a TOML file, eg:
+
+    lower_note = 21
+    note_range = 88
+
+    [[panels]]
+    width = 44
+    height = 16
+    serpentine = true
+
+    [[panels]]
+    x = 44
+    width = 44
+    height = 16
+    serpentine = true
+    rotation = 180
+
+The mapping is worked out once, so each frame is a single gather from the color
+buffer, however complicated the wiring.
+"""
+
+import operator
+import tomllib
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from midivis.display import RGB
+from midivis.midi_metadata import NOTES_PER_CHANNEL, NUM_CHANNELS
+from midivis.wled import LEDS_HEIGHT, LEDS_WIDTH
+
+ROTATIONS = (0, 90, 180, 270)
+
+
+@dataclass(frozen=True)
+class Panel:
+    # Size in LEDs, as mounted
+    width: int
+    height: int
+
+    # Position of the top left LED in the note grid
+    x: int = 0
+    y: int = 0
+
+    # Index of the LED where the panel's wiring starts, or None to follow on
+    # from the previous panel
+    first_led: int | None = None
+
+    # Whether every other row of the wiring runs backwards
+    serpentine: bool = False
+
+    # How far the panel is turned clockwise, in degrees. Unturned, the wiring
+    # starts at the top left and runs right along each row.
+    rotation: int = 0
+
+    def grid_positions(self) -> list[tuple[int, int]]:
+        """Returns the (x, y) grid position of each LED, in wiring order."""
+        if self.rotation in (0, 180):
+            wiring_width = self.width
+        else:
+            wiring_width = self.height
+
+        positions = []
+        for led in range(self.width * self.height):
+            row, column = divmod(led, wiring_width)
+            if self.serpentine and row % 2:
+                column = wiring_width - 1 - column
+            match self.rotation:
+                case 0:
+                    x, y = column, row
+                case 90:
+                    x, y = self.width - 1 - row, column
+                case 180:
+                    x, y = self.width - 1 - column, self.height - 1 - row
+                case _:
+                    x, y = row, self.height - 1 - column
+            positions.append((self.x + x, self.y + y))
+        return positions
+
+
+class Layout:
+    """
+    Maps the cells of a `Display` to LEDs.
+
+    Grid column `x` shows note `lower_note + x`, and row `y` shows channel `y`
+    (0-based). LEDs below the last channel, or beyond `note_range` notes, stay
+    black.
+    """
+
+    def __init__(
+        self,
+        panels: Sequence[Panel],
+        lower_note: int = 0,
+        note_range: int = NOTES_PER_CHANNEL,
+    ) -> None:
+        if not panels:
+            raise ValueError("A layout needs at least one panel")
+        if not 0 <= lower_note < NOTES_PER_CHANNEL:
+            raise ValueError(f"lower_note must be from 0 to {NOTES_PER_CHANNEL - 1}")
+
+        upper_note = min(lower_note + note_range, NOTES_PER_CHANNEL)
+
+        # The cell shown by each LED, or None, and at each grid position
+        led_cells: dict[int, int | None] = {}
+        grid_cells: dict[tuple[int, int], int | None] = {}
+        next_led = 0
+        for panel in panels:
+            if panel.rotation not in ROTATIONS:
+                raise ValueError(f"Panel rotation must be one of {ROTATIONS}")
+            if panel.width < 1 or panel.height < 1:
+                raise ValueError("Panels must be at least 1 LED wide and high")
+
+            if panel.x < 0 or panel.y < 0:
+                raise ValueError("Panels can't be placed left of or above the grid")
+
+            led = next_led if panel.first_led is None else panel.first_led
+            for x, y in panel.grid_positions():
+                if led in led_cells:
+                    raise ValueError(f"LED {led} is in more than one panel")
+                note = lower_note + x
+                if y < NUM_CHANNELS and note < upper_note:
+                    cell: int | None = y * NOTES_PER_CHANNEL + note
+                else:
+                    cell = None
+                led_cells[led] = cell
+                grid_cells[x, y] = cell
+                led += 1
+            next_led = led
+
+        self.num_leds = max(led_cells) + 1
+
+        # Unmapped LEDs read the black padding after the colors
+        black = NUM_CHANNELS * NOTES_PER_CHANNEL * RGB
+        byte_indices: list[int] = []
+        self._cell_leds: dict[int, list[int]] = {}
+        for led in range(self.num_leds):
+            cell = led_cells.get(led)
+            if cell is None:
+                byte_indices += range(black, black + RGB)
+            else:
+                byte_indices += range(cell * RGB, (cell + 1) * RGB)
+                self._cell_leds.setdefault(cell, []).append(led)
+
+        self._gather = operator.itemgetter(*byte_indices)
+        self._source = bytearray(black + RGB)
+
+        # The size of the wall, as seen from the front
+        self.width = max(x for x, _ in grid_cells) + 1
+        self.height = max(y for _, y in grid_cells) + 1
+
+        pixel_indices: list[int] = []
+        for y in range(self.height):
+            for x in range(self.width):
+                cell = grid_cells.get((x, y))
+                start = black if cell is None else cell * RGB
+                pixel_indices += range(start, start + RGB)
+        self._gather_pixels = operator.itemgetter(*pixel_indices)
+
+    def leds(self, colors: bytes | memoryview) -> bytes:
+        """Returns the packed r, g, b values of each LED, from `Display.colors`."""
+        return bytes(self._gather(self._fill(colors)))
+
+    def pixels(self, colors: bytes | memoryview) -> bytes:
+        """
+        Returns the packed r, g, b values of the wall as an image, row by row,
+        from `Display.colors`. Gaps between panels are black.
+        """
+        return bytes(self._gather_pixels(self._fill(colors)))
+
+    def _fill(self, colors: bytes | memoryview) -> bytearray:
+        source = self._source
+        source[: len(colors)] = colors
+        return source
+
+    def changed_leds(self, cells: Iterable[int]) -> list[int]:
+        """Returns the LEDs that show any of `cells`."""
+        cell_leds = self._cell_leds
+        return [led for cell in cells if cell in cell_leds for led in cell_leds[cell]]
+
+
+DEFAULT_LAYOUT_PANELS = (Panel(width=LEDS_WIDTH, height=LEDS_HEIGHT),)
+
+
+def default_layout() -> Layout:
+    """A single row-major panel, showing the same notes as `to_panel`."""
+    return Layout(DEFAULT_LAYOUT_PANELS, note_range=LEDS_WIDTH)
+
+
+def load_layout(path: Path) -> Layout:
+    with open(path, "rb") as f:
+        try:
+            config = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"Invalid layout in {path}: {e}") from e
+
+    try:
+        panels = [_panel(panel) for panel in config.get("panels", [])]
+        return Layout(
+            panels,
+            lower_note=int(config.get("lower_note", 0)),
+            note_range=int(config.get("note_range", NOTES_PER_CHANNEL)),
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid layout in {path}: {e}") from e
+
+
+def _panel(config: dict[str, Any]) -> Panel:
+    return Panel(
+        width=int(config["width"]),
+        height=int(config["height"]),
+        x=int(config.get("x", 0)),
+        y=int(config.get("y", 0)),
+        first_led=None if "first_led" not in config else int(config["first_led"]),
+        serpentine=bool(config.get("serpentine", False)),
+        rotation=int(config.get("rotation", 0)),
+    )
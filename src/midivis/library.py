@@ -0,0 +1,405 @@
+"""
+The library database that `midivis analyse` fills in, and searches over it
+"""
+
+import asyncio
+import functools
+import re
+import sqlite3
+from collections import Counter
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple
+
+DB_PATH = Path("midi.db")
+
+# Bump this whenever analysis starts recording something new, so that
+# `midivis analyse` re-analyses tracks that were analysed by an older version
+ANALYSIS_VERSION = 2
+
+
+DEFAULT_PAGE_SIZE = 50
+
+# Search terms are matched as prefixes of the words in file names and paths
+_SEARCH_TERM = re.compile(r"\w+")
+
+TRACK_COLUMNS = """
+    tracks.track_id,
+    tracks.file_path,
+    tracks.file_name,
+    tracks.runtime_secs,
+    tracks.note_count,
+    tracks.channel_count,
+    tracks.program_count
+"""
+
+
+class CountTable(NamedTuple):
+    """
+    A table of per track counts, with library-wide totals in `{key}_totals`.
+    """
+
+    # eg "track_notes"
+    table: str
+
+    # What's counted, eg "note"
+    key: str
+
+    # eg "note_count"
+    count_column: str
+
+    # Whether searches can filter on `key`, which needs an extra index
+    searchable: bool
+
+    @property
+    def totals(self) -> str:
+        return f"{self.key}_totals"
+
+
+NOTES = CountTable("track_notes", "note", "note_count", searchable=False)
+CHANNELS = CountTable("track_channels", "channel", "note_count", searchable=True)
+PROGRAMS = CountTable("track_programs", "program", "change_count", searchable=True)
+COUNT_TABLES = (NOTES, CHANNELS, PROGRAMS)
+
+
+class Track(NamedTuple):
+    track_id: int
+    file_path: str
+    file_name: str
+    runtime_secs: float | None
+    note_count: int
+    channel_count: int
+    program_count: int
+
+
+@dataclass(frozen=True)
+class TrackFilter:
+    """
+    Restricts a search. Each bound is inclusive, and `None` means unbounded.
+    """
+
+    min_runtime_secs: float | None = None
+    max_runtime_secs: float | None = None
+    min_note_count: int | None = None
+    max_note_count: int | None = None
+    min_channel_count: int | None = None
+    max_channel_count: int | None = None
+    min_program_count: int | None = None
+    max_program_count: int | None = None
+
+    # Tracks must play notes on all of these (0-based) channels...
+    channels: frozenset[int] = field(default_factory=frozenset)
+
+    # ...and use all of these programs
+    programs: frozenset[int] = field(default_factory=frozenset)
+
+    def where(self) -> tuple[list[str], list[object]]:
+        """Returns SQL conditions on `tracks`, and their parameters."""
+        conditions = []
+        params: list[object] = []
+        for column in ("runtime_secs", "note_count", "channel_count", "program_count"):
+            for bound, op in (("min", ">="), ("max", "<=")):
+                value = getattr(self, f"{bound}_{column}")
+                if value is not None:
+                    conditions.append(f"tracks.{column} {op} ?")
+                    params.append(value)
+        for channel in sorted(self.channels):
+            conditions.append(
+                "EXISTS (SELECT 1 FROM track_channels"
+                " WHERE track_id = tracks.track_id AND channel = ?)"
+            )
+            params.append(channel)
+        for program in sorted(self.programs):
+            conditions.append(
+                "EXISTS (SELECT 1 FROM track_programs"
+                " WHERE track_id = tracks.track_id AND program = ?)"
+            )
+            params.append(program)
+        return conditions, params
+
+
+class SearchPage(NamedTuple):
+    tracks: list[Track]
+
+    # Position of the first track in the full list of results
+    offset: int
+
+    # Whether there are more results after this page
+    has_more: bool
+
+
+def fts_query(text: str) -> str | None:
+    """
+    Converts what the user typed into an FTS5 query that matches every word as
+    a prefix, or `None` if there's nothing to search for.
+    """
+    terms = _SEARCH_TERM.findall(text)
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+def search(
+    conn: sqlite3.Connection,
+    text: str = "",
+    track_filter: TrackFilter = TrackFilter(),
+    offset: int = 0,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> SearchPage:
+    """
+    Returns a page of tracks whose names or paths match `text`, by name.
+
+    Results aren't ranked by relevance: ranking every match of a one or two
+    letter prefix takes too long on a large library, and ordering by name keeps
+    results stable as the user types.
+    """
+    conditions, params = track_filter.where()
+
+    query = fts_query(text)
+    if query is not None:
+        conditions.insert(
+            0,
+            "tracks.track_id IN (SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?)",
+        )
+        params.insert(0, query)
+
+    sql = f"SELECT {TRACK_COLUMNS} FROM tracks"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # Fetch one extra row to find out if there's another page
+    sql += " ORDER BY tracks.file_name COLLATE NOCASE, tracks.track_id LIMIT ? OFFSET ?"
+    params += [limit + 1, offset]
+
+    tracks = [Track(*row) for row in conn.execute(sql, params)]
+    return SearchPage(
+        tracks=tracks[:limit], offset=offset, has_more=len(tracks) > limit
+    )
+
+
+class Library:
+    """
+    Async access to the library database, for the UI.
+
+    Queries run one at a time on a dedicated thread (which owns the
+    connection), so they never block the event loop.
+    """
+
+    def __init__(self, path: Path = DB_PATH) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library")
+        self._conn = self._executor.submit(init_db, path).result()
+
+    def close(self) -> None:
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
+
+    async def search(
+        self,
+        text: str = "",
+        track_filter: TrackFilter = TrackFilter(),
+        offset: int = 0,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> SearchPage:
+        """See `search()`."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            functools.partial(search, self._conn, text, track_filter, offset, limit),
+        )
+
+
+def replace_counts(
+    conn: sqlite3.Connection,
+    counts: CountTable,
+    track_ids: Sequence[int],
+    rows: Iterable[tuple[int, int, int]],
+) -> None:
+    """
+    Replaces everything in `counts` for `track_ids` with `rows` of
+    `(track_id, key, count)`, and updates the totals to match.
+
+    Totals are updated once per key, rather than by a trigger for every row,
+    which would make inserting a batch of tracks twice as slow.
+    """
+    table, key, count, _ = counts
+    track_counts: Counter[int] = Counter()
+    totals: Counter[int] = Counter()
+
+    placeholders = ", ".join("?" * len(track_ids))
+    for old_key, old_count in conn.execute(
+        f"SELECT {key}, {count} FROM {table} WHERE track_id IN ({placeholders})",
+        track_ids,
+    ):
+        track_counts[old_key] -= 1
+        totals[old_key] -= old_count
+    conn.execute(f"DELETE FROM {table} WHERE track_id IN ({placeholders})", track_ids)
+
+    rows = list(rows)
+    conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", rows)
+    for _, new_key, new_count in rows:
+        track_counts[new_key] += 1
+        totals[new_key] += new_count
+
+    conn.executemany(
+        f"""
+        INSERT INTO {counts.totals} VALUES (?, ?, ?)
+        ON CONFLICT ({key}) DO UPDATE SET
+            track_count = track_count + excluded.track_count,
+            {count} = {count} + excluded.{count}
+        """,
+        [(k, track_counts[k], totals[k]) for k in track_counts.keys() | totals.keys()],
+    )
+
+
+def histograms(conn: sqlite3.Connection) -> dict[str, Counter[int]]:
+    """
+    Returns histograms over the whole library: how many tracks use each channel
+    and program, how many times each note is played, and how many tracks span
+    each range of notes.
+    """
+    note_ranges: Counter[int] = Counter()
+    for note_range, track_count in conn.execute(
+        "SELECT note_max - note_min, COUNT(*) FROM tracks GROUP BY 1"
+    ):
+        # Tracks without notes count as having a range of 0
+        note_ranges[note_range or 0] += track_count
+
+    def totals(sql: str) -> Counter[int]:
+        return Counter(dict(conn.execute(sql)))
+
+    return {
+        "Channels": totals(
+            "SELECT channel, track_count FROM channel_totals WHERE track_count > 0"
+        ),
+        "Notes": totals(
+            "SELECT note, note_count FROM note_totals WHERE track_count > 0"
+        ),
+        "Programs": totals(
+            "SELECT program, track_count FROM program_totals WHERE track_count > 0"
+        ),
+        "Note Ranges": note_ranges,
+    }
+
+
+def init_db(path: Path = DB_PATH) -> sqlite3.Connection:
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+
+    # Lets the UI search while `midivis analyse` is writing, and makes commits
+    # cheaper
+    cur.execute("PRAGMA journal_mode = WAL")
+    cur.execute("PRAGMA synchronous = NORMAL")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tracks (
+            track_id INTEGER PRIMARY KEY,
+            -- file info
+            file_path TEXT NOT NULL UNIQUE,
+            file_name TEXT NOT NULL,
+            file_size_bytes INTEGER NOT NULL,
+            file_mtime_ns INTEGER,  -- NULLable because older databases didn't record it
+            file_hash_blake2b TEXT NOT NULL,
+            -- track info
+            runtime_secs REAL,  -- NULLable because Mido says asynchronous midi files have no defined runtime
+            channel_count INTEGER NOT NULL,
+            note_count INTEGER NOT NULL,
+            program_count INTEGER NOT NULL,
+            note_max INTEGER,
+            note_min INTEGER,
+            analysis_version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    # Upgrade databases created by older versions
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(tracks)")}
+    if "file_mtime_ns" not in columns:
+        cur.execute("ALTER TABLE tracks ADD COLUMN file_mtime_ns INTEGER")
+    if "analysis_version" not in columns:
+        cur.execute(
+            "ALTER TABLE tracks ADD COLUMN analysis_version INTEGER NOT NULL DEFAULT 0"
+        )
+
+    for column in (
+        "runtime_secs",
+        "note_count",
+        "channel_count",
+        "program_count",
+        "file_name COLLATE NOCASE",
+    ):
+        name = column.split()[0]
+        cur.execute(f"CREATE INDEX IF NOT EXISTS tracks_{name} ON tracks ({column})")
+
+    # Per track counts, and library-wide totals (see `replace_counts`) so that
+    # reports don't need to aggregate millions of rows
+    for table, key, count, searchable in COUNT_TABLES:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                track_id INTEGER NOT NULL REFERENCES tracks ON DELETE CASCADE,
+                {key} INTEGER NOT NULL,
+                {count} INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (track_id, {key})
+            ) WITHOUT ROWID
+        """)
+        columns = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+        if count not in columns:
+            cur.execute(
+                f"ALTER TABLE {table} ADD COLUMN {count} INTEGER NOT NULL DEFAULT 0"
+            )
+        if searchable:
+            cur.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table}_{key} ON {table} ({key}, track_id)
+            """)
+
+        has_totals = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (f"{key}_totals",)
+        ).fetchone()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {key}_totals (
+                {key} INTEGER PRIMARY KEY,
+                track_count INTEGER NOT NULL,
+                {count} INTEGER NOT NULL
+            )
+        """)
+        if not has_totals:
+            cur.execute(f"""
+                INSERT INTO {key}_totals
+                SELECT {key}, COUNT(*), SUM({count}) FROM {table} GROUP BY {key}
+            """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS tracks_note_range ON tracks (note_max - note_min)
+    """)
+
+    # Full text index over names and paths, kept up to date by triggers. The
+    # prefix indexes make searching as the user types fast.
+    has_fts = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'tracks_fts'"
+    ).fetchone()
+    cur.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5 (
+            file_name,
+            file_path,
+            content = 'tracks',
+            content_rowid = 'track_id',
+            prefix = '1 2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks BEGIN
+            INSERT INTO tracks_fts (rowid, file_name, file_path)
+            VALUES (new.track_id, new.file_name, new.file_path);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, file_name, file_path)
+            VALUES ('delete', old.track_id, old.file_name, old.file_path);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tracks_fts_update
+        AFTER UPDATE OF file_name, file_path ON tracks BEGIN
+            INSERT INTO tracks_fts (tracks_fts, rowid, file_name, file_path)
+            VALUES ('delete', old.track_id, old.file_name, old.file_path);
+            INSERT INTO tracks_fts (rowid, file_name, file_path)
+            VALUES (new.track_id, new.file_name, new.file_path);
+        END;
+    """)
+    if not has_fts:
+        # Index anything that was analysed before the index existed
+        cur.execute("INSERT INTO tracks_fts (tracks_fts) VALUES ('rebuild')")
+    con.commit()
+
+    cur.execute("PRAGMA foreign_keys = ON")
+    return con
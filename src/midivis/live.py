@@ -0,0 +1,222 @@
+"""
+Visualises live MIDI input, eg from a keyboard or a DAW, as it's played
+
+The input port calls back on its own thread as each message arrives, which
+forwards it straight to the synth (if thru is on), and wakes the event loop.
+Everything that arrives while the loop is busy is published to the same outputs
+as playback uses as one batch, so a burst of notes (or a fast controller sweep)
+never builds up a backlog. How long each message takes to reach each output is
+measured, and reported at the end.
+"""
+
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import mido
+from mido import Message
+from mido.ports import BaseOutput
+
+from midivis.bus import LiveBatch, Subscriber, publish
+from midivis.outputs import DisplayOutput, OutputOptions, open_outputs
+from midivis.play import port
+from midivis.tracing import TimingStats
+from midivis.utils import log
+
+# The name other programs see when `virtual` is used
+VIRTUAL_PORT_NAME = "midivis"
+
+# A message, and when it arrived (from `time.perf_counter`)
+Received = tuple[Message, float]
+
+
+@dataclass
+class LiveStats:
+    # Messages received from the input
+    received: int = 0
+
+    # Batches they were published in
+    batches: int = 0
+
+    # From a message arriving to each output showing it
+    latency: dict[str, TimingStats] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        lines = [f"{self.received} messages in {self.batches} batches"]
+        for name, stats in self.latency.items():
+            if stats:
+                lines.append(f"Input to {name} latency: {stats}")
+        return "\n".join(lines)
+
+
+class LiveInput:
+    """
+    Collects messages from an input's callback thread for the event loop.
+
+    `receive` is the callback: it sends each message on to `thru_port` right
+    away, then queues it. `batches` yields everything queued since the last
+    batch as a `LiveBatch`, waking only when something arrives.
+    """
+
+    def __init__(self, thru_port: BaseOutput | None = None) -> None:
+        self._thru_port = thru_port
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._pending: list[Received] = []
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._started = time.perf_counter()
+
+    def receive(self, message: Message) -> None:
+        """Handles a message from the input. Called on the input's thread."""
+        received = time.perf_counter()
+        if self._thru_port is not None and not message.is_meta:
+            self._thru_port.send(message)
+
+        with self._lock:
+            wake = not self._pending
+            self._pending.append((message, received))
+        # Only the first message of a batch needs to wake the loop
+        if wake:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    def close(self) -> None:
+        """Ends `batches`, once it's yielded what's queued. Safe from any thread."""
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def batches(self) -> AsyncIterator[LiveBatch]:
+        while True:
+            self._ready.clear()
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if batch:
+                times = tuple(received - self._started for _, received in batch)
+                yield LiveBatch(
+                    tuple(message for message, _ in batch),
+                    times=times,
+                    time_secs=times[-1],
+                    received_at=batch[0][1],
+                )
+            elif self._closed:
+                return
+            else:
+                await self._ready.wait()
+
+
+@contextmanager
+def open_source(
+    live_input: LiveInput,
+    name: str | None = None,
+    virtual: bool = False,
+    replay: Path | None = None,
+) -> Iterator[None]:
+    """
+    Feeds `live_input` from the input port `name` (or the first one), or from a
+    new virtual port that other programs can connect to.
+
+    With `replay`, plays that MIDI file in real time instead, as a stand-in
+    for a real input, and closes `live_input` when it ends.
+    """
+    if replay is not None:
+        stopping = threading.Event()
+        thread = threading.Thread(
+            target=_replay,
+            args=(replay, live_input, stopping),
+            name="replay",
+            daemon=True,
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stopping.set()
+        return
+
+    mido.set_backend("mido.backends.rtmidi/LINUX_ALSA")
+    if virtual and name is None:
+        name = VIRTUAL_PORT_NAME
+    with mido.open_input(name, virtual=virtual, callback=live_input.receive) as port:
+        log(1, f"Listening to {port.name}")
+        yield
+
+
+def _replay(path: Path, live_input: LiveInput, stopping: threading.Event) -> None:
+    try:
+        for message in mido.MidiFile(path).play():
+            if stopping.is_set():
+                return
+            live_input.receive(message)
+    finally:
+        live_input.close()
+
+
+async def visualise(
+    live_input: LiveInput,
+    outputs: Sequence[Subscriber],
+    stats: LiveStats | None = None,
+) -> LiveStats:
+    """
+    Publishes each batch from `live_input` to `outputs`, until the input closes
+    (or the task is cancelled).
+
+    The outputs' latency is collected in `stats`, so it's there even if this
+    is cancelled.
+    """
+    if stats is None:
+        stats = LiveStats()
+    for output in outputs:
+        if isinstance(output, DisplayOutput):
+            stats.latency[output.name] = output.latency
+
+    async def batches() -> AsyncIterator[LiveBatch]:
+        async for batch in live_input.batches():
+            stats.received += len(batch.messages)
+            stats.batches += 1
+            yield batch
+
+    await publish(batches(), outputs)
+    return stats
+
+
+def run_live(
+    name: str | None = None,
+    virtual: bool = False,
+    replay: Path | None = None,
+    thru: bool = False,
+    options: OutputOptions = OutputOptions(),
+) -> None:
+    """Visualises an input until it ends or is interrupted, then reports the latency."""
+    stats = LiveStats()
+    try:
+        asyncio.run(_live(name, virtual, replay, thru, options, stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log(0, str(stats))
+
+
+async def _live(
+    name: str | None,
+    virtual: bool,
+    replay: Path | None,
+    thru: bool,
+    options: OutputOptions,
+    stats: LiveStats,
+) -> None:
+    if replay is not None:
+        title = f"{replay.name} (replay)"
+    else:
+        title = name or (VIRTUAL_PORT_NAME if virtual else "Live")
+    outputs = open_outputs(
+        options, title, record_name=time.strftime("live-%Y%m%d-%H%M%S.mid")
+    )
+
+    with port() if thru else nullcontext() as synth_port:
+        live_input = LiveInput(thru_port=synth_port)
+        with open_source(live_input, name=name, virtual=virtual, replay=replay):
+            await visualise(live_input, outputs, stats)
@@ -0,0 +1,407 @@
+"""
+Outputs for playback, as subscribers to the playback bus
+
+The outputs don't mind whether batches were played from a timeline or
+received live.
+"""
+
+import enum
+import socket
+import struct
+import sys
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+import mido
+from rich.live import Live
+from rich.panel import Panel
+
+from midivis import tracing
+from midivis.ansi import ENTER_SCREEN, LEAVE_SCREEN, AnsiRenderer
+from midivis.bus import AnyBatch, Subscriber
+from midivis.display import Display, PanelRenderer
+from midivis.layout import Layout, default_layout
+from midivis.palette import Palette
+from midivis.render import DEFAULT_MAX_FPS, FrameRenderer
+from midivis.timeline import Timeline
+from midivis.tracing import TimingStats
+from midivis.utils import get_console, log
+from midivis.wled import HOST
+from midivis.wled_realtime import WLEDProtocol, open_client
+
+# Recordings use mido's default tempo, at which a tick is a millisecond / 0.96
+TICKS_PER_BEAT = 480
+TEMPO = 500_000
+
+RELAY_PORT = 5008
+
+# Keeps relayed datagrams within a typical Ethernet MTU
+MAX_DATAGRAM = 1472
+
+# Each relayed datagram starts with the time its messages were due, in seconds
+RELAY_HEADER = struct.Struct("!d")
+
+
+class TerminalRenderer(enum.StrEnum):
+    # Draws with rich, which works in any terminal
+    RICH = "rich"
+
+    # Writes escape codes directly, for 24-bit colour terminals
+    ANSI = "ansi"
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    # How to draw in the terminal, or None for no terminal
+    terminal: TerminalRenderer | None = TerminalRenderer.RICH
+    max_fps: float = DEFAULT_MAX_FPS
+
+    # The WLED API to send to, or None for no WLED
+    wled_protocol: WLEDProtocol | None = None
+    wled_host: str = HOST
+
+    # How the WLED panels are arranged, or None for the default
+    layout: Layout | None = None
+
+    palette: Palette | None = None
+
+    # Where to record what was played, or None to not record
+    record_dir: Path | None = None
+
+    # Where to forward what was played, or None to not forward it
+    relay_host: str | None = None
+    relay_port: int = RELAY_PORT
+
+
+def open_outputs(
+    options: OutputOptions,
+    title: str,
+    timeline: Timeline | None = None,
+    start_secs: float = 0.0,
+    record_name: str | None = None,
+) -> list[Subscriber]:
+    """
+    Returns the outputs chosen by `options`, for playing `timeline` from
+    `start_secs`, or for live input if `timeline` is None. Recordings are named
+    `record_name`, or after `title`.
+    """
+    outputs: list[Subscriber] = []
+    if options.terminal == TerminalRenderer.RICH:
+        outputs.append(
+            TerminalOutput(
+                title,
+                timeline,
+                start_secs,
+                max_fps=options.max_fps,
+                palette=options.palette,
+            )
+        )
+    elif options.terminal == TerminalRenderer.ANSI:
+        outputs.append(
+            AnsiTerminalOutput(
+                title,
+                timeline,
+                start_secs,
+                max_fps=options.max_fps,
+                palette=options.palette,
+            )
+        )
+    if options.wled_protocol is not None:
+        outputs.append(
+            WLEDOutput(
+                title,
+                timeline,
+                start_secs,
+                protocol=options.wled_protocol,
+                host=options.wled_host,
+                palette=options.palette,
+                layout=options.layout,
+            )
+        )
+    if options.record_dir is not None:
+        path = options.record_dir / (title if record_name is None else record_name)
+        outputs.append(Recorder(path, timeline, start_secs))
+    if options.relay_host is not None:
+        outputs.append(Relay(options.relay_host, options.relay_port))
+    return outputs
+
+
+class DisplayOutput(Subscriber):
+    """
+    Shows a `Display` of its own, which each batch is applied to.
+
+    For live batches, `latency` collects how long they took from arriving to
+    being shown. Subclasses call `_take_unshown` as they take a snapshot of the
+    display, then `_shown` once it's out.
+    """
+
+    def __init__(
+        self,
+        title: str,
+        timeline: Timeline | None,
+        start_secs: float = 0.0,
+        palette: Palette | None = None,
+    ) -> None:
+        self._display = Display(
+            title=title,
+            # There's no end to a live performance
+            duration_secs=0.0 if timeline is None else timeline.length_secs,
+            progress_secs=start_secs,
+            palette=palette,
+        )
+        if timeline is not None and start_secs > 0:
+            self._display.restore(timeline.seek(start_secs).state)
+
+        self.latency = TimingStats()
+        # When the oldest live message that's not been shown yet arrived
+        self._unshown_since: float | None = None
+
+    async def handle(self, batch: AnyBatch) -> None:
+        with tracing.span("display update"):
+            batch.apply_to(self._display)
+        if self._unshown_since is None:
+            self._unshown_since = batch.received_at
+        await self.updated()
+
+    async def updated(self) -> None:
+        """Called once each batch has been applied to the display."""
+
+    def _take_unshown(self) -> float | None:
+        since, self._unshown_since = self._unshown_since, None
+        return since
+
+    def _shown(self, since: float | None) -> None:
+        if since is not None:
+            self.latency.add(time.perf_counter() - since)
+
+
+class TerminalOutput(DisplayOutput):
+    """
+    Shows the display in the terminal, redrawing at most `max_fps` times per
+    second.
+    """
+
+    name = "terminal"
+
+    def __init__(
+        self,
+        title: str,
+        timeline: Timeline | None,
+        start_secs: float = 0.0,
+        max_fps: float = DEFAULT_MAX_FPS,
+        palette: Palette | None = None,
+    ) -> None:
+        super().__init__(title, timeline, start_secs, palette)
+        self._live = Live(console=get_console(), auto_refresh=False)
+
+        panel_renderer = PanelRenderer(self._display, with_instruments=False)
+        self._renderer = FrameRenderer(
+            self._display,
+            build=lambda _: (panel_renderer.render(), self._take_unshown()),
+            output=self._output,
+            max_fps=max_fps,
+        )
+
+    async def open(self) -> None:
+        self._live.start()
+        self._renderer.start()
+
+    async def close(self) -> None:
+        try:
+            await self._renderer.stop()
+            log(1, f"Rendered {self._renderer.stats}")
+        finally:
+            # Clear the screen at the end
+            self._live.update("", refresh=True)
+            self._live.stop()
+
+    def _output(self, frame: tuple[Panel, float | None]) -> None:
+        panel, since = frame
+        self._live.update(panel, refresh=True)
+        self._shown(since)
+
+
+class AnsiTerminalOutput(DisplayOutput):
+    """
+    Shows the display in the terminal like `TerminalOutput`, but writes ANSI
+    escape codes directly, on the alternate screen, which takes far less CPU.
+    """
+
+    name = "terminal"
+
+    def __init__(
+        self,
+        title: str,
+        timeline: Timeline | None,
+        start_secs: float = 0.0,
+        max_fps: float = DEFAULT_MAX_FPS,
+        palette: Palette | None = None,
+        stream: TextIO | None = None,
+    ) -> None:
+        super().__init__(title, timeline, start_secs, palette)
+        self._stream = stream if stream is not None else sys.stdout
+
+        ansi_renderer = AnsiRenderer(self._display)
+        self._renderer = FrameRenderer(
+            self._display,
+            build=lambda _: (ansi_renderer.render(), self._take_unshown()),
+            output=self._output,
+            max_fps=max_fps,
+        )
+
+    async def open(self) -> None:
+        self._write(ENTER_SCREEN)
+        self._renderer.start()
+
+    async def close(self) -> None:
+        try:
+            await self._renderer.stop()
+        finally:
+            self._write(LEAVE_SCREEN)
+        log(1, f"Rendered {self._renderer.stats}")
+
+    def _output(self, frame: tuple[str, float | None]) -> None:
+        text, since = frame
+        self._write(text)
+        self._shown(since)
+
+    def _write(self, text: str) -> None:
+        self._stream.write(text)
+        self._stream.flush()
+
+
+class WLEDOutput(DisplayOutput):
+    """
+    Sends the display to WLED, as soon as each batch changes it, arranged by
+    `layout`.
+    """
+
+    name = "wled"
+
+    def __init__(
+        self,
+        title: str,
+        timeline: Timeline | None,
+        start_secs: float = 0.0,
+        protocol: WLEDProtocol = WLEDProtocol.JSON,
+        host: str = HOST,
+        palette: Palette | None = None,
+        layout: Layout | None = None,
+    ) -> None:
+        super().__init__(title, timeline, start_secs, palette)
+        self._changes = self._display.track_changes()
+        self._layout = default_layout() if layout is None else layout
+        self._client = open_client(protocol, host=host)
+        self._exit_stack = ExitStack()
+
+    async def open(self) -> None:
+        self._exit_stack.enter_context(self._client)
+        try:
+            self._client.submit_frame(self._layout.leds(self._display.colors))
+        except BaseException:
+            self._exit_stack.close()
+            raise
+        self._changes.drain()
+
+    async def updated(self) -> None:
+        since = self._take_unshown()
+        if not self._changes:
+            return
+        changed = self._layout.changed_leds(self._changes.drain())
+        # Changes outside the layout's notes don't show
+        if changed:
+            with tracing.span("wled submit"):
+                self._client.submit_frame(
+                    self._layout.leds(self._display.colors), changed
+                )
+            self._shown(since)
+
+    async def close(self) -> None:
+        self._exit_stack.close()
+        log(1, f"WLED: {self._client.stats}")
+
+
+class Recorder(Subscriber):
+    """
+    Records everything that was played to a type 0 MIDI file.
+
+    When playback starts part way through, the recording starts with the
+    messages that brought the synth up to date.
+    """
+
+    name = "recorder"
+
+    def __init__(
+        self, path: Path, timeline: Timeline | None = None, start_secs: float = 0.0
+    ) -> None:
+        self._path = path
+        self._timeline = timeline
+        self._start_secs = start_secs
+        self._track = mido.MidiTrack()
+        self._ticks = 0
+
+    async def open(self) -> None:
+        if self._timeline is not None and self._start_secs > 0:
+            self._track.extend(
+                self._timeline.seek(self._start_secs).state.restore_messages()
+            )
+
+    async def handle(self, batch: AnyBatch) -> None:
+        for time_secs, message in batch.timed_messages():
+            # Work from absolute ticks, so rounding errors don't accumulate
+            ticks = round(
+                mido.second2tick(time_secs - self._start_secs, TICKS_PER_BEAT, TEMPO)
+            )
+            delta = max(ticks - self._ticks, 0)
+            self._ticks += delta
+            self._track.append(message.copy(time=delta))
+
+    async def close(self) -> None:
+        midi_file = mido.MidiFile(type=0, ticks_per_beat=TICKS_PER_BEAT)
+        midi_file.tracks.append(self._track)
+        midi_file.save(self._path)
+        log(1, f"Recorded {len(self._track)} messages to {self._path}")
+
+
+class Relay(Subscriber):
+    """
+    Forwards everything that was played to another host over UDP.
+
+    Each datagram is a `RELAY_HEADER` followed by raw MIDI bytes of messages
+    that were all due at that time. Batches are split wherever the time
+    changes, and between messages when they're too big for one datagram.
+    """
+
+    name = "relay"
+
+    def __init__(self, host: str, port: int = RELAY_PORT) -> None:
+        self._address = (host, port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    async def handle(self, batch: AnyBatch) -> None:
+        datagram = bytearray()
+        datagram_secs = None
+        for time_secs, data in batch.timed_bytes():
+            if time_secs != datagram_secs or (
+                len(datagram) + len(data) > MAX_DATAGRAM
+                and len(datagram) > RELAY_HEADER.size
+            ):
+                if len(datagram) > RELAY_HEADER.size:
+                    self._send(datagram)
+                datagram = bytearray(RELAY_HEADER.pack(time_secs))
+                datagram_secs = time_secs
+            datagram += data
+        if len(datagram) > RELAY_HEADER.size:
+            self._send(datagram)
+
+    async def close(self) -> None:
+        self._socket.close()
+
+    def _send(self, datagram: bytearray) -> None:
+        try:
+            self._socket.sendto(datagram, self._address)
+        except OSError as e:
+            log(1, f"Relay packet failed: {type(e).__name__}: {e}")
@@ -0,0 +1,112 @@
+"""
+Palettes, which decide the colour of each note from its program and loudness
+
+A note's brightness `level` (0-255) is its velocity scaled by its channel's
+volume. Palettes build a ramp of colours per program, lazily, as translation
+tables for `bytes.translate`, so a whole channel is recolored with a handful of
+translations and no per-note arithmetic.
+"""
+
+import abc
+import colorsys
+import enum
+
+from midivis.midi_metadata import NOTES_PER_CHANNEL
+
+NUM_PROGRAMS = 128
+
+# Stands in for the program of the percussion channel, whose program changes
+# select drum kits rather than instruments
+PERCUSSION = NUM_PROGRAMS
+
+MAX_LEVEL = 255
+
+# `LEVELS[volume]` maps each velocity to its brightness level at that volume
+LEVELS = [
+    bytes(
+        velocity * volume * MAX_LEVEL // (0x7F * 0x7F)
+        if velocity < NOTES_PER_CHANNEL
+        else 0
+        for velocity in range(256)
+    )
+    for volume in range(NOTES_PER_CHANNEL)
+]
+
+
+class Palette(abc.ABC):
+    """
+    Maps a program (or `PERCUSSION`) and a brightness level to a colour.
+
+    Subclasses implement `color`. Level 0 is always black.
+    """
+
+    def __init__(self) -> None:
+        self._ramps: list[tuple[bytes, bytes, bytes] | None] = [None] * (
+            NUM_PROGRAMS + 1
+        )
+
+    @abc.abstractmethod
+    def color(self, program: int, level: int) -> tuple[int, int, int]:
+        """Returns the r, g, b colour of `program` at `level` (from 1)."""
+
+    def ramp(self, program: int) -> tuple[bytes, bytes, bytes]:
+        """
+        Returns translation tables mapping levels to the r, g and b values for
+        `program`.
+        """
+        ramp = self._ramps[program]
+        if ramp is None:
+            tables = (bytearray(256), bytearray(256), bytearray(256))
+            for level in range(1, MAX_LEVEL + 1):
+                for table, x in zip(tables, self.color(program, level)):
+                    table[level] = x
+            r, g, b = tables
+            ramp = self._ramps[program] = (bytes(r), bytes(g), bytes(b))
+        return ramp
+
+
+class HuePalette(Palette):
+    """
+    Colours each program with its own hue, and percussion white.
+    """
+
+    def color(self, program: int, level: int) -> tuple[int, int, int]:
+        if program == PERCUSSION:
+            hue, sat = 0.0, 0.0
+        else:
+            hue, sat = program / 0x7F, 1.0
+        r, g, b = (int(x * 255) for x in colorsys.hsv_to_rgb(hue, sat, level / 255))
+        return r, g, b
+
+
+class HeatPalette(Palette):
+    """
+    Ignores the program: quiet notes glow red, and loud ones burn through
+    yellow to white. Percussion is blue.
+    """
+
+    def color(self, program: int, level: int) -> tuple[int, int, int]:
+        if program == PERCUSSION:
+            return level // 4, level // 2, level
+        r = min(level * 3, 255)
+        g = min(max(level * 3 - 255, 0), 255)
+        b = min(max(level * 3 - 510, 0), 255)
+        return r, g, b
+
+
+class PaletteName(enum.StrEnum):
+    HUE = "hue"
+    HEAT = "heat"
+
+
+_PALETTES: dict[PaletteName, Palette] = {}
+
+
+def get_palette(name: PaletteName = PaletteName.HUE) -> Palette:
+    """Returns the shared instance of a palette, so its ramps are only built once."""
+    palette = _PALETTES.get(name)
+    if palette is None:
+        palette = _PALETTES[name] = (
+            HuePalette() if name == PaletteName.HUE else HeatPalette()
+        )
+    return palette
@@ -1,29 +1,47 @@
 import asyncio
-import itertools
 import pathlib
 import subprocess
 import time
-from collections.abc import AsyncIterator, Iterable, Iterator
+from collections.abc import Iterable, Iterator
 from contextlib import contextmanager
 from typing import Any
 
 import mido
 from mido.ports import BaseOutput
-from rich.live import Live
 
-from midivis.display import Display, to_panel
-from midivis.utils import get_console, log
-from midivis.wled import set_leds_all
-
-
-class Track:
-    pass
+from midivis import tracing
+from midivis.bus import MAX_POLL_SECS, play_to
+from midivis.display import RGB
+from midivis.frames import FrameFile, load_frames
+from midivis.layout import Layout, default_layout
+from midivis.outputs import OutputOptions, open_outputs
+from midivis.playlist import Playlist, PlaylistEntry, Prefetcher, Track
+from midivis.scheduler import Scheduler
+from midivis.timeline import Timeline
+from midivis.utils import log
+from midivis.wled import HOST
+from midivis.wled_realtime import WLEDProtocol, open_client
 
 
 class Player:
     def __init__(self) -> None:
         # self._listeners = []
-        pass
+        self.playlist = Playlist()
+        self._prefetcher = Prefetcher(self.playlist)
+
+    def __enter__(self) -> "Player":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops compiling upcoming tracks."""
+        self._prefetcher.close()
+
+    async def timeline(self, entry: PlaylistEntry) -> Timeline:
+        """Returns the compiled timeline for `entry`, waiting for it if necessary."""
+        return await self._prefetcher.timeline(entry)
 
     async def play(self) -> None:
         pass
@@ -31,19 +49,16 @@ class Player:
     async def pause(self) -> None:
         pass
 
-    async def seek(self, delta_seconds: float = 10) -> None:
-        # stop all notes
-        # iterate through all messages, ignoring note_on and note_off
-        pass
-
     async def stop(self) -> None:
         pass
 
     async def next(self) -> None:
-        pass
+        self.playlist.advance()
+        self._prefetcher.refresh()
 
     async def previous(self) -> None:
-        pass
+        self.playlist.back()
+        self._prefetcher.refresh()
 
     async def listen(self) -> Iterator[Any]:
         """Listen to MIDI events"""
@@ -51,79 +66,23 @@ class Player:
 
     # Playlist management
 
-    async def add_track(self, track: Track) -> None:
-        pass
+    async def add_track(self, track: Track) -> int:
+        """Adds a track to the end of the playlist, returning its playlist ID."""
+        playlist_id = self.playlist.add(track)
+        self._prefetcher.refresh()
+        return playlist_id
 
     async def remove_track(self, playlist_id: int) -> None:
-        pass
+        self.playlist.remove(playlist_id)
+        self._prefetcher.refresh()
 
     async def bump_track_up(self, playlist_id: int) -> None:
-        pass
+        self.playlist.move(playlist_id, -1)
+        self._prefetcher.refresh()
 
     async def bump_track_down(self, playlist_id: int) -> None:
-        pass
-
-
-async def play_async(
-    midi_file: mido.MidiFile,
-    meta_messages: bool = False,
-    start_secs: float = 0.0,
-    synth_port: BaseOutput | None = None,
-) -> AsyncIterator[tuple[list[mido.Message | mido.MetaMessage], float]]:
-    """
-    Async generator that yields MIDI messages in real time.
-
-    This is similar to `MidiFile.play()`, except that it:
-        - uses async sleeps instead of blocking ones
-        - groups simultaneous messages together
-    """
-
-    abs_start_time = time.monotonic() - start_secs
-    progress_secs = 0.0
-
-    message_group: list[mido.Message] = []
-
-    for message in midi_file:
-        want_message = True
-
-        if isinstance(message, mido.MetaMessage) and not meta_messages:
-            want_message = False
-
-        if progress_secs < start_secs and message.type in {"note_on", "note_off"}:
-            # Skip note on/off messages before we start. Note that
-            # we must not skip other messages since they may have
-            # side-effects, eg `program_change`. This does mean
-            # that any notes whose `note_off` has not yet occurred
-            # at `start_secs` will not be sounding.
-            want_message = False
-
-        if message.time > 0:
-            # yield the previous group (if nonempty)
-            if message_group:
-                yield message_group, progress_secs
-
-            # start a new group with the message
-            message_group = [message] if want_message else []
-
-            # sleep until the message should be played
-            progress_secs += message.time
-
-            playback_time = time.monotonic() - abs_start_time
-            seconds_to_next_event = progress_secs - playback_time
-
-            if seconds_to_next_event > 0:
-                await asyncio.sleep(seconds_to_next_event)
-
-        elif want_message:
-            # message has time 0; append it to the existing group
-            message_group.append(message)
-
-        if want_message and synth_port is not None:
-            synth_port.send(message)
-
-    # yield any final group:
-    if message_group:
-        yield message_group, progress_secs
+        self.playlist.move(playlist_id, 1)
+        self._prefetcher.refresh()
 
 
 @contextmanager
@@ -151,63 +110,142 @@ def port() -> Iterator[BaseOutput]:
             timidity_handle.terminate()
 
 
-async def play_wled(
-    synth_port: BaseOutput, midi_path: pathlib.Path, start_secs: float = 0.0
+async def play_frames(
+    synth_port: BaseOutput,
+    midi_path: pathlib.Path,
+    timeline: Timeline,
+    frames: FrameFile,
+    start_secs: float = 0.0,
+    protocol: WLEDProtocol = WLEDProtocol.JSON,
+    host: str = HOST,
+    layout: Layout | None = None,
 ) -> None:
-    mf = mido.MidiFile(filename=midi_path, clip=True)
-
-    display = Display(
-        title=str(midi_path), duration_secs=mf.length, progress_secs=start_secs
-    )
-
-    async for messages, progress_secs in play_async(
-        mf, start_secs=start_secs, synth_port=synth_port
-    ):
-        for message in messages:
-            display.update(message, progress_secs)
-
-        if display.needs_redraw:
-            set_leds_all(itertools.chain(*display.colors))
+    """
+    Plays a MIDI file to the synth while streaming its pre-rendered frames to
+    WLED, without computing any colours.
+    """
+    if layout is None:
+        layout = default_layout()
+    times = frames.times
+    num_frames = len(frames)
+
+    buffer = bytearray(frames.num_leds * RGB)
+    frame = memoryview(buffer)
+
+    # Catch up to the starting position without sending anything
+    index = 0
+    while index < num_frames and times[index] <= start_secs:
+        frames.apply(index, buffer, [])
+        index += 1
+
+    scheduler = Scheduler(timeline, synth_port=synth_port, start_secs=start_secs)
+    profiler = tracing.get_profiler()
+
+    with open_client(protocol, host=host) as client:
+        client.submit_frame(layout.leds(frame))
+
+        scheduler.start()
+        try:
+            while index < num_frames:
+                wait_secs = times[index] - scheduler.playback_secs()
+                if wait_secs > 0:
+                    await asyncio.sleep(wait_secs)
+
+                # Send every frame that's due (if we've fallen behind) as one
+                changed: list[int] = []
+                now = scheduler.playback_secs()
+                if profiler is not None:
+                    profiler.record_lateness("frame due", now - times[index])
+                with tracing.span("frame apply"):
+                    while index < num_frames and times[index] <= now:
+                        frames.apply(index, buffer, changed)
+                        index += 1
+                changed_leds = layout.changed_leds(changed)
+                if changed_leds:
+                    with tracing.span("wled submit"):
+                        client.submit_frame(layout.leds(frame), changed_leds)
+
+                # Nothing else wants the sent groups
+                scheduler.groups.clear()
+
+            while not scheduler.finished:
+                await asyncio.sleep(MAX_POLL_SECS)
+        finally:
+            scheduler.stop()
+
+    log(1, f"Timing error for {len(scheduler.stats)} groups: {scheduler.stats}")
+    log(1, f"WLED: {client.stats}")
+
+
+async def play_file(
+    synth_port: BaseOutput,
+    midi_path: pathlib.Path,
+    timeline: Timeline,
+    start_secs: float = 0.0,
+    options: OutputOptions = OutputOptions(),
+) -> None:
+    """Plays a MIDI file to the synth, and to each of the chosen outputs."""
+    outputs = open_outputs(options, midi_path.name, timeline, start_secs)
+    await play_to(timeline, outputs, start_secs=start_secs, synth_port=synth_port)
 
 
-async def play_terminal(
-    synth_port: BaseOutput, midi_path: pathlib.Path, start_secs: float = 0.0
+def play_many(
+    paths: Iterable[pathlib.Path],
+    options: OutputOptions = OutputOptions(),
+    prerendered: bool = False,
+    start_secs: float = 0.0,
 ) -> None:
-    mf = mido.MidiFile(filename=midi_path, clip=True)
-
-    display = Display(
-        title=str(midi_path.name), duration_secs=mf.length, progress_secs=start_secs
+    """Plays each file in turn, starting `start_secs` into the first one."""
+    asyncio.run(
+        _play_many(
+            paths, options=options, prerendered=prerendered, start_secs=start_secs
+        )
     )
 
-    with Live(console=get_console(), auto_refresh=False) as live:
-        async for messages, progress_secs in play_async(
-            mf, start_secs=start_secs, synth_port=synth_port
-        ):
-            # TODO: Consider splitting out "play" into its own thread/process
-
-            for message in messages:
-                display.update(message, progress_secs)
 
-            if display.needs_redraw:
-                live.update(to_panel(display, with_instruments=False), refresh=True)
-
-        # Clear the screen at the end
-        live.update("", refresh=True)
-
-
-def play_many(paths: Iterable[pathlib.Path]) -> None:
-    asyncio.run(_play_many(paths))
-
-
-async def _play_many(paths: Iterable[pathlib.Path]) -> None:
-    with port() as synth_port:
+async def _play_many(
+    paths: Iterable[pathlib.Path],
+    options: OutputOptions,
+    prerendered: bool,
+    start_secs: float,
+) -> None:
+    with port() as synth_port, Player() as player:
         for path in paths:
+            await player.add_track(Track(path))
+        playlist = player.playlist
+        while (entry := playlist.current) is not None:
+            path = entry.track.path
             try:
-                # await play_wled(synth_port, path)
-                await play_terminal(synth_port, path)
+                # The next tracks are compiled while this one plays, so this
+                # only has to wait for the first
+                with tracing.span("wait for timeline"):
+                    timeline = await player.timeline(entry)
+
+                if options.wled_protocol is not None and prerendered:
+                    await play_frames(
+                        synth_port,
+                        path,
+                        timeline,
+                        load_frames(path, fps=options.max_fps),
+                        start_secs=start_secs,
+                        protocol=options.wled_protocol,
+                        host=options.wled_host,
+                        layout=options.layout,
+                    )
+                else:
+                    await play_file(
+                        synth_port,
+                        path,
+                        timeline,
+                        start_secs=start_secs,
+                        options=options,
+                    )
             except Exception as e:
                 log(0, f"{type(e).__name__}: {e}")
                 raise
+            playlist.advance()
+            # Only the first track starts part way through
+            start_secs = 0.0
 
 
 # Good ones:
@@ -0,0 +1,204 @@
+"""
+Playlists, with the upcoming tracks compiled in the background for gapless
+playback
+"""
+
+import asyncio
+import itertools
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import NamedTuple
+
+from midivis.cache import load_cached_timeline
+from midivis.timeline import Timeline
+from midivis.utils import log
+
+# How many tracks after the current one to have ready
+PREFETCH_TRACKS = 2
+
+# Prefetching stops at the next track once the loaded tracks take this much
+# memory
+DEFAULT_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Track:
+    path: Path
+
+    @property
+    def title(self) -> str:
+        return self.path.name
+
+
+class PlaylistEntry(NamedTuple):
+    # Tells entries apart, even when the same track is on the playlist twice
+    playlist_id: int
+    track: Track
+
+
+class Playlist:
+    """
+    An ordered list of tracks, and the position of the current one.
+
+    The current entry stays current when the playlist is rearranged around it.
+    Once the position is past the last entry, there is no current entry.
+    """
+
+    def __init__(self, tracks: Iterable[Track] = ()) -> None:
+        self._entries: list[PlaylistEntry] = []
+        self._position = 0
+        self._ids = itertools.count(1)
+        for track in tracks:
+            self.add(track)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[PlaylistEntry]:
+        return iter(self._entries)
+
+    @property
+    def current(self) -> PlaylistEntry | None:
+        if self._position < len(self._entries):
+            return self._entries[self._position]
+        return None
+
+    def upcoming(self) -> list[PlaylistEntry]:
+        """Returns the current entry, followed by the ones after it."""
+        return self._entries[self._position :]
+
+    def add(self, track: Track) -> int:
+        """Adds a track to the end, returning its playlist ID."""
+        playlist_id = next(self._ids)
+        self._entries.append(PlaylistEntry(playlist_id, track))
+        return playlist_id
+
+    def remove(self, playlist_id: int) -> None:
+        """
+        Removes an entry. If it was the current one, the entry after it becomes
+        current.
+        """
+        index = self._index(playlist_id)
+        del self._entries[index]
+        if index < self._position:
+            self._position -= 1
+
+    def move(self, playlist_id: int, offset: int) -> None:
+        """Moves an entry `offset` places later (or earlier, if negative)."""
+        index = self._index(playlist_id)
+        new_index = min(max(index + offset, 0), len(self._entries) - 1)
+        current = self.current
+        self._entries.insert(new_index, self._entries.pop(index))
+        if current is not None:
+            self._position = self._entries.index(current)
+
+    def advance(self) -> None:
+        self._position = min(self._position + 1, len(self._entries))
+
+    def back(self) -> None:
+        self._position = max(self._position - 1, 0)
+
+    def _index(self, playlist_id: int) -> int:
+        for index, entry in enumerate(self._entries):
+            if entry.playlist_id == playlist_id:
+                return index
+        raise KeyError(f"No entry {playlist_id} on the playlist")
+
+
+def _load(path: Path) -> Timeline:
+    timeline = load_cached_timeline(path)
+    # `messages` is built (and kept) on first access. Do that here, on the
+    # worker thread, so it doesn't hold up the start of the track.
+    _ = timeline.messages
+    return timeline
+
+
+class Prefetcher:
+    """
+    Compiles the current track and the next `tracks` tracks of a playlist on a
+    worker thread, one at a time, so each one is ready before the previous one
+    finishes.
+
+    Tracks after the next one are only started while the tracks already loaded
+    fit within `budget_bytes`. Call `refresh` whenever the playlist changes.
+    """
+
+    def __init__(
+        self,
+        playlist: Playlist,
+        tracks: int = PREFETCH_TRACKS,
+        budget_bytes: int = DEFAULT_BUDGET_BYTES,
+    ) -> None:
+        self._playlist = playlist
+        self._tracks = tracks
+        self._budget_bytes = budget_bytes
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="prefetch"
+        )
+        self._loading: dict[int, asyncio.Future[Timeline]] = {}
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    async def timeline(self, entry: PlaylistEntry) -> Timeline:
+        """
+        Returns the compiled timeline for the current entry, waiting for it if
+        necessary.
+        """
+        self.refresh()
+        future = self._loading.get(entry.playlist_id)
+        if future is None:
+            future = self._load(entry)
+        return await future
+
+    def refresh(self) -> None:
+        """
+        Starts loading the next track that's due, and forgets any that are no
+        longer coming up.
+        """
+        wanted = set()
+        total_bytes = 0
+        for n, entry in enumerate(self._playlist.upcoming()[: self._tracks + 1]):
+            future = self._loading.get(entry.playlist_id)
+            if future is None:
+                if n > 1 and total_bytes >= self._budget_bytes:
+                    log(1, f"Not prefetching {entry.track.path}: over budget")
+                    break
+                future = self._load(entry)
+            wanted.add(entry.playlist_id)
+            if not future.done():
+                break
+            if not future.cancelled() and future.exception() is None:
+                total_bytes += future.result().nbytes
+
+        for playlist_id in self._loading.keys() - wanted:
+            self._loading.pop(playlist_id).cancel()
+
+    def close(self) -> None:
+        for future in self._loading.values():
+            future.cancel()
+        self._loading.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, entry: PlaylistEntry) -> asyncio.Future[Timeline]:
+        log(1, f"Prefetching {entry.track.path}")
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, _load, entry.track.path
+        )
+        future.add_done_callback(self._loaded)
+        self._loading[entry.playlist_id] = future
+        return future
+
+    def _loaded(self, future: asyncio.Future[Timeline]) -> None:
+        if future.cancelled():
+            return
+        if (e := future.exception()) is not None:
+            # Raised again when the track is due to play
+            log(1, f"Unable to prefetch: {type(e).__name__}: {e}")
+        # Move on to the next track
+        self.refresh()
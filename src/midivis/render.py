@@ -0,0 +1,123 @@
+"""
+Renders the display independently of playback, at a capped frame rate
+"""
+
+import asyncio
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Generic, TypeVar
+
+from midivis import tracing
+from midivis.display import Display
+
+DEFAULT_MAX_FPS = 30.0
+
+FrameT = TypeVar("FrameT")
+
+
+@dataclass
+class RenderStats:
+    # Frames that were output
+    frames: int = 0
+
+    # Frame slots that were missed because the previous frame was still being
+    # output (the changes are picked up by the next frame)
+    dropped: int = 0
+
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def fps(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.frames} frames ({self.fps:.1f} fps), {self.dropped} dropped"
+
+
+class FrameRenderer(Generic[FrameT]):
+    """
+    Periodically renders the latest state of a `Display`.
+
+    On each tick (at most `max_fps` times per second), if the display has
+    changed then `build` is called on the event loop to take a snapshot of it,
+    and `output` is called with the snapshot on a worker thread. Any changes made
+    in between ticks, or while the previous frame is still being output, are
+    coalesced into the next frame.
+
+    This means playback never has to wait for the output, however slow it is.
+    """
+
+    def __init__(
+        self,
+        display: Display,
+        build: Callable[[Display], FrameT],
+        output: Callable[[FrameT], object],
+        max_fps: float = DEFAULT_MAX_FPS,
+    ) -> None:
+        self._display = display
+        self._build = build
+        self._output = output
+        self._frame_secs = 1 / max_fps
+
+        self._task: asyncio.Task[None] | None = None
+        self._stopping = asyncio.Event()
+        self._last_rendered = (-1, -1)
+
+        self.stats = RenderStats()
+
+    def start(self) -> None:
+        self.stats = RenderStats()
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops rendering, after outputting any outstanding changes."""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.render()
+
+    async def render(self) -> None:
+        """Outputs a frame, if the display has changed since the last one."""
+        display = self._display
+        # The subtitle shows whole seconds, so that's all that's worth redrawing for
+        state = (display.generation, int(display.progress_secs))
+        if state == self._last_rendered:
+            return
+
+        self._last_rendered = state
+
+        with tracing.span("frame build"):
+            frame = self._build(display)
+        await asyncio.to_thread(self._traced_output, frame)
+        self.stats.frames += 1
+
+    def _traced_output(self, frame: FrameT) -> None:
+        with tracing.span("frame output"):
+            self._output(frame)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        profiler = tracing.get_profiler()
+        while not self._stopping.is_set():
+            if profiler is not None:
+                profiler.record_lateness("frame tick", loop.time() - next_frame)
+            await self.render()
+
+            # Skip any ticks we missed while rendering, rather than trying to
+            # catch up
+            next_frame += self._frame_secs
+            missed = int((loop.time() - next_frame) / self._frame_secs)
+            if missed > 0:
+                self.stats.dropped += missed
+                next_frame += missed * self._frame_secs
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=next_frame - loop.time()
+                )
+            except TimeoutError:
+                pass
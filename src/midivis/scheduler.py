@@ -0,0 +1,187 @@
+"""
+Drift-free playback of compiled timelines on a dedicated thread
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Protocol
+
+from mido.ports import BaseOutput
+
+from midivis.timeline import Timeline
+from midivis.tracing import TimingStats, get_profiler
+from midivis.utils import log
+
+# How long before a deadline to stop sleeping and start spinning
+SPIN_SECS = 0.002
+
+
+class Clock(Protocol):
+    def now(self) -> float:
+        """Returns the current time in seconds."""
+        ...
+
+    def wait_until(self, deadline: float, interrupt: threading.Event) -> None:
+        """Blocks until `deadline`, or until `interrupt` is set."""
+        ...
+
+
+class MonotonicClock:
+    """
+    A real-time clock.
+
+    Waits sleep until shortly before the deadline, then spin until it passes,
+    since a plain sleep can overshoot by a millisecond or more.
+    """
+
+    def __init__(self, spin_secs: float = SPIN_SECS) -> None:
+        self._spin_secs = spin_secs
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def wait_until(self, deadline: float, interrupt: threading.Event) -> None:
+        remaining = deadline - time.perf_counter()
+        if remaining > self._spin_secs:
+            if interrupt.wait(remaining - self._spin_secs):
+                return
+        while time.perf_counter() < deadline:
+            pass
+
+
+class VirtualClock:
+    """
+    A clock that jumps straight to each deadline, for running faster than
+    real time.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def wait_until(self, deadline: float, interrupt: threading.Event) -> None:
+        self._now = max(self._now, deadline)
+
+
+class Scheduler:
+    """
+    Plays a timeline to a synth port on its own thread.
+
+    Each group of simultaneous events has an absolute deadline (relative to when
+    playback started), so errors in one wait do not accumulate into the next.
+
+    As each group is sent, `(start, stop, progress_secs)` is appended to
+    `groups`, for the UI to consume at its own pace. The deque is only appended
+    to by the scheduler thread and only popped by the consumer, which is
+    thread-safe without locking.
+    """
+
+    def __init__(
+        self,
+        timeline: Timeline,
+        synth_port: BaseOutput | None = None,
+        start_secs: float = 0.0,
+        clock: Clock | None = None,
+    ) -> None:
+        self._timeline = timeline
+        # Build these now, rather than once playback has started
+        self._messages = timeline.messages
+        self._synth_port = synth_port
+        self._start_secs = start_secs
+        self._clock = clock if clock is not None else MonotonicClock()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._abs_start_time = 0.0
+
+        self.groups: deque[tuple[int, int, float]] = deque()
+        self.stats = TimingStats()
+
+    @property
+    def clock(self) -> Clock:
+        return self._clock
+
+    @property
+    def finished(self) -> bool:
+        return not self._thread.is_alive()
+
+    def playback_secs(self) -> float:
+        """Returns the current playback position, in seconds."""
+        return self._clock.now() - self._abs_start_time
+
+    def start(self) -> None:
+        self._abs_start_time = self._clock.now() - self._start_secs
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        _raise_priority()
+
+        timeline = self._timeline
+        messages = self._messages
+        times = timeline.times
+        group_starts = timeline.group_starts
+        synth_port = self._synth_port
+        clock = self._clock
+        abs_start_time = self._abs_start_time
+        profiler = get_profiler()
+
+        first_group = 0
+        if self._start_secs > 0:
+            # Jump straight to the nearest keyframe, and bring the synth up to
+            # date (including any notes that should still be sounding)
+            seek_point = timeline.seek(self._start_secs)
+            first_group = timeline.group_index(seek_point.event_index)
+            if synth_port is not None:
+                for message in seek_point.state.restore_messages():
+                    synth_port.send(message)
+
+        for group in range(first_group, timeline.num_groups):
+            start = group_starts[group]
+            stop = group_starts[group + 1]
+            progress_secs = times[start]
+            deadline = abs_start_time + progress_secs
+
+            clock.wait_until(deadline, self._stop)
+            if self._stop.is_set():
+                break
+
+            send_start = time.perf_counter()
+            if synth_port is not None:
+                for i in range(start, stop):
+                    synth_port.send(messages[i])
+
+            late_secs = clock.now() - deadline
+            self.stats.add(late_secs)
+            if profiler is not None:
+                profiler.record("synth send", send_start, time.perf_counter())
+                profiler.record_lateness("scheduler", late_secs)
+            self.groups.append((start, stop, progress_secs))
+
+
+def _raise_priority() -> None:
+    """
+    Asks the OS to prioritise the calling thread.
+
+    This needs privileges that we will often not have, in which case we carry
+    on at normal priority.
+    """
+    try:
+        priority = os.sched_get_priority_min(os.SCHED_FIFO)
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return
+    except (AttributeError, OSError):
+        pass
+
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+    except (AttributeError, OSError):
+        log(1, "Unable to raise scheduler thread priority")
@@ -0,0 +1,262 @@
+"""
+A fast scanner for Standard MIDI Files, for gathering stats without mido
+
+See https://midi.org/standard-midi-files-specification
+"""
+
+import mmap
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from midivis.midi_metadata import NOTES_PER_CHANNEL, NUM_CHANNELS
+
+DEFAULT_TEMPO = 500_000  # microseconds per beat, ie 120 bpm
+
+# Number of data bytes following each channel message status nibble
+DATA_LENGTHS = {
+    0x80: 2,
+    0x90: 2,
+    0xA0: 2,
+    0xB0: 2,
+    0xC0: 1,
+    0xD0: 1,
+    0xE0: 2,
+}
+
+META = 0xFF
+META_SET_TEMPO = 0x51
+SYSEX = 0xF0
+SYSEX_ESCAPE = 0xF7
+
+
+class SMFError(ValueError):
+    """The file is malformed, or uses something the scanner doesn't support."""
+
+
+@dataclass
+class SMFSummary:
+    # How many note_on events there are for each note
+    note_counts: list[int] = field(default_factory=lambda: [0] * NOTES_PER_CHANNEL)
+
+    # How many note_on events there are on each channel
+    channel_counts: list[int] = field(default_factory=lambda: [0] * NUM_CHANNELS)
+
+    # How many program_change events there are for each program
+    program_counts: list[int] = field(default_factory=lambda: [0] * NOTES_PER_CHANNEL)
+
+    # `None` for asynchronous (type 2) files, which have no defined runtime
+    runtime_secs: float | None = None
+
+    @property
+    def note_count(self) -> int:
+        return sum(self.note_counts)
+
+    @property
+    def channels(self) -> set[int]:
+        return {channel for channel, count in enumerate(self.channel_counts) if count}
+
+    @property
+    def programs(self) -> set[int]:
+        return {program for program, count in enumerate(self.program_counts) if count}
+
+    @property
+    def note_min(self) -> int | None:
+        return next((n for n, count in enumerate(self.note_counts) if count), None)
+
+    @property
+    def note_max(self) -> int | None:
+        return next(
+            (n for n in reversed(range(NOTES_PER_CHANNEL)) if self.note_counts[n]),
+            None,
+        )
+
+
+def scan_smf_file(path: Path) -> SMFSummary:
+    """Scans the file at `path`, without reading it all into memory."""
+    with map_file(path) as data:
+        return scan_smf(data)
+
+
+@contextmanager
+def map_file(path: Path) -> Iterator[bytes | mmap.mmap]:
+    """Maps the file at `path` into memory, read only."""
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            yield b""
+            return
+        with data:
+            yield data
+
+
+def scan_smf(data: bytes | mmap.mmap) -> SMFSummary:
+    """
+    Computes stats for a Standard MIDI File in a single pass over its bytes.
+
+    This gives the same results as parsing the file with mido (with
+    `clip=False`) and looking at every message, but without building any
+    message objects. It is more lenient than mido about the contents of meta
+    messages other than tempo changes.
+
+    Raises `SMFError` for anything unexpected, in which case the caller should
+    fall back to mido.
+    """
+    if data[:4] != b"MThd":
+        raise SMFError("MThd not found")
+    header_size = int.from_bytes(data[4:8])
+    if header_size < 6 or len(data) < 8 + header_size:
+        raise SMFError("Truncated header")
+    file_type = int.from_bytes(data[8:10])
+    num_tracks = int.from_bytes(data[10:12])
+    ticks_per_beat = int.from_bytes(data[12:14])
+    if ticks_per_beat & 0x8000:
+        raise SMFError("SMPTE time division is not supported")
+    if ticks_per_beat == 0:
+        raise SMFError("Zero ticks per beat")
+
+    summary = SMFSummary()
+
+    # (tick, tempo) from every track, for working out the runtime
+    tempo_changes: list[tuple[int, int]] = []
+
+    try:
+        end_tick = _scan_tracks(
+            data, 8 + header_size, num_tracks, summary, tempo_changes
+        )
+    except IndexError as e:
+        raise SMFError("Truncated file") from e
+
+    if file_type != 2:
+        summary.runtime_secs = _ticks_to_secs(end_tick, tempo_changes, ticks_per_beat)
+
+    return summary
+
+
+def _scan_tracks(
+    data: bytes | mmap.mmap,
+    pos: int,
+    num_tracks: int,
+    summary: SMFSummary,
+    tempo_changes: list[tuple[int, int]],
+) -> int:
+    """
+    Scans the track chunks starting at `pos` into `summary` and `tempo_changes`.
+
+    Returns the tick at which the last track ends.
+    """
+    note_counts = summary.note_counts
+    channel_counts = summary.channel_counts
+    program_counts = summary.program_counts
+
+    end_tick = 0
+    size = len(data)
+
+    for _ in range(num_tracks):
+        if data[pos : pos + 4] != b"MTrk":
+            raise SMFError("MTrk not found")
+        track_end = pos + 8 + int.from_bytes(data[pos + 4 : pos + 8])
+        if track_end > size:
+            raise SMFError("Truncated track")
+        pos += 8
+
+        tick = 0
+        running_status = 0
+
+        while pos < track_end:
+            # Delta time
+            byte = 0x80
+            delta = 0
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+            tick += delta
+
+            status = data[pos]
+            if status & 0x80:
+                pos += 1
+                if status != META:
+                    running_status = status
+            elif running_status >= SYSEX:
+                # mido would read this as a sysex, which is probably not intended
+                raise SMFError("Running status after sysex")
+            elif running_status:
+                # Running status: this is the first data byte
+                status = running_status
+            else:
+                raise SMFError("Running status without a previous status")
+
+            kind = status & 0xF0
+            if kind < SYSEX:
+                data1 = data[pos]
+                if data1 & 0x80:
+                    raise SMFError("Data byte out of range")
+                if DATA_LENGTHS[kind] == 2:
+                    if data[pos + 1] & 0x80:
+                        raise SMFError("Data byte out of range")
+                    pos += 2
+                else:
+                    pos += 1
+
+                if kind == 0x90:
+                    note_counts[data1] += 1
+                    channel_counts[status & 0x0F] += 1
+                elif kind == 0xC0:
+                    program_counts[data1] += 1
+
+            elif status == META:
+                meta_type = data[pos]
+                pos += 1
+                length, pos = _read_variable_int(data, pos)
+                if meta_type == META_SET_TEMPO:
+                    if length != 3:
+                        raise SMFError("Bad tempo")
+                    tempo_changes.append((tick, int.from_bytes(data[pos : pos + 3])))
+                pos += length
+
+            elif status in (SYSEX, SYSEX_ESCAPE):
+                length, pos = _read_variable_int(data, pos)
+                pos += length
+
+            else:
+                raise SMFError(f"Unsupported status byte 0x{status:02x}")
+
+        if pos != track_end:
+            raise SMFError("Event overruns the end of its track")
+        end_tick = max(end_tick, tick)
+
+    return end_tick
+
+
+def _read_variable_int(data: bytes | mmap.mmap, pos: int) -> tuple[int, int]:
+    """Returns a variable length quantity, and the position after it."""
+    value = 0
+    byte = 0x80
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def _ticks_to_secs(
+    end_tick: int, tempo_changes: list[tuple[int, int]], ticks_per_beat: int
+) -> float:
+    """Converts a tick to seconds, following the tempo map."""
+    # Tempo changes at the same tick take effect in track order, like when
+    # mido merges the tracks
+    tempo_changes.sort(key=lambda change: change[0])
+
+    secs = 0.0
+    tick = 0
+    tempo = DEFAULT_TEMPO
+    for change_tick, new_tempo in tempo_changes:
+        secs += (change_tick - tick) * tempo / ticks_per_beat / 1e6
+        tick = change_tick
+        tempo = new_tempo
+    secs += (end_tick - tick) * tempo / ticks_per_beat / 1e6
+    return secs
@@ -1,5 +1,18 @@
+from datetime import timedelta
+
+from textual import work
 from textual.app import App, ComposeResult
-from textual.widgets import Button, Footer, Header, Placeholder, Static
+from textual.widgets import (
+    Button,
+    DataTable,
+    Footer,
+    Header,
+    Input,
+    Placeholder,
+    Static,
+)
+
+from midivis.library import Library, SearchPage
 
 # Useful: https://en.wikipedia.org/wiki/Media_control_symbols
 PLAY_ICON = "\u23f5"
@@ -38,16 +51,95 @@ class NotesContainer(Static):  # TODO: Consider using HorizontalScroll
 
 
 class PlaylistManager(Static):
+    def __init__(self, library: Library) -> None:
+        super().__init__()
+        self._library = library
+
     def compose(self) -> ComposeResult:
-        yield SearchWidget()
+        yield SearchWidget(self._library)
         yield Placeholder("Playlist add/remove/up/down buttons", id="playlist_buttons")
         yield Placeholder("Playlist", id="playlist")
 
 
 class SearchWidget(Static):
+    """
+    Searches the library as the user types.
+
+    Results are fetched a page at a time, with the next page loaded when the
+    cursor reaches the end of the table. Pages load separately from searches,
+    so scrolling never cancels a search, and a new search cancels (or
+    discards) any page that's still loading.
+    """
+
+    def __init__(self, library: Library) -> None:
+        super().__init__()
+        self._library = library
+        self._text = ""
+        self._page: SearchPage | None = None
+
     def compose(self) -> ComposeResult:
-        yield Placeholder("search box", id="search_box")
-        yield Placeholder("search results table", id="search_results_table")
+        yield Input(placeholder="Search", id="search_box")
+        yield DataTable(id="search_results_table", cursor_type="row")
+
+    def on_mount(self) -> None:
+        table = self.query_one(DataTable)
+        table.add_columns("Name", "Length", "Notes", "Path")
+        self.search("")
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        self.search(event.value)
+
+    def on_data_table_row_highlighted(self, event: DataTable.RowHighlighted) -> None:
+        table = self.query_one(DataTable)
+        if (
+            self._page is not None
+            and self._page.has_more
+            and event.cursor_row == table.row_count - 1
+        ):
+            self.load_more()
+
+    @work(exclusive=True, group="search")
+    async def search(self, text: str) -> None:
+        # Any page still loading is for the old results
+        self.workers.cancel_group(self, "load_more")
+        page = await self._library.search(text)
+        self._text = text
+        self._page = page
+        table = self.query_one(DataTable)
+        table.clear()
+        self._add_rows(page)
+
+    @work(exclusive=True, group="load_more")
+    async def load_more(self) -> None:
+        if self._page is None:
+            return
+        text = self._text
+        offset = self._page.offset + len(self._page.tracks)
+        page = await self._library.search(text, offset=offset)
+
+        # Throw the page away if the results changed while it was loading
+        current = self._page
+        if (
+            self._text != text
+            or current is None
+            or current.offset + len(current.tracks) != offset
+        ):
+            return
+        self._page = page
+        self._add_rows(page)
+
+    def _add_rows(self, page: SearchPage) -> None:
+        self.query_one(DataTable).add_rows(
+            (
+                track.file_name,
+                ""
+                if track.runtime_secs is None
+                else str(timedelta(seconds=int(track.runtime_secs))),
+                track.note_count,
+                track.file_path,
+            )
+            for track in page.tracks
+        )
 
 
 class MidiVisApp(App[int]):
@@ -57,6 +149,10 @@ class MidiVisApp(App[int]):
         ("q", "quit", "Quit"),
     ]
 
+    def __init__(self, library: Library) -> None:
+        super().__init__()
+        self.library = library
+
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
         yield Header()
@@ -64,9 +160,12 @@ class MidiVisApp(App[int]):
         yield PlayingTrackInfo("No track playing")
         yield Controls()
         yield TrackInfo()
-        yield PlaylistManager()
+        yield PlaylistManager(self.library)
+
+    def on_unmount(self) -> None:
+        self.library.close()
 
 
 if __name__ == "__main__":
-    app = MidiVisApp()
+    app = MidiVisApp(Library())
     app.run()
@@ -0,0 +1,424 @@
+"""
+Pre-compiled MIDI timelines for realtime playback
+"""
+
+import pathlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import mido
+
+from midivis.midi_metadata import NOTES_PER_CHANNEL, NUM_CHANNELS
+
+# Status nibbles of the channel messages we keep (the low nibble is the channel)
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLYTOUCH = 0xA0
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+AFTERTOUCH = 0xD0
+PITCHWHEEL = 0xE0
+SYSEX = 0xF0
+
+# How often to snapshot the channel state while compiling, for seeking
+KEYFRAME_INTERVAL_SECS = 5.0
+
+# Rough sizes for `Timeline.nbytes`: a time and four data bytes per event, a
+# snapshot of the channel state per keyframe, and a `mido.Message` per event
+# once `messages` has been built
+EVENT_BYTES = 12
+KEYFRAME_BYTES = 4300
+MESSAGE_BYTES = 230
+
+# Marks a program/controller/pitchwheel that the file has not (yet) set
+UNSET = 0xFF
+
+# Controllers that need special treatment when restoring state
+BANK_SELECT = (0, 32)
+DATA_ENTRY = (6, 38, 96, 97)
+PARAMETER_NUMBERS = (98, 99, 100, 101)
+ALL_SOUND_OFF = 120
+RESET_ALL_CONTROLLERS = 121
+ALL_NOTES_OFF = 123
+FIRST_CHANNEL_MODE_CONTROLLER = 120
+
+# The order to restore controllers in: bank select first (so that it applies to
+# the program change), parameter numbers last (so that they end up selected)
+RESTORE_ORDER = (
+    *BANK_SELECT,
+    *(
+        control
+        for control in range(FIRST_CHANNEL_MODE_CONTROLLER)
+        if control not in (*BANK_SELECT, *DATA_ENTRY, *PARAMETER_NUMBERS)
+    ),
+    *PARAMETER_NUMBERS,
+)
+
+
+class ChannelState:
+    """
+    The state of all 16 MIDI channels at a point in time.
+
+    Holds each channel's program, controllers (including volume) and
+    pitchwheel, plus the velocities of the notes that are sounding.
+    """
+
+    def __init__(self) -> None:
+        self.programs = bytearray([UNSET] * NUM_CHANNELS)
+        self.controllers = bytearray([UNSET] * (NUM_CHANNELS * 128))
+        self.pitchwheels = bytearray([UNSET] * (NUM_CHANNELS * 2))
+        self.velocities = bytearray(NUM_CHANNELS * NOTES_PER_CHANNEL)
+
+    def copy(self) -> "ChannelState":
+        state = ChannelState()
+        state.programs[:] = self.programs
+        state.controllers[:] = self.controllers
+        state.pitchwheels[:] = self.pitchwheels
+        state.velocities[:] = self.velocities
+        return state
+
+    def to_bytes(self) -> bytes:
+        return bytes(
+            self.programs + self.controllers + self.pitchwheels + self.velocities
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes | memoryview) -> "ChannelState":
+        """The inverse of `to_bytes`."""
+        state = cls()
+        pos = 0
+        for buffer in (
+            state.programs,
+            state.controllers,
+            state.pitchwheels,
+            state.velocities,
+        ):
+            buffer[:] = data[pos : pos + len(buffer)]
+            pos += len(buffer)
+        return state
+
+    def program(self, channel: int) -> int:
+        program = self.programs[channel]
+        return 0 if program == UNSET else program
+
+    def controller(self, channel: int, control: int, default: int) -> int:
+        value = self.controllers[channel * 128 + control]
+        return default if value == UNSET else value
+
+    def apply(self, status: int, channel: int, data1: int, data2: int) -> None:
+        """Updates the state with a single timeline event."""
+        match status:
+            case 0x90:  # note_on
+                self.velocities[channel * NOTES_PER_CHANNEL + data1] = data2
+
+            case 0x80:  # note_off
+                self.velocities[channel * NOTES_PER_CHANNEL + data1] = 0
+
+            case 0xC0:  # program_change
+                self.programs[channel] = data1
+
+            case 0xE0:  # pitchwheel
+                self.pitchwheels[channel * 2] = data1
+                self.pitchwheels[channel * 2 + 1] = data2
+
+            case 0xB0:  # control_change
+                if data1 < FIRST_CHANNEL_MODE_CONTROLLER:
+                    self.controllers[channel * 128 + data1] = data2
+                elif data1 == RESET_ALL_CONTROLLERS:
+                    self.controllers[channel * 128 : (channel + 1) * 128] = bytes(
+                        [UNSET] * 128
+                    )
+                    self.pitchwheels[channel * 2 : channel * 2 + 2] = bytes([UNSET] * 2)
+                elif data1 in (ALL_SOUND_OFF, ALL_NOTES_OFF):
+                    start = channel * NOTES_PER_CHANNEL
+                    self.velocities[start : start + NOTES_PER_CHANNEL] = bytes(
+                        NOTES_PER_CHANNEL
+                    )
+
+    def restore_messages(self) -> list[mido.Message]:
+        """
+        Returns the messages needed to bring a synth into this state.
+
+        Every channel is silenced and has its controllers reset, then only the
+        values that the file has set are sent, followed by the notes that
+        should be sounding.
+
+        Data entry controllers are not resent, since their meaning depends on
+        the order in which they were originally received.
+        """
+        messages = []
+        for channel in range(NUM_CHANNELS):
+            messages.append(
+                mido.Message(
+                    "control_change", channel=channel, control=ALL_SOUND_OFF, value=0
+                )
+            )
+            messages.append(
+                mido.Message(
+                    "control_change",
+                    channel=channel,
+                    control=RESET_ALL_CONTROLLERS,
+                    value=0,
+                )
+            )
+
+            base = channel * 128
+            for control in RESTORE_ORDER:
+                value = self.controllers[base + control]
+                if value != UNSET:
+                    messages.append(
+                        mido.Message(
+                            "control_change",
+                            channel=channel,
+                            control=control,
+                            value=value,
+                        )
+                    )
+                if control == BANK_SELECT[-1] and self.programs[channel] != UNSET:
+                    # Program changes must come after the bank select
+                    messages.append(
+                        mido.Message(
+                            "program_change",
+                            channel=channel,
+                            program=self.programs[channel],
+                        )
+                    )
+
+            lsb, msb = self.pitchwheels[channel * 2 : channel * 2 + 2]
+            if lsb != UNSET:
+                messages.append(mido.Message.from_bytes([0xE0 | channel, lsb, msb]))
+
+            start = channel * NOTES_PER_CHANNEL
+            for note, velocity in enumerate(
+                self.velocities[start : start + NOTES_PER_CHANNEL]
+            ):
+                if velocity:
+                    messages.append(
+                        mido.Message(
+                            "note_on", channel=channel, note=note, velocity=velocity
+                        )
+                    )
+
+        return messages
+
+
+class Keyframe(NamedTuple):
+    # The keyframe's position in the file
+    time_secs: float
+
+    # The first event at or after `time_secs`
+    event_index: int
+
+    # The state after applying all events before `event_index`
+    state: ChannelState
+
+
+class SeekPoint(NamedTuple):
+    # The first event to play
+    event_index: int
+
+    # The state after applying all events before `event_index`
+    state: ChannelState
+
+
+class Timeline:
+    """
+    A MIDI file compiled into packed arrays.
+
+    Each event `i` is described by `times[i]` (absolute seconds from the start of
+    the file), `statuses[i]` (the status nibble, eg `NOTE_ON`), `channels[i]`,
+    `data1[i]` and `data2[i]`. Unused data bytes are 0. System exclusive events
+    have status `SYSEX`, and their payloads live in `sysex`.
+
+    Simultaneous events are grouped: group `g` covers the events from
+    `group_starts[g]` up to (but excluding) `group_starts[g + 1]`. The final entry
+    of `group_starts` is always the number of events.
+
+    All of the tick and tempo maths happens once, when the timeline is compiled,
+    so that playback only needs to index into the arrays.
+
+    `keyframes` hold snapshots of the channel state taken every
+    `KEYFRAME_INTERVAL_SECS`, so that `seek` does not need to replay the whole
+    file.
+    """
+
+    def __init__(
+        self,
+        times: Sequence[float],
+        statuses: Sequence[int],
+        channels: Sequence[int],
+        data1: Sequence[int],
+        data2: Sequence[int],
+        group_starts: Sequence[int],
+        sysex: dict[int, bytes],
+        length_secs: float,
+        keyframes: Sequence[Keyframe],
+    ) -> None:
+        self.times = times
+        self.statuses = statuses
+        self.channels = channels
+        self.data1 = data1
+        self.data2 = data2
+        self.group_starts = group_starts
+        self.sysex = sysex
+        self.length_secs = length_secs
+        self.keyframes = keyframes
+
+        self._keyframe_times = [keyframe.time_secs for keyframe in keyframes]
+        self._messages: list[mido.Message] | None = None
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+    @property
+    def num_groups(self) -> int:
+        return len(self.group_starts) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Roughly how much memory the timeline takes, including `messages` once
+        they've been built.
+        """
+        total = len(self) * EVENT_BYTES + len(self.group_starts) * 4
+        total += len(self.keyframes) * KEYFRAME_BYTES
+        total += sum(len(data) for data in self.sysex.values())
+        if self._messages is not None:
+            total += len(self._messages) * MESSAGE_BYTES
+        return total
+
+    def group_index(self, event_index: int) -> int:
+        """Returns the group that starts at (or just after) `event_index`."""
+        return bisect_left(self.group_starts, event_index)
+
+    def event_bytes(self, index: int) -> bytes:
+        """Returns the raw MIDI bytes of the event at `index`."""
+        status = self.statuses[index]
+        if status == SYSEX:
+            return self.sysex[index]
+        if status in (PROGRAM_CHANGE, AFTERTOUCH):
+            return bytes((status | self.channels[index], self.data1[index]))
+        return bytes(
+            (status | self.channels[index], self.data1[index], self.data2[index])
+        )
+
+    @property
+    def messages(self) -> list[mido.Message]:
+        """
+        The events as `mido.Message`s, for sending to an output port.
+
+        These are built on first access, so do this before playback starts.
+        """
+        if self._messages is None:
+            self._messages = [
+                mido.Message.from_bytes(self.event_bytes(i)) for i in range(len(self))
+            ]
+        return self._messages
+
+    def seek(self, start_secs: float) -> SeekPoint:
+        """
+        Finds where to resume playback from in order to start at `start_secs`.
+
+        The nearest keyframe at or before `start_secs` is looked up, and only the
+        events between it and `start_secs` are replayed. Times outside the file
+        are clamped to its start or end.
+        """
+        start_secs = min(max(start_secs, 0.0), self.length_secs)
+        keyframe = self.keyframes[bisect_right(self._keyframe_times, start_secs) - 1]
+        index = max(keyframe.event_index, bisect_left(self.times, start_secs))
+
+        state = keyframe.state.copy()
+        for i in range(keyframe.event_index, index):
+            state.apply(
+                self.statuses[i], self.channels[i], self.data1[i], self.data2[i]
+            )
+
+        return SeekPoint(event_index=index, state=state)
+
+
+def compile_timeline(midi_file: mido.MidiFile) -> Timeline:
+    """
+    Compiles a MIDI file into a `Timeline`.
+
+    Meta messages are only used for their timing (tempo changes are already
+    applied by mido when iterating over the file) and are not kept.
+    """
+    times = array("d")
+    statuses = array("B")
+    channels = array("B")
+    data1 = array("B")
+    data2 = array("B")
+    group_starts = array("I")
+    sysex: dict[int, bytes] = {}
+
+    state = ChannelState()
+    keyframes = [Keyframe(time_secs=0.0, event_index=0, state=state.copy())]
+    next_keyframe_secs = KEYFRAME_INTERVAL_SECS
+
+    progress_secs = 0.0
+    group_secs = -1.0
+
+    for message in midi_file:
+        # Accumulate in the same way as `MidiFile.play()`, so that grouping
+        # matches what mido would do.
+        progress_secs += message.time
+
+        if message.is_meta:
+            continue
+
+        raw = message.bytes()
+        status = raw[0]
+
+        if status == SYSEX:
+            sysex[len(statuses)] = bytes(raw)
+            channel = d1 = d2 = 0
+        elif status < SYSEX:
+            channel = status & 0x0F
+            status &= 0xF0
+            d1 = raw[1]
+            d2 = raw[2] if len(raw) > 2 else 0
+        else:
+            # Realtime/system common messages have no business being in a file
+            continue
+
+        while progress_secs >= next_keyframe_secs:
+            keyframes.append(
+                Keyframe(
+                    time_secs=next_keyframe_secs,
+                    event_index=len(statuses),
+                    state=state.copy(),
+                )
+            )
+            next_keyframe_secs += KEYFRAME_INTERVAL_SECS
+
+        if progress_secs != group_secs:
+            group_starts.append(len(statuses))
+            group_secs = progress_secs
+
+        times.append(progress_secs)
+        statuses.append(status)
+        channels.append(channel)
+        data1.append(d1)
+        data2.append(d2)
+        state.apply(status, channel, d1, d2)
+
+    group_starts.append(len(statuses))
+
+    return Timeline(
+        times=times,
+        statuses=statuses,
+        channels=channels,
+        data1=data1,
+        data2=data2,
+        group_starts=group_starts,
+        sysex=sysex,
+        length_secs=progress_secs,
+        keyframes=keyframes,
+    )
+
+
+def load_timeline(midi_path: pathlib.Path) -> Timeline:
+    """Parses and compiles the MIDI file at `midi_path`."""
+    return compile_timeline(mido.MidiFile(filename=midi_path, clip=True))
@@ -0,0 +1,184 @@
+"""
+Per-stage timings for playback, with optional export in Chrome's trace format
+
+Profiling is off by default, in which case `span` hands back a shared no-op
+context manager and `get_profiler` returns `None`, so instrumented code costs
+no more than a function call. Traces open in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+
+import json
+import os
+import threading
+import time
+from array import array
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import Any
+
+_NULL_SPAN: AbstractContextManager[None] = nullcontext()
+
+
+class TimingStats:
+    """
+    Collects timings, eg how late each group of messages was sent.
+    """
+
+    def __init__(self) -> None:
+        self._samples_secs = array("d")
+
+    def __len__(self) -> int:
+        return len(self._samples_secs)
+
+    def add(self, secs: float) -> None:
+        self._samples_secs.append(secs)
+
+    def total(self) -> float:
+        """Returns the sum of the timings, in seconds."""
+        return sum(self._samples_secs)
+
+    def percentile(self, percent: float) -> float:
+        """Returns the given percentile, in seconds."""
+        if not self._samples_secs:
+            return 0.0
+        ordered = sorted(self._samples_secs)
+        rank = round(percent / 100 * (len(ordered) - 1))
+        return ordered[rank]
+
+    def summary(self) -> dict[str, float]:
+        """Returns p50, p99 and max, in milliseconds."""
+        return {
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": max(self._samples_secs, default=0.0) * 1000,
+        }
+
+    def __str__(self) -> str:
+        return ", ".join(f"{key}={value:.3f}" for key, value in self.summary().items())
+
+
+class Profiler:
+    """
+    Collects how long each stage takes, and how late timed work happens.
+
+    Stages can be recorded from any thread.
+    """
+
+    def __init__(self, trace: bool = False) -> None:
+        self.stages: dict[str, TimingStats] = {}
+        self.lateness: dict[str, TimingStats] = {}
+
+        self._trace_events: list[dict[str, Any]] | None = [] if trace else None
+        self._thread_names: dict[int, str] = {}
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def record(self, stage: str, start: float, end: float) -> None:
+        """Records that `stage` ran from `start` to `end` (`perf_counter` times)."""
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages.setdefault(stage, TimingStats())
+        stats.add(end - start)
+
+        if self._trace_events is not None:
+            self._trace_events.append(
+                {
+                    "name": stage,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": self._pid,
+                    "tid": self._tid(),
+                }
+            )
+
+    def record_lateness(self, name: str, late_secs: float) -> None:
+        """Records how late something happened, compared to when it was due."""
+        stats = self.lateness.get(name)
+        if stats is None:
+            stats = self.lateness.setdefault(name, TimingStats())
+        stats.add(late_secs)
+
+        if self._trace_events is not None:
+            self._trace_events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": (time.perf_counter() - self._origin) * 1e6,
+                    "pid": self._pid,
+                    "args": {"late_ms": late_secs * 1000},
+                }
+            )
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, start, time.perf_counter())
+
+    def summary(self) -> str:
+        lines = []
+        for title, timings in (("Stage", self.stages), ("Lateness", self.lateness)):
+            if timings:
+                lines.append(f"{title:<24} {'count':>8} {'total_s':>9}  percentiles")
+            for name, stats in sorted(timings.items()):
+                lines.append(
+                    f"{name:<24} {len(stats):>8} {stats.total():>9.3f}  {stats}"
+                )
+        return "\n".join(lines) or "Nothing was profiled"
+
+    def write_trace(self, path: Path) -> None:
+        """Writes everything recorded so far in Chrome's trace event format."""
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self._thread_names.items()
+        ]
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": metadata + (self._trace_events or []),
+                    "displayTimeUnit": "ms",
+                },
+                f,
+            )
+
+    def _tid(self) -> int:
+        tid = threading.get_native_id()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        return tid
+
+
+_profiler: Profiler | None = None
+
+
+def enable(trace: bool = False) -> Profiler:
+    """Starts profiling, keeping trace events too if `trace` is set."""
+    global _profiler
+    _profiler = Profiler(trace=trace)
+    return _profiler
+
+
+def disable() -> None:
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+def span(stage: str) -> AbstractContextManager[None]:
+    """Times the body of a `with` block as `stage`, if profiling is enabled."""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(stage)
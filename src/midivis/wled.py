@@ -3,18 +3,30 @@ Helpers to call the WLED API
 """
 
 import colorsys
+import enum
 import functools
 import itertools
+import re
+import threading
 import time
-from typing import Any, Iterable, NamedTuple
+import timeit
+from dataclasses import dataclass, field
+from random import Random
+from typing import Any, Collection, Iterable, Iterator, NamedTuple
 
 import requests
+import requests.adapters
 from more_itertools import run_length
 
+from midivis import tracing
+from midivis.tracing import TimingStats
+from midivis.utils import log
+
 HOST = "192.168.1.152"
 LEDS_WIDTH = 100
 LEDS_HEIGHT = 16
 NUM_LEDS = LEDS_WIDTH * LEDS_HEIGHT
+TIMEOUT_SECS = 1.0
 
 
 class RGBColor(NamedTuple):
@@ -38,30 +50,189 @@ class RGBColor(NamedTuple):
 OFF = RGBColor.from_hsv(0, 0, 0)
 
 
+def colors_from_buffer(buffer: bytes | memoryview) -> Iterator[RGBColor]:
+    """Reads packed r, g, b bytes as `RGBColor`s."""
+    values = iter(buffer)
+    return map(RGBColor._make, zip(values, values, values))
+
+
+# Reused between calls, so that the connection to WLED is kept alive
+_SESSION = requests.Session()
+
+
 def _set_state(data: dict[str, Any]) -> None:
     """Raw call to /json/state on the WLED API."""
     # import json; print(json.dumps(data)); return
-    resp = requests.post(f"http://{HOST}/json/state", json=data)
+    resp = _SESSION.post(f"http://{HOST}/json/state", json=data, timeout=TIMEOUT_SECS)
     resp.raise_for_status()
 
 
-def set_leds_all(colors: Iterable[RGBColor]) -> None:
-    """Sets the LEDs to the specified colors."""
+def leds_all_state(colors: Iterable[RGBColor]) -> dict[str, Any]:
+    """Returns the state that sets the LEDs to the specified colors."""
     # See https://kno.wled.ge/interfaces/json-api/#per-segment-individual-led-control
     # TODO: split big calls up into multiple smaller ones
-    _set_state({"seg": {"i": compress(colors)}})
+    return {"seg": {"i": compress(colors)}}
 
 
-def set_leds_sparse(colors: dict[int, RGBColor]) -> None:
-    """Changes the colors of the specified LEDs only."""
+def leds_sparse_state(colors: dict[int, RGBColor]) -> dict[str, Any]:
+    """Returns the state that changes the colors of the specified LEDs only."""
     leds: list[str | int] = []
     for pos, color in colors.items():
         leds.append(pos)
         leds.append(str(color))
-    _set_state({"seg": {"i": leds}})
+    return {"seg": {"i": leds}}
+
+
+def leds_changed_state(
+    buffer: bytes | memoryview, changed: Collection[int] | None
+) -> dict[str, Any]:
+    """
+    Returns the state that updates the LEDs at the `changed` positions (or all
+    of them, if `None`) from a packed r, g, b buffer.
+
+    Whichever encoding gives the smallest payload is used.
+    """
+    _, leds = smallest_encoding(buffer, changed)
+    return {"seg": {"i": leds}}
+
+
+def set_leds_all(colors: Iterable[RGBColor]) -> None:
+    """Sets the LEDs to the specified colors."""
+    _set_state(leds_all_state(colors))
+
+
+def set_leds_sparse(colors: dict[int, RGBColor]) -> None:
+    """Changes the colors of the specified LEDs only."""
+    _set_state(leds_sparse_state(colors))
+
+
+@dataclass
+class ClientStats:
+    # Frames successfully sent
+    sent: int = 0
+
+    # Frames replaced by a newer one before they could be sent
+    dropped: int = 0
+
+    # Frames where the request failed
+    failed: int = 0
+
+    # How long each request took
+    latency: TimingStats = field(default_factory=TimingStats)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.sent} sent, {self.dropped} dropped, {self.failed} failed; "
+            f"latency {self.latency}"
+        )
+
+
+class WLEDClient:
+    """
+    Sends frames to WLED from a worker thread, over a kept-alive connection.
+
+    There is only room for one pending frame: submitting a frame while another
+    is waiting replaces it, so a slow controller skips stale frames rather than
+    falling further and further behind. The changed positions of replaced
+    frames are carried over, so no change is lost. If a request fails, the
+    next frame is sent in full, since the failed one's changes never arrived.
+    """
+
+    def __init__(self, host: str = HOST, timeout_secs: float = TIMEOUT_SECS) -> None:
+        self._url = f"http://{host}/json/state"
+        self._timeout_secs = timeout_secs
+
+        self._session = requests.Session()
+        self._session.mount(
+            "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        )
+
+        self._mailbox = threading.Condition()
+        self._pending: tuple[bytes, set[int] | None] | None = None
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="wled", daemon=True)
+
+        # Set when a request fails. Only used by the worker thread.
+        self._resend_all = False
+
+        self.stats = ClientStats()
+
+    def __enter__(self) -> "WLEDClient":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def submit_frame(
+        self, buffer: bytes | memoryview, changed: Collection[int] | None = None
+    ) -> None:
+        """
+        Queues a frame from a packed r, g, b buffer, replacing any pending frame.
+
+        `changed` is the positions that changed since the last frame, or `None`
+        if the whole frame should be sent.
+        """
+        frame = bytes(buffer)
+        with self._mailbox:
+            if self._pending is not None:
+                self.stats.dropped += 1
+                _, pending_changed = self._pending
+                if changed is not None and pending_changed is not None:
+                    changed = pending_changed.union(changed)
+                else:
+                    changed = None
+            self._pending = (frame, None if changed is None else set(changed))
+            self._mailbox.notify()
+
+    def close(self) -> None:
+        """Sends any pending frame, then stops the worker."""
+        with self._mailbox:
+            self._closing = True
+            self._mailbox.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._session.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._mailbox:
+                while self._pending is None and not self._closing:
+                    self._mailbox.wait()
+                if self._pending is None:
+                    return
+                frame, changed = self._pending
+                self._pending = None
+
+            if self._resend_all:
+                changed = None
+                self._resend_all = False
+
+            with tracing.span("wled encode"):
+                state = leds_changed_state(frame, changed)
+
+            start = time.perf_counter()
+            try:
+                with tracing.span("wled post"):
+                    resp = self._session.post(
+                        self._url, json=state, timeout=self._timeout_secs
+                    )
+                resp.raise_for_status()
+            except requests.RequestException as e:
+                self.stats.failed += 1
+                self._resend_all = True
+                log(1, f"WLED request failed: {type(e).__name__}: {e}")
+            else:
+                self.stats.sent += 1
+            self.stats.latency.add(time.perf_counter() - start)
 
 
 def compress(colors: Iterable[RGBColor]) -> list[str | int]:
+    """
+    Run-length encodes colors for the WLED API.
+
+    Prefer `encode_ranged`, which does the same from a packed buffer much faster.
+    """
     offset = 0
     compressed: list[str | int] = []
     for color, size in run_length.encode(colors):
@@ -75,6 +246,107 @@ def compress(colors: Iterable[RGBColor]) -> list[str | int]:
     return compressed
 
 
+class Encoding(enum.Enum):
+    # Every LED's color, in order
+    DENSE = enum.auto()
+
+    # Runs of the same color as [start, stop, color], and single colors as is
+    RANGED = enum.auto()
+
+    # [position, color] for the changed LEDs only
+    SPARSE = enum.auto()
+
+
+# Hex strings for every byte value, so colors don't need formatting
+_HEX = [f"{i:02X}" for i in range(256)]
+
+# Matches a run of identical 3-byte colors. Every match is a multiple of 3
+# bytes long, so consecutive matches stay aligned to color boundaries.
+_RUN = re.compile(rb"(...)(?:\1)*+", re.DOTALL)
+
+
+def _hex(buffer: bytes | memoryview, pos: int) -> str:
+    i = pos * 3
+    return _HEX[buffer[i]] + _HEX[buffer[i + 1]] + _HEX[buffer[i + 2]]
+
+
+def encode_dense(buffer: bytes | memoryview) -> list[str | int]:
+    """Encodes a packed r, g, b buffer with one color per LED."""
+    # One hex conversion for the whole buffer, then slice each color out of it
+    hex_colors = buffer.hex().upper()
+    return [hex_colors[i : i + 6] for i in range(0, len(hex_colors) - 5, 6)]
+
+
+def encode_ranged(buffer: bytes | memoryview) -> list[str | int]:
+    """
+    Run-length encodes a packed r, g, b buffer.
+
+    Gives the same output as `compress`, but finds the runs with a regex rather
+    than by comparing colors one at a time, and slices each color's hex out of a
+    single conversion of the whole buffer.
+    """
+    hex_colors = buffer.hex().upper()
+    compressed: list[str | int] = []
+    append = compressed.append
+    extend = compressed.extend
+    for match in _RUN.finditer(buffer):
+        start, end = match.span()
+        color_hex = hex_colors[start * 2 : start * 2 + 6]
+        if end - start == 3:
+            append(color_hex)
+        else:
+            extend((start // 3, end // 3, color_hex))
+
+    return compressed
+
+
+def encode_sparse(
+    buffer: bytes | memoryview, changed: Iterable[int]
+) -> list[str | int]:
+    """Encodes only the `changed` positions of a packed r, g, b buffer."""
+    leds: list[str | int] = []
+    for pos in sorted(changed):
+        leds.append(pos)
+        leds.append(_hex(buffer, pos))
+    return leds
+
+
+def payload_size(leds: list[str | int]) -> int:
+    """Estimates the size in bytes of the JSON encoding of `leds`."""
+    # Each color is 6 hex digits plus quotes; items are separated by ", "
+    size = 2 + 2 * max(len(leds) - 1, 0)
+    for led in leds:
+        size += 8 if isinstance(led, str) else len(str(led))
+    return size
+
+
+def smallest_encoding(
+    buffer: bytes | memoryview, changed: Collection[int] | None = None
+) -> tuple[Encoding, list[str | int]]:
+    """
+    Returns whichever encoding of a packed r, g, b buffer is smallest.
+
+    Sparse encoding is only considered if the `changed` positions are known.
+    """
+    # Dense is never smaller than ranged, but it's cheap to size without encoding
+    num_leds = len(buffer) // 3
+    dense_size = 2 + 10 * num_leds - 2
+
+    ranged = encode_ranged(buffer)
+    best = (payload_size(ranged), Encoding.RANGED, ranged)
+
+    if changed is not None and len(changed) < num_leds:
+        sparse = encode_sparse(buffer, changed)
+        # Compare sizes only: the encodings themselves aren't ordered
+        sparse_size = payload_size(sparse)
+        if sparse_size < best[0]:
+            best = (sparse_size, Encoding.SPARSE, sparse)
+
+    if dense_size < best[0]:
+        return Encoding.DENSE, encode_dense(buffer)
+    return best[1], best[2]
+
+
 def main() -> None:
     # cycle_rainbow()
     chase()
@@ -82,6 +354,36 @@ def main() -> None:
     # colors = {5: OFF, 8: RGBColor(255, 255, 255), 9: RGBColor(0, 255, 0), 10: RGBColor(255, 0, 0), 1: OFF}
     # set_leds_sparse(colors)
 
+    # benchmark_compress()
+
+
+def benchmark_compress(number: int = 1000) -> None:
+    """Compares `compress` with `encode_ranged` on some typical frames."""
+    random = Random(0)
+    palette = [bytes(OFF), bytes([127, 0, 255]), bytes([255, 255, 255])]
+    frames = {
+        "off": bytes(NUM_LEDS * 3),
+        "chase": bytes(NUM_LEDS * 3 - 15) + bytes([64, 128, 255, 128, 64] * 3),
+        "notes": b"".join(
+            random.choice(palette) if random.random() < 0.15 else palette[0]
+            for _ in range(NUM_LEDS)
+        ),
+        "rainbow": bytes(random.randrange(256) for _ in range(NUM_LEDS * 3)),
+    }
+
+    for name, frame in frames.items():
+        colors = list(colors_from_buffer(frame))
+        assert compress(colors) == encode_ranged(frame)
+
+        old_secs = timeit.timeit(lambda: compress(colors), number=number) / number
+        new_secs = timeit.timeit(lambda: encode_ranged(frame), number=number) / number
+        print(
+            f"{name:8s} compress: {old_secs * 1e6:8.1f} us  "
+            f"encode_ranged: {new_secs * 1e6:8.1f} us  "
+            f"({old_secs / new_secs:.1f}x)  "
+            f"smallest: {smallest_encoding(frame)[0].name}"
+        )
+
 
 def chase() -> None:
     last = time.perf_counter_ns()
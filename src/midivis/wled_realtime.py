@@ -0,0 +1,206 @@
+"""
+Pushes frames to WLED over its UDP realtime protocols
+
+See https://kno.wled.ge/interfaces/udp-realtime/ and http://www.3waylabs.com/ddp/
+"""
+
+import enum
+import socket
+import threading
+import time
+from collections.abc import Callable, Collection, Iterator
+
+from midivis import tracing
+from midivis.utils import log
+from midivis.wled import HOST, TIMEOUT_SECS, ClientStats, WLEDClient
+
+DDP_PORT = 4048
+REALTIME_PORT = 21324
+
+# DDP header: flags (version 1), sequence number, data type (8-bit RGB),
+# destination (default output device), then offset and length
+DDP_VERSION_1 = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_DESTINATION = 0x01
+DDP_MAX_LEDS = 480  # 1440 bytes of data per packet
+
+DRGB = 2
+DRGB_MAX_LEDS = 490
+
+DNRGB = 4
+DNRGB_MAX_LEDS = 489
+
+# Seconds that WLED stays in realtime mode after the last packet
+REALTIME_TIMEOUT_SECS = 2
+
+# Resend the whole frame when nothing has been sent for this long, so that WLED
+# stays in realtime mode through quiet passages
+KEEPALIVE_SECS = 1.0
+
+
+class WLEDProtocol(enum.StrEnum):
+    JSON = "json"
+    DDP = "ddp"
+    DRGB = "drgb"
+    DNRGB = "dnrgb"
+
+
+class WLEDRealtimeClient:
+    """
+    Sends frames to WLED as UDP packets, straight from a packed r, g, b buffer.
+
+    Frames are split into as many packets as the protocol needs. With DDP and
+    DNRGB, packets that contain no changed LEDs are not sent at all. Sending a
+    UDP packet doesn't wait for the controller, so frames are sent straight
+    away; a background thread only resends the last frame in full whenever
+    nothing has been sent for `KEEPALIVE_SECS`.
+    """
+
+    def __init__(
+        self,
+        protocol: WLEDProtocol,
+        host: str = HOST,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if protocol == WLEDProtocol.JSON:
+            raise ValueError("Use WLEDClient for the JSON API")
+
+        self._protocol = protocol
+        self._address = (
+            host,
+            DDP_PORT if protocol == WLEDProtocol.DDP else REALTIME_PORT,
+        )
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sequence = 0
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._frame: bytes | None = None
+        self._last_sent = float("-inf")
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run_keepalive, name="wled keepalive", daemon=True
+        )
+
+        self.stats = ClientStats()
+
+    def __enter__(self) -> "WLEDRealtimeClient":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._socket.close()
+
+    def submit_frame(
+        self, buffer: bytes | memoryview, changed: Collection[int] | None = None
+    ) -> None:
+        """
+        Sends a frame from a packed r, g, b buffer.
+
+        `changed` is the positions that changed since the last frame, or `None`
+        if the whole frame should be sent. The whole frame is also sent if WLED
+        might have timed out since the last one.
+        """
+        with self._lock:
+            if self._clock() - self._last_sent >= KEEPALIVE_SECS:
+                changed = None
+            frame = bytes(buffer)
+            self._send(frame, changed)
+            # Only once it's sent, so the keepalive never resends a frame
+            # that can't be sent
+            self._frame = frame
+
+    def keep_alive(self) -> None:
+        """Resends the last frame in full if nothing's been sent for a while."""
+        with self._lock:
+            if (
+                self._frame is not None
+                and self._clock() - self._last_sent >= KEEPALIVE_SECS
+            ):
+                self._send(self._frame, None)
+
+    def _run_keepalive(self) -> None:
+        while not self._stopping.wait(KEEPALIVE_SECS / 4):
+            self.keep_alive()
+
+    def _send(self, buffer: bytes, changed: Collection[int] | None) -> None:
+        self._last_sent = self._clock()
+        start = time.perf_counter()
+        try:
+            with tracing.span("wled send"):
+                for packet in self.packets(buffer, changed):
+                    self._socket.sendto(packet, self._address)
+        except OSError as e:
+            self.stats.failed += 1
+            log(1, f"WLED packet failed: {type(e).__name__}: {e}")
+        else:
+            self.stats.sent += 1
+        self.stats.latency.add(time.perf_counter() - start)
+
+    def packets(
+        self, buffer: bytes | memoryview, changed: Collection[int] | None = None
+    ) -> Iterator[bytes]:
+        """Returns the packets needed to send a frame."""
+        buffer = memoryview(buffer)
+        num_leds = len(buffer) // 3
+
+        match self._protocol:
+            case WLEDProtocol.DRGB:
+                if num_leds > DRGB_MAX_LEDS:
+                    raise ValueError(
+                        f"DRGB supports at most {DRGB_MAX_LEDS} LEDs; use DNRGB or DDP"
+                    )
+                yield bytes((DRGB, REALTIME_TIMEOUT_SECS)) + buffer
+
+            case WLEDProtocol.DNRGB:
+                for first, last in _chunks(num_leds, DNRGB_MAX_LEDS, changed):
+                    header = bytes(
+                        (DNRGB, REALTIME_TIMEOUT_SECS, first >> 8, first & 0xFF)
+                    )
+                    yield header + buffer[first * 3 : last * 3]
+
+            case WLEDProtocol.DDP:
+                chunks = list(_chunks(num_leds, DDP_MAX_LEDS, changed))
+                self._sequence = self._sequence % 15 + 1
+                for n, (first, last) in enumerate(chunks):
+                    flags = DDP_VERSION_1
+                    if n == len(chunks) - 1:
+                        # Tells WLED to display the frame
+                        flags |= DDP_PUSH
+                    offset = first * 3
+                    length = (last - first) * 3
+                    header = bytes(
+                        (flags, self._sequence, DDP_TYPE_RGB24, DDP_DESTINATION)
+                    )
+                    header += offset.to_bytes(4, "big") + length.to_bytes(2, "big")
+                    yield header + buffer[offset : offset + length]
+
+
+def _chunks(
+    num_leds: int, max_leds: int, changed: Collection[int] | None
+) -> Iterator[tuple[int, int]]:
+    """
+    Splits the LEDs into `(first, last)` ranges of at most `max_leds`, skipping
+    any that contain no changed LEDs.
+    """
+    if changed is not None:
+        changed_chunks = {pos // max_leds for pos in changed}
+    for first in range(0, num_leds, max_leds):
+        if changed is None or first // max_leds in changed_chunks:
+            yield first, min(first + max_leds, num_leds)
+
+
+def open_client(
+    protocol: WLEDProtocol, host: str = HOST
+) -> WLEDClient | WLEDRealtimeClient:
+    """Returns a client that pushes frames to WLED using `protocol`."""
+    if protocol == WLEDProtocol.JSON:
+        return WLEDClient(host=host, timeout_secs=TIMEOUT_SECS)
+    return WLEDRealtimeClient(protocol, host=host)
@@ -0,0 +1,93 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+import mido
+
+from midivis.bus import Batch, LiveBatch, _merge
+from midivis.outputs import Recorder
+from midivis.timeline import compile_timeline
+
+
+def make_midi_file() -> mido.MidiFile:
+    track = mido.MidiTrack()
+    for note in range(60, 64):
+        track.append(mido.Message("note_on", note=note, velocity=100, time=240))
+        track.append(mido.Message("note_off", note=note, time=240))
+    midi_file = mido.MidiFile()
+    midi_file.tracks.append(track)
+    return midi_file
+
+
+class MergeTest(unittest.TestCase):
+    def test_merged_batch_keeps_event_times(self) -> None:
+        timeline = compile_timeline(make_midi_file())
+        starts = timeline.group_starts
+        batches = [
+            Batch(
+                timeline,
+                starts[group],
+                starts[group + 1],
+                timeline.times[starts[group]],
+            )
+            for group in range(timeline.num_groups)
+        ]
+        merged = batches[0]
+        for batch in batches[1:]:
+            merged = _merge(merged, batch)
+
+        expected = [
+            time_secs for batch in batches for time_secs, _ in batch.timed_messages()
+        ]
+        self.assertEqual(
+            [time_secs for time_secs, _ in merged.timed_messages()], expected
+        )
+
+    def test_merged_live_batch_keeps_message_times(self) -> None:
+        first = LiveBatch(
+            (mido.Message("note_on", note=60),),
+            times=(1.0,),
+            time_secs=1.0,
+            received_at=0.0,
+        )
+        second = LiveBatch(
+            (mido.Message("note_off", note=60),),
+            times=(2.0,),
+            time_secs=2.0,
+            received_at=1.0,
+        )
+        merged = _merge(first, second)
+        self.assertEqual([t for t, _ in merged.timed_messages()], [1.0, 2.0])
+        self.assertEqual([t for t, _ in merged.timed_bytes()], [1.0, 2.0])
+
+
+class RecorderTest(unittest.TestCase):
+    def test_records_timing_of_merged_batches(self) -> None:
+        timeline = compile_timeline(make_midi_file())
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "recording.mid"
+            recorder = Recorder(path, timeline)
+            batch = Batch(timeline, 0, len(timeline), timeline.length_secs)
+
+            async def record() -> None:
+                await recorder.open()
+                await recorder.handle(batch)
+                await recorder.close()
+
+            asyncio.run(record())
+
+            recorded = mido.MidiFile(path)
+            times = []
+            now = 0.0
+            for message in recorded:
+                now += message.time
+                if not message.is_meta:
+                    times.append(now)
+
+        for recorded_secs, due_secs in zip(times, timeline.times, strict=True):
+            self.assertAlmostEqual(recorded_secs, due_secs, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
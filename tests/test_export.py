@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import mido
+
+from midivis.export import ExportFormat, export_file, output_names
+
+
+def write_midi(path: Path, num_notes: int) -> None:
+    track = mido.MidiTrack()
+    for note in range(60, 60 + num_notes):
+        track.append(mido.Message("note_on", note=note, velocity=100, time=240))
+        track.append(mido.Message("note_off", note=note, time=240))
+    midi_file = mido.MidiFile()
+    midi_file.tracks.append(track)
+    midi_file.save(path)
+
+
+class OutputNamesTest(unittest.TestCase):
+    def test_keeps_distinct_names(self) -> None:
+        paths = [Path("a/one.mid"), Path("b/two.mid")]
+        self.assertEqual(output_names(paths), ["one.mid", "two.mid"])
+
+    def test_adds_suffix_to_repeated_names(self) -> None:
+        paths = [
+            Path("a/song.mid"),
+            Path("b/song.mid"),
+            Path("c/SONG.MID"),
+            Path("d/song-2.mid"),
+        ]
+        self.assertEqual(
+            output_names(paths),
+            ["song.mid", "song-2.mid", "SONG-3.MID", "song-2-2.mid"],
+        )
+
+
+class ExportFileTest(unittest.TestCase):
+    def test_png_export_replaces_earlier_frames(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            with mock.patch("midivis.cache.CACHE_DIR", root / "cache"):
+                long_path = root / "long" / "song.mid"
+                short_path = root / "short" / "song.mid"
+                for path, num_notes in ((long_path, 8), (short_path, 2)):
+                    path.parent.mkdir()
+                    write_midi(path, num_notes)
+                output_dir = root / "out"
+                output_dir.mkdir()
+
+                long = export_file(long_path, output_dir, fps=10)
+                short = export_file(short_path, output_dir, fps=10)
+
+            self.assertEqual(long.path, short.path)
+            self.assertLess(short.frames, long.frames)
+            self.assertEqual(len(list(short.path.glob("*.png"))), short.frames)
+            self.assertEqual(sorted(p.name for p in output_dir.iterdir()), ["song.mid"])
+
+    def test_raw_export(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            with mock.patch("midivis.cache.CACHE_DIR", root / "cache"):
+                midi_path = root / "song.mid"
+                write_midi(midi_path, 2)
+                result = export_file(
+                    midi_path, root, fps=10, export_format=ExportFormat.RAW
+                )
+            self.assertEqual(result.path, root / "song.mid.rgb")
+            self.assertEqual(result.size_bytes, result.path.stat().st_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
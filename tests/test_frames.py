@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import mido
+
+from midivis.frames import frames_path, load_frames
+
+
+def write_midi(path: Path) -> None:
+    track = mido.MidiTrack()
+    for note in range(60, 64):
+        track.append(mido.Message("note_on", note=note, velocity=100, time=240))
+        track.append(mido.Message("note_off", note=note, time=240))
+    midi_file = mido.MidiFile()
+    midi_file.tracks.append(track)
+    midi_file.save(path)
+
+
+class LoadFramesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = Path(temp_dir.name)
+        patcher = mock.patch("midivis.cache.CACHE_DIR", self.dir / "cache")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("midivis.frames.log")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.midi_path = self.dir / "song.mid"
+        write_midi(self.midi_path)
+
+    def test_reuses_frames_at_same_fps(self) -> None:
+        load_frames(self.midi_path, fps=30)
+        mtime_ns = frames_path(self.midi_path).stat().st_mtime_ns
+
+        frames = load_frames(self.midi_path, fps=30)
+        self.assertEqual(frames.fps, 30)
+        self.assertEqual(frames_path(self.midi_path).stat().st_mtime_ns, mtime_ns)
+
+    def test_renders_again_at_different_fps(self) -> None:
+        slow = load_frames(self.midi_path, fps=10)
+        self.assertEqual(slow.fps, 10)
+
+        fast = load_frames(self.midi_path, fps=60)
+        self.assertEqual(fast.fps, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
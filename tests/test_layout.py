@@ -0,0 +1,122 @@
+import unittest
+
+from midivis.display import RGB
+from midivis.layout import Layout, Panel
+from midivis.midi_metadata import NOTES_PER_CHANNEL, NUM_CHANNELS
+
+
+def numbered_colors() -> bytes:
+    """Colors whose red value is the cell's note, and green its channel."""
+    colors = bytearray(NUM_CHANNELS * NOTES_PER_CHANNEL * RGB)
+    for channel in range(NUM_CHANNELS):
+        for note in range(NOTES_PER_CHANNEL):
+            cell = (channel * NOTES_PER_CHANNEL + note) * RGB
+            colors[cell : cell + RGB] = bytes((note, channel, 1))
+    return bytes(colors)
+
+
+def led_positions(layout: Layout) -> list[tuple[int, int] | None]:
+    """The (x, y) grid position shown by each LED, or None if it's black."""
+    leds = layout.leds(numbered_colors())
+    return [
+        (leds[i], leds[i + 1]) if leds[i + 2] else None
+        for i in range(0, len(leds), RGB)
+    ]
+
+
+class PanelWiringTest(unittest.TestCase):
+    # A 3 wide, 2 high panel, as seen from the front:
+    #   (0, 0) (1, 0) (2, 0)
+    #   (0, 1) (1, 1) (2, 1)
+
+    def test_rotations(self) -> None:
+        expected = {
+            0: [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)],
+            90: [(2, 0), (2, 1), (1, 0), (1, 1), (0, 0), (0, 1)],
+            180: [(2, 1), (1, 1), (0, 1), (2, 0), (1, 0), (0, 0)],
+            270: [(0, 1), (0, 0), (1, 1), (1, 0), (2, 1), (2, 0)],
+        }
+        for rotation, positions in expected.items():
+            with self.subTest(rotation=rotation):
+                panel = Panel(width=3, height=2, rotation=rotation)
+                self.assertEqual(panel.grid_positions(), positions)
+                self.assertEqual(led_positions(Layout([panel])), positions)
+
+    def test_serpentine(self) -> None:
+        panel = Panel(width=3, height=2, serpentine=True)
+        self.assertEqual(
+            panel.grid_positions(),
+            [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1)],
+        )
+
+    def test_serpentine_rotated(self) -> None:
+        panel = Panel(width=3, height=2, serpentine=True, rotation=90)
+        self.assertEqual(
+            panel.grid_positions(),
+            [(2, 0), (2, 1), (1, 1), (1, 0), (0, 0), (0, 1)],
+        )
+
+    def test_offset(self) -> None:
+        panel = Panel(width=2, height=1, x=5, y=3)
+        self.assertEqual(panel.grid_positions(), [(5, 3), (6, 3)])
+
+
+class LayoutTest(unittest.TestCase):
+    def test_panels_follow_on(self) -> None:
+        layout = Layout(
+            [Panel(width=2, height=1), Panel(width=2, height=1, x=2, rotation=180)]
+        )
+        self.assertEqual(layout.num_leds, 4)
+        self.assertEqual(led_positions(layout), [(0, 0), (1, 0), (3, 0), (2, 0)])
+
+    def test_first_led(self) -> None:
+        layout = Layout(
+            [Panel(width=2, height=1), Panel(width=2, height=1, x=2, first_led=4)]
+        )
+        # LEDs 2 and 3 aren't in any panel
+        self.assertEqual(
+            led_positions(layout), [(0, 0), (1, 0), None, None, (2, 0), (3, 0)]
+        )
+
+    def test_notes_and_channels_outside_range_are_black(self) -> None:
+        layout = Layout(
+            [Panel(width=3, height=NUM_CHANNELS + 1)], lower_note=60, note_range=2
+        )
+        positions = led_positions(layout)
+        self.assertEqual(positions[:3], [(60, 0), (61, 0), None])
+        self.assertEqual(positions[-3:], [None, None, None])
+
+    def test_changed_leds(self) -> None:
+        layout = Layout([Panel(width=2, height=2, serpentine=True)])
+        # Note 1 on channel 1 is at (1, 1), the third LED
+        self.assertEqual(layout.changed_leds([NOTES_PER_CHANNEL + 1]), [2])
+        self.assertEqual(layout.changed_leds([5]), [])
+
+    def test_pixels(self) -> None:
+        layout = Layout([Panel(width=2, height=1), Panel(width=1, height=1, x=3)])
+        self.assertEqual((layout.width, layout.height), (4, 1))
+        pixels = layout.pixels(numbered_colors())
+        # The gap at x=2 is black
+        self.assertEqual(pixels, bytes((0, 0, 1, 1, 0, 1, 0, 0, 0, 3, 0, 1)))
+
+    def test_overlapping_leds(self) -> None:
+        with self.assertRaisesRegex(ValueError, "LED 1 is in more than one panel"):
+            Layout(
+                [Panel(width=2, height=1), Panel(width=2, height=1, x=2, first_led=1)]
+            )
+
+    def test_invalid_panels(self) -> None:
+        for panel in (
+            Panel(width=2, height=2, rotation=45),
+            Panel(width=0, height=2),
+            Panel(width=2, height=2, x=-1),
+        ):
+            with self.subTest(panel=panel):
+                with self.assertRaises(ValueError):
+                    Layout([panel])
+        with self.assertRaises(ValueError):
+            Layout([])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import mido
+
+from midivis.analyse import analyse_file
+from midivis.smf import SMFError, SMFSummary, scan_smf
+
+END_OF_TRACK = bytes((0, 0xFF, 0x2F, 0))
+
+
+def header(file_type: int, num_tracks: int, division: int) -> bytes:
+    return (
+        b"MThd"
+        + (6).to_bytes(4)
+        + file_type.to_bytes(2)
+        + num_tracks.to_bytes(2)
+        + division.to_bytes(2)
+    )
+
+
+def track(events: bytes) -> bytes:
+    return b"MTrk" + len(events).to_bytes(4) + events
+
+
+def to_bytes(midi_file: mido.MidiFile) -> bytes:
+    f = io.BytesIO()
+    midi_file.save(file=f)
+    return f.getvalue()
+
+
+class ScanSMFTest(unittest.TestCase):
+    def assert_matches_mido(self, data: bytes) -> SMFSummary:
+        """Checks the scanner against mido, and returns the summary."""
+        summary = scan_smf(data)
+
+        midi_file = mido.MidiFile(file=io.BytesIO(data), clip=False)
+        note_counts = [0] * 128
+        channel_counts = [0] * 16
+        program_counts = [0] * 128
+        for midi_track in midi_file.tracks:
+            for message in midi_track:
+                if message.type == "note_on":
+                    note_counts[message.note] += 1
+                    channel_counts[message.channel] += 1
+                elif message.type == "program_change":
+                    program_counts[message.program] += 1
+
+        self.assertEqual(summary.note_counts, note_counts)
+        self.assertEqual(summary.channel_counts, channel_counts)
+        self.assertEqual(summary.program_counts, program_counts)
+        if midi_file.type == 2:
+            self.assertIsNone(summary.runtime_secs)
+        else:
+            assert summary.runtime_secs is not None
+            self.assertAlmostEqual(summary.runtime_secs, midi_file.length)
+        return summary
+
+    def test_running_status(self) -> None:
+        events = bytes(
+            (
+                *(0, 0x91, 60, 100),
+                # Running status: another note on, then a program change
+                *(0x60, 62, 100),
+                *(0, 0xC1, 5),
+                *(0x60, 7),
+                # A meta event doesn't cancel running status
+                *(0, 0xFF, 0x01, 1, ord("x")),
+                *(0x60, 0x81, 60, 0),
+                *(0, 62, 0),
+            )
+        )
+        summary = self.assert_matches_mido(
+            header(0, 1, 96) + track(events + END_OF_TRACK)
+        )
+        self.assertEqual(summary.note_count, 2)
+        self.assertEqual(summary.channels, {1})
+        self.assertEqual(summary.programs, {5, 7})
+
+    def test_sysex_and_meta_events(self) -> None:
+        midi_track = mido.MidiTrack(
+            [
+                mido.MetaMessage("track_name", name="Piano"),
+                mido.MetaMessage("text", text="x" * 200),
+                mido.Message("sysex", data=bytes(range(100))),
+                mido.Message("note_on", note=64, velocity=90, time=10),
+                mido.MetaMessage("marker", text="here", time=10),
+                mido.Message("sysex", data=(0x7E, 0x7F, 0x09, 0x01)),
+                mido.Message("note_off", note=64, time=10),
+            ]
+        )
+        midi_file = mido.MidiFile()
+        midi_file.tracks.append(midi_track)
+        summary = self.assert_matches_mido(to_bytes(midi_file))
+        self.assertEqual(summary.note_count, 1)
+
+    def test_tempo_changes(self) -> None:
+        conductor = mido.MidiTrack(
+            [
+                mido.MetaMessage("set_tempo", tempo=1_000_000, time=0),
+                mido.MetaMessage("set_tempo", tempo=250_000, time=480),
+            ]
+        )
+        notes = mido.MidiTrack(
+            [
+                mido.Message("note_on", note=60, velocity=100, time=0),
+                mido.Message("note_off", note=60, time=1920),
+            ]
+        )
+        midi_file = mido.MidiFile(type=1, ticks_per_beat=480)
+        midi_file.tracks += [conductor, notes]
+        summary = self.assert_matches_mido(to_bytes(midi_file))
+        # One beat at 1s, then three at 0.25s
+        assert summary.runtime_secs is not None
+        self.assertAlmostEqual(summary.runtime_secs, 1.75)
+
+    def test_tempo_changes_at_same_tick_apply_in_track_order(self) -> None:
+        first = mido.MidiTrack(
+            [
+                mido.MetaMessage("set_tempo", tempo=1_000_000, time=240),
+                mido.Message("note_on", note=60, velocity=100, time=0),
+                mido.Message("note_off", note=60, time=960),
+            ]
+        )
+        second = mido.MidiTrack(
+            [mido.MetaMessage("set_tempo", tempo=250_000, time=240)]
+        )
+        midi_file = mido.MidiFile(type=1, ticks_per_beat=480)
+        midi_file.tracks += [first, second]
+        summary = self.assert_matches_mido(to_bytes(midi_file))
+        # Half a beat at the default 0.5s, then two at the second track's tempo
+        assert summary.runtime_secs is not None
+        self.assertAlmostEqual(summary.runtime_secs, 0.75)
+
+    def test_asynchronous_file_has_no_runtime(self) -> None:
+        midi_file = mido.MidiFile(type=2)
+        midi_file.tracks.append(
+            mido.MidiTrack([mido.Message("note_on", note=60, velocity=1, time=5)])
+        )
+        self.assert_matches_mido(to_bytes(midi_file))
+
+    def test_malformed_files(self) -> None:
+        note = bytes((0, 0x90, 60, 100))
+        cases = {
+            "not midi": b"RIFF" + bytes(20),
+            "truncated header": header(0, 1, 96)[:10],
+            "smpte": header(0, 1, 0xE728) + track(note + END_OF_TRACK),
+            "missing track": header(0, 2, 96) + track(note + END_OF_TRACK),
+            "truncated track": header(0, 1, 96) + track(note + END_OF_TRACK)[:-2],
+            "no running status": header(0, 1, 96) + track(bytes((0, 60, 100))),
+            "running status after sysex": header(0, 1, 96)
+            + track(bytes((0, 0xF0, 1, 0xF7, 0, 60, 100)) + END_OF_TRACK),
+            "data out of range": header(0, 1, 96)
+            + track(bytes((0, 0x90, 60, 0x80)) + END_OF_TRACK),
+            "overrun": header(0, 1, 96) + track(bytes((0, 0xFF, 0x01, 5, 0))),
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(SMFError):
+                    scan_smf(data)
+
+
+class AnalyseFallbackTest(unittest.TestCase):
+    def analyse(self, data: bytes) -> tuple[int, str | None]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "song.mid"
+            path.write_bytes(data)
+            stats = analyse_file(path, Path(temp_dir))
+        return stats.note_count, stats.error
+
+    def test_falls_back_to_mido(self) -> None:
+        # The scanner doesn't support SMPTE timing, but mido does
+        data = header(0, 1, 0xE728) + track(bytes((0, 0x90, 60, 100)) + END_OF_TRACK)
+        self.assertEqual(self.analyse(data), (1, None))
+
+    def test_reports_broken_files(self) -> None:
+        _, error = self.analyse(header(0, 1, 96) + track(bytes((0, 60, 100))))
+        self.assertIsNotNone(error)
+
+
+if __name__ == "__main__":
+    unittest.main()
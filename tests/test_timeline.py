@@ -0,0 +1,99 @@
+import unittest
+
+import mido
+
+from midivis.timeline import (
+    KEYFRAME_INTERVAL_SECS,
+    ChannelState,
+    Timeline,
+    compile_timeline,
+)
+
+
+def make_timeline() -> Timeline:
+    """About four keyframes' worth of notes, program changes and controllers."""
+    track = mido.MidiTrack()
+    for n in range(80):
+        channel = n % 3
+        track.append(mido.Message("program_change", channel=channel, program=n, time=0))
+        track.append(
+            mido.Message("control_change", channel=channel, control=7, value=n, time=0)
+        )
+        track.append(
+            mido.Message(
+                "note_on", channel=channel, note=40 + n, velocity=100, time=240
+            )
+        )
+        # Leave every fourth note sounding
+        if n % 4:
+            track.append(
+                mido.Message("note_off", channel=channel, note=40 + n, time=240)
+            )
+    midi_file = mido.MidiFile()
+    midi_file.tracks.append(track)
+    return compile_timeline(midi_file)
+
+
+def replayed_state(timeline: Timeline, stop: int) -> ChannelState:
+    """The state after every event before `stop`, replayed from the start."""
+    state = ChannelState()
+    for i in range(stop):
+        state.apply(
+            timeline.statuses[i],
+            timeline.channels[i],
+            timeline.data1[i],
+            timeline.data2[i],
+        )
+    return state
+
+
+class SeekTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.timeline = make_timeline()
+
+    def test_has_keyframes(self) -> None:
+        self.assertGreater(len(self.timeline.keyframes), 3)
+
+    def test_matches_replaying_from_start(self) -> None:
+        timeline = self.timeline
+        times = [
+            0.0,
+            0.3,
+            KEYFRAME_INTERVAL_SECS,
+            KEYFRAME_INTERVAL_SECS + 0.01,
+            2.5 * KEYFRAME_INTERVAL_SECS,
+            timeline.times[len(timeline) // 2],
+            timeline.length_secs,
+        ]
+        for start_secs in times:
+            with self.subTest(start_secs=start_secs):
+                point = timeline.seek(start_secs)
+                # The first event at or after `start_secs`
+                self.assertTrue(
+                    point.event_index == len(timeline)
+                    or timeline.times[point.event_index] >= start_secs
+                )
+                self.assertTrue(
+                    point.event_index == 0
+                    or timeline.times[point.event_index - 1] < start_secs
+                )
+                self.assertEqual(
+                    point.state.to_bytes(),
+                    replayed_state(timeline, point.event_index).to_bytes(),
+                )
+
+    def test_clamps_before_start(self) -> None:
+        point = self.timeline.seek(-1)
+        self.assertEqual(point.event_index, 0)
+        self.assertEqual(point.state.to_bytes(), ChannelState().to_bytes())
+
+    def test_clamps_after_end(self) -> None:
+        timeline = self.timeline
+        self.assertEqual(
+            timeline.seek(timeline.length_secs + 100).event_index,
+            timeline.seek(timeline.length_secs).event_index,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
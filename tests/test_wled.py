@@ -0,0 +1,71 @@
+import time
+import unittest
+from typing import Any
+
+import requests
+
+from midivis.wled import (
+    Encoding,
+    WLEDClient,
+    encode_ranged,
+    encode_sparse,
+    leds_changed_state,
+    payload_size,
+    smallest_encoding,
+)
+
+NUM_LEDS = 16
+
+
+class FakeResponse:
+    def raise_for_status(self) -> None:
+        pass
+
+
+class WLEDClientTest(unittest.TestCase):
+    def test_sends_full_frame_after_failed_request(self) -> None:
+        posted: list[dict[str, Any]] = []
+
+        def post(url: str, json: dict[str, Any], timeout: float) -> FakeResponse:
+            if not posted:
+                posted.append({})
+                raise requests.ConnectionError("unreachable")
+            posted.append(json)
+            return FakeResponse()
+
+        first = bytes(range(NUM_LEDS * 3))
+        second = bytearray(first)
+        second[0:3] = b"\xff\xff\xff"
+
+        client = WLEDClient(host="wled.invalid")
+        client._session.post = post  # type: ignore[method-assign,assignment]
+        with client:
+            client.submit_frame(first, {0, 1, 2})
+            deadline = time.monotonic() + 5
+            while client.stats.failed == 0 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(client.stats.failed, 1)
+
+            client.submit_frame(second, {0})
+
+        self.assertEqual(len(posted), 2)
+        self.assertEqual(posted[1], leds_changed_state(second, None))
+        self.assertNotEqual(posted[1], leds_changed_state(second, {0}))
+
+
+class SmallestEncodingTest(unittest.TestCase):
+    def test_equal_sizes(self) -> None:
+        buffer = bytes.fromhex("000000010203010203")
+        changed = {1, 2}
+        self.assertEqual(
+            payload_size(encode_ranged(buffer)),
+            payload_size(encode_sparse(buffer, changed)),
+        )
+
+        encoding, payload = smallest_encoding(buffer, changed)
+        self.assertEqual(encoding, Encoding.RANGED)
+        self.assertEqual(payload, encode_ranged(buffer))
+
+
+if __name__ == "__main__":
+    unittest.main()
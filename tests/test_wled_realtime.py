@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from midivis.outputs import WLEDOutput
+from midivis.wled_realtime import (
+    DNRGB_MAX_LEDS,
+    DRGB_MAX_LEDS,
+    KEEPALIVE_SECS,
+    REALTIME_TIMEOUT_SECS,
+    WLEDProtocol,
+    WLEDRealtimeClient,
+)
+
+NUM_LEDS = DNRGB_MAX_LEDS * 3
+
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent: list[bytes] = []
+
+    def sendto(self, packet: bytes, address: tuple[str, int]) -> None:
+        self.sent.append(packet)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class WLEDRealtimeClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.socket = FakeSocket()
+        # Not entered, so the keepalive thread doesn't run
+        self.client = WLEDRealtimeClient(
+            WLEDProtocol.DNRGB, host="wled.invalid", clock=self.clock
+        )
+        self.client._socket.close()
+        self.client._socket = self.socket  # type: ignore[assignment]
+        self.frame = bytes(NUM_LEDS * 3)
+
+    def tearDown(self) -> None:
+        self.client.close()
+
+    def test_sends_only_changed_chunks(self) -> None:
+        self.client.submit_frame(self.frame)
+        self.assertEqual(len(self.socket.sent), 3)
+
+        self.clock.now += KEEPALIVE_SECS / 2
+        self.client.submit_frame(self.frame, {0})
+        self.assertEqual(len(self.socket.sent), 4)
+
+    def test_keeps_alive_with_full_frame(self) -> None:
+        self.client.submit_frame(self.frame)
+        self.client.keep_alive()
+        self.assertEqual(len(self.socket.sent), 3)
+
+        self.clock.now += REALTIME_TIMEOUT_SECS + 1
+        self.socket.sent.clear()
+        self.client.keep_alive()
+        self.assertEqual(len(self.socket.sent), 3)
+
+    def test_sends_full_frame_after_quiet_passage(self) -> None:
+        self.client.submit_frame(self.frame)
+
+        self.clock.now += REALTIME_TIMEOUT_SECS + 1
+        self.socket.sent.clear()
+        self.client.submit_frame(self.frame, {0})
+        self.assertEqual(len(self.socket.sent), 3)
+
+
+class DRGBLimitTest(unittest.TestCase):
+    def test_oversized_frame_is_not_kept_alive(self) -> None:
+        socket = FakeSocket()
+        clock = FakeClock()
+        client = WLEDRealtimeClient(WLEDProtocol.DRGB, host="wled.invalid", clock=clock)
+        client._socket.close()
+        client._socket = socket  # type: ignore[assignment]
+
+        with self.assertRaises(ValueError):
+            client.submit_frame(bytes((DRGB_MAX_LEDS + 1) * 3))
+        clock.now += REALTIME_TIMEOUT_SECS + 1
+        client.keep_alive()
+        self.assertEqual(socket.sent, [])
+        client.close()
+
+    def test_output_closes_client_when_open_fails(self) -> None:
+        output = WLEDOutput(
+            "title", None, protocol=WLEDProtocol.DRGB, host="wled.invalid"
+        )
+        with self.assertRaises(ValueError):
+            asyncio.run(output.open())
+        self.assertFalse(output._client._thread.is_alive())  # type: ignore[union-attr]
+        self.assertEqual(output._client._socket.fileno(), -1)  # type: ignore[union-attr]
+
+
+if __name__ == "__main__":
+    unittest.main()